@@ -0,0 +1,68 @@
+import logging
+import threading
+import time
+
+# --------------------------
+# ESTADO DE ARRANQUE
+# --------------------------
+# El modelo se carga y calienta en segundo plano; la interfaz (menú de la CLI o
+# carga.html vía /api/estado) no espera. Estados:
+#   loading  -> se pide al servidor que cargue y fije el modelo en memoria
+#   warming  -> llamadas cortas de calentamiento
+#   ready    -> listo (también si el calentamiento falló: las llamadas lo reintentarán)
+# Solo una llamada interactiva que llegue antes de "ready" espera a que termine.
+
+ESTADOS = ("loading", "warming", "ready")
+
+
+class EstadoArranque:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listo = threading.Event()
+        self.estado = "loading"
+        self.detalle = ""
+        self.error = None
+        self.inicio = time.monotonic()
+        self.tiempos = {}           # estado -> segundos desde el inicio al entrar en él
+        self._hilo = None
+
+    def cambiar(self, estado: str, detalle: str = ""):
+        with self.lock:
+            self.estado = estado
+            self.detalle = detalle
+            self.tiempos[estado] = round(time.monotonic() - self.inicio, 3)
+        if estado == "ready":
+            self.listo.set()
+        logging.info(f"🚦 Arranque: {estado}{f' ({detalle})' if detalle else ''}")
+
+    def esperar(self, timeout: float = None) -> bool:
+        """Bloquea hasta 'ready' (o `timeout`). Tras el arranque, o si no se lanzó, no espera."""
+        if self.listo.is_set() or self._hilo is None:
+            return True
+        t0 = time.perf_counter()
+        listo = self.listo.wait(timeout)
+        logging.info(f"⏳ Petición esperó {time.perf_counter() - t0:.2f}s al arranque del modelo")
+        return listo
+
+    def iniciar(self, tarea):
+        """Ejecuta `tarea(self)` en un hilo de fondo una sola vez; siempre termina en 'ready'."""
+        with self.lock:
+            if self._hilo is not None:
+                return
+            self.inicio = time.monotonic()
+            self._hilo = threading.Thread(target=self._ejecutar, args=(tarea,), daemon=True, name="warm-up")
+            self._hilo.start()
+
+    def _ejecutar(self, tarea):
+        try:
+            tarea(self)
+        except Exception as e:
+            self.error = str(e)
+            logging.error(f"❌ Error en el arranque del modelo: {e}")
+        finally:
+            self.cambiar("ready", self.error or "")
+
+    def a_dict(self) -> dict:
+        with self.lock:
+            return {"estado": self.estado, "detalle": self.detalle, "error": self.error,
+                    "segundos": round(time.monotonic() - self.inicio, 1), "tiempos": dict(self.tiempos)}
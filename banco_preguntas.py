@@ -0,0 +1,238 @@
+import sqlite3
+import threading
+import logging
+import hashlib
+import json
+import time
+
+# --------------------------
+# BANCO DE PREGUNTAS (SQLite)
+# --------------------------
+# Guarda preguntas ya parseadas (enunciado, opciones, correcta, justificaciones por
+# opción si las hay) por (tema, avanzado) para servirlas sin llamar al modelo.
+# Cada usuario tiene su registro de vistas,
+# cada tema tiene un tope con desalojo por uso más antiguo y, cuando a un tema le
+# quedan pocas preguntas sin ver, se rellena en segundo plano (un relleno por tema y como
+# mucho `max_rellenos` a la vez en todo el banco).
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS preguntas (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    tema        TEXT NOT NULL,
+    avanzado    INTEGER NOT NULL,
+    enunciado   TEXT NOT NULL,
+    opciones    TEXT NOT NULL,
+    correcta    TEXT NOT NULL,
+    justificaciones TEXT,
+    creado      REAL NOT NULL,
+    ultimo_uso  REAL,
+    usos        INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (tema, avanzado, enunciado)
+);
+CREATE INDEX IF NOT EXISTS idx_preguntas_tema ON preguntas (tema, avanzado);
+CREATE TABLE IF NOT EXISTS vistas (
+    usuario     TEXT NOT NULL,
+    pregunta_id INTEGER NOT NULL REFERENCES preguntas (id) ON DELETE CASCADE,
+    PRIMARY KEY (usuario, pregunta_id)
+);
+CREATE TABLE IF NOT EXISTS explicaciones (
+    pregunta_id INTEGER NOT NULL REFERENCES preguntas (id) ON DELETE CASCADE,
+    clave       TEXT NOT NULL,
+    texto       TEXT NOT NULL,
+    PRIMARY KEY (pregunta_id, clave)
+);
+"""
+
+
+def clave_explicacion(correcta: str, usuario: str, opts: dict) -> str:
+    """La explicación depende de las letras mostradas y del texto de ambas opciones."""
+    base = f"{correcta}|{usuario}|{opts.get(correcta, '')}|{opts.get(usuario, '')}"
+    return hashlib.sha1(base.encode("utf-8")).hexdigest()
+
+
+class BancoPreguntas:
+    def __init__(self, ruta: str, generador=None, max_por_tema: int = 40,
+                 min_disponibles: int = 3, lote_relleno: int = 3, max_rellenos: int = 1):
+        """
+        generador(tema, avanzado) debe devolver (enunciado, opciones, correcta, justificaciones) o None;
+        se usa para el relleno en segundo plano.
+        """
+        self.generador = generador
+        self.max_por_tema = max_por_tema
+        self.min_disponibles = min_disponibles
+        self.lote_relleno = lote_relleno
+        self.max_rellenos = max_rellenos
+        self.lock = threading.Lock()
+        self.rellenando = set()
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(ESQUEMA)
+        columnas = {c[1] for c in self.conn.execute("PRAGMA table_info(preguntas)")}
+        if "justificaciones" not in columnas:
+            # Bancos creados antes de las preguntas estructuradas
+            self.conn.execute("ALTER TABLE preguntas ADD COLUMN justificaciones TEXT")
+        self.conn.commit()
+
+    # ---------- lectura ----------
+    def servir(self, tema: str, avanzado: bool, usuario: str):
+        """
+        Devuelve (enunciado, opciones, correcta, justificaciones) de una pregunta no
+        vista por `usuario` y la marca como vista, o None.
+        """
+        with self.lock:
+            fila = self.conn.execute(
+                "SELECT id, enunciado, opciones, correcta, justificaciones FROM preguntas p "
+                "WHERE tema = ? AND avanzado = ? AND NOT EXISTS ("
+                "  SELECT 1 FROM vistas v WHERE v.usuario = ? AND v.pregunta_id = p.id"
+                ") ORDER BY RANDOM() LIMIT 1",
+                (tema, int(avanzado), usuario),
+            ).fetchone()
+            if fila:
+                self._marcar_vista(usuario, fila[0])
+            restantes = self._no_vistas(tema, avanzado, usuario)
+        if restantes < self.min_disponibles:
+            self.rellenar_async(tema, avanzado)
+        if not fila:
+            return None
+        return fila[1], json.loads(fila[2]), fila[3], json.loads(fila[4]) if fila[4] else None
+
+    def respaldo(self, tema: str, avanzado: bool):
+        """Una pregunta del tema aunque ya se haya visto (la menos usada), sin marcarla; None si no hay."""
+        with self.lock:
+            fila = self.conn.execute(
+                "SELECT enunciado, opciones, correcta, justificaciones FROM preguntas "
+                "WHERE tema = ? AND avanzado = ? ORDER BY usos, RANDOM() LIMIT 1",
+                (tema, int(avanzado)),
+            ).fetchone()
+        if not fila:
+            return None
+        return fila[0], json.loads(fila[1]), fila[2], json.loads(fila[3]) if fila[3] else None
+
+    def explicacion(self, tema: str, avanzado: bool, enunciado: str, clave: str):
+        with self.lock:
+            fila = self.conn.execute(
+                "SELECT e.texto FROM explicaciones e JOIN preguntas p ON p.id = e.pregunta_id "
+                "WHERE p.tema = ? AND p.avanzado = ? AND p.enunciado = ? AND e.clave = ?",
+                (tema, int(avanzado), enunciado, clave),
+            ).fetchone()
+        return fila[0] if fila else None
+
+    def total(self, tema: str, avanzado: bool) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM preguntas WHERE tema = ? AND avanzado = ?",
+                (tema, int(avanzado)),
+            ).fetchone()[0]
+
+    # ---------- escritura ----------
+    def guardar(self, tema: str, avanzado: bool, enunciado: str, opciones: dict, correcta: str,
+                justificaciones: dict = None, usuario: str = None):
+        """Inserta una pregunta (ignora duplicados exactos) y aplica el tope por tema."""
+        if not enunciado or not opciones or correcta not in opciones:
+            return None
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO preguntas (tema, avanzado, enunciado, opciones, correcta, justificaciones, creado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (tema, int(avanzado), enunciado, json.dumps(opciones, ensure_ascii=False), correcta,
+                 json.dumps(justificaciones, ensure_ascii=False) if justificaciones else None, time.time()),
+            )
+            pid = self.conn.execute(
+                "SELECT id FROM preguntas WHERE tema = ? AND avanzado = ? AND enunciado = ?",
+                (tema, int(avanzado), enunciado),
+            ).fetchone()[0]
+            if usuario:
+                self._marcar_vista(usuario, pid)
+            self._desalojar(tema, avanzado)
+            self.conn.commit()
+        return pid
+
+    def devolver(self, tema: str, avanzado: bool, enunciado: str, usuario: str):
+        """Quita la vista de una pregunta servida pero no mostrada (p. ej. precarga descartada)."""
+        with self.lock:
+            fila = self.conn.execute(
+                "SELECT id FROM preguntas WHERE tema = ? AND avanzado = ? AND enunciado = ?",
+                (tema, int(avanzado), enunciado),
+            ).fetchone()
+            if fila:
+                borradas = self.conn.execute(
+                    "DELETE FROM vistas WHERE usuario = ? AND pregunta_id = ?", (usuario, fila[0])
+                ).rowcount
+                if borradas:
+                    self.conn.execute("UPDATE preguntas SET usos = MAX(usos - 1, 0) WHERE id = ?", (fila[0],))
+            self.conn.commit()
+
+    def olvidar_usuario(self, usuario: str) -> int:
+        """Borra las vistas de `usuario` (p. ej. una sesión del servidor que ya se cerró)."""
+        with self.lock:
+            borradas = self.conn.execute("DELETE FROM vistas WHERE usuario = ?", (usuario,)).rowcount
+            self.conn.commit()
+        return borradas
+
+    def olvidar_prefijo(self, prefijo: str) -> int:
+        """Borra las vistas de todos los usuarios que empiezan por `prefijo`."""
+        with self.lock:
+            borradas = self.conn.execute(
+                "DELETE FROM vistas WHERE substr(usuario, 1, ?) = ?", (len(prefijo), prefijo)
+            ).rowcount
+            self.conn.commit()
+        return borradas
+
+    def guardar_explicacion(self, tema: str, avanzado: bool, enunciado: str, clave: str, texto: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO explicaciones (pregunta_id, clave, texto) "
+                "SELECT id, ?, ? FROM preguntas WHERE tema = ? AND avanzado = ? AND enunciado = ?",
+                (clave, texto, tema, int(avanzado), enunciado),
+            )
+            self.conn.commit()
+
+    # ---------- relleno en segundo plano ----------
+    def rellenar_async(self, tema: str, avanzado: bool):
+        if self.generador is None:
+            return
+        clave = (tema, bool(avanzado))
+        with self.lock:
+            # Un tema ya en relleno, o el banco en su tope: el próximo `servir` lo vuelve a pedir
+            if clave in self.rellenando or len(self.rellenando) >= self.max_rellenos:
+                return
+            self.rellenando.add(clave)
+        threading.Thread(target=self._rellenar, args=clave, daemon=True, name="banco-relleno").start()
+
+    def _rellenar(self, tema: str, avanzado: bool):
+        try:
+            for _ in range(self.lote_relleno):
+                if self.total(tema, avanzado) >= self.max_por_tema:
+                    break
+                item = self.generador(tema, avanzado)
+                if item:
+                    self.guardar(tema, avanzado, *item)
+            logging.info(f"📚 Banco rellenado: {tema} ({'avanzado' if avanzado else 'básico'})")
+        except Exception as e:
+            logging.error(f"❌ Error rellenando banco de preguntas: {e}")
+        finally:
+            with self.lock:
+                self.rellenando.discard((tema, bool(avanzado)))
+
+    # ---------- internos (llamar con self.lock tomado) ----------
+    def _marcar_vista(self, usuario: str, pid: int):
+        self.conn.execute("INSERT OR IGNORE INTO vistas (usuario, pregunta_id) VALUES (?, ?)", (usuario, pid))
+        self.conn.execute("UPDATE preguntas SET usos = usos + 1, ultimo_uso = ? WHERE id = ?", (time.time(), pid))
+        self.conn.commit()
+
+    def _no_vistas(self, tema: str, avanzado: bool, usuario: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM preguntas p WHERE tema = ? AND avanzado = ? AND NOT EXISTS ("
+            "  SELECT 1 FROM vistas v WHERE v.usuario = ? AND v.pregunta_id = p.id)",
+            (tema, int(avanzado), usuario),
+        ).fetchone()[0]
+
+    def _desalojar(self, tema: str, avanzado: bool):
+        # Se eliminan primero las preguntas usadas hace más tiempo
+        self.conn.execute(
+            "DELETE FROM preguntas WHERE id IN ("
+            "  SELECT id FROM preguntas WHERE tema = ? AND avanzado = ? "
+            "  ORDER BY COALESCE(ultimo_uso, creado) DESC LIMIT -1 OFFSET ?)",
+            (tema, int(avanzado), self.max_por_tema),
+        )
@@ -0,0 +1,214 @@
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import metricas_llm
+from mock_ollama import ServidorMock
+
+# --------------------------
+# BENCHMARK DE LOS MODOS CONTRA EL MOCK DE OLLAMA
+# --------------------------
+# Levanta mock_ollama en un hilo, apunta el chatbot a él y ejecuta cada modo sin
+# interacción: input() se sustituye por un guion de respuestas por hilo. La latencia
+# de un "paso" es el tiempo entre una respuesta del estudiante y la siguiente vez
+# que el programa le pide algo (lo que el estudiante espera). El informe es JSON
+# para poder comparar ejecuciones.
+#
+#   python benchmark.py --repeticiones 3 --sesiones 8 --salida bench.json
+
+GUIONES = {
+    "chat": (["¿Qué es un SGSI?", "¿Qué controles tiene el anexo A de ISO 27001?",
+              "¿Cómo se evalúa un riesgo según ISO 27005?", "¿y cómo se documenta eso?",
+              "¿Qué es un SGSI?", "salir"], 5),
+    "quiz_basico": (["1", "A", "sí", "B", "sí", "C", "no", "salir"], 3),
+    "quiz_avanzado": (["3", "A", "sí", "B", "sí", "C", "no", "salir"], 3),
+    "examen": (["A", "B", "C", "A", "B", "C", "A", "B"], 8),
+    "caso": (["Aislaría el equipo y avisaría al responsable de seguridad.", "sí",
+              "Restauraría desde el último respaldo y revisaría accesos.", "no"], 2),
+}
+
+
+class FinGuion(Exception):
+    pass
+
+
+class EntradaGuionada:
+    """Reemplazo de input() con un guion por hilo que mide el tiempo entre respuestas."""
+
+    def __init__(self, pensar: float = 0.0):
+        self.local = threading.local()
+        self.pensar = pensar
+
+    def preparar(self, respuestas):
+        self.local.respuestas = list(respuestas)
+        self.local.pasos = []
+        self.local.ultima = time.perf_counter()
+
+    def __call__(self, prompt=""):
+        ahora = time.perf_counter()
+        self.local.pasos.append(ahora - self.local.ultima)
+        if not self.local.respuestas:
+            raise FinGuion()
+        respuesta = self.local.respuestas.pop(0)
+        # Tiempo de lectura del estudiante: no cuenta como espera
+        time.sleep(self.pensar)
+        self.local.ultima = time.perf_counter()
+        return respuesta
+
+    def pasos(self):
+        # El primer paso mide el arranque del modo hasta la primera pregunta
+        return list(self.local.pasos)
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    datos = sorted(valores)
+    return datos[min(len(datos) - 1, int(len(datos) * p))]
+
+
+def resumen(valores):
+    return {"n": len(valores), "p50": round(percentil(valores, 0.5), 4), "p95": round(percentil(valores, 0.95), 4),
+            "max": round(max(valores), 4) if valores else 0.0, "media": round(sum(valores) / len(valores), 4) if valores else 0.0}
+
+
+def ejecutar_modo(chatbot, entrada, modo: str, precarga: int):
+    respuestas, items = GUIONES[modo]
+    entrada.preparar(respuestas)
+    funciones = {
+        "chat": chatbot.modo_chat_libre,
+        "quiz_basico": lambda: chatbot.modo_estandares(basico=True),
+        "quiz_avanzado": lambda: chatbot.modo_estandares(basico=False),
+        "examen": lambda: chatbot.modo_examen_rapido(precarga=precarga),
+        "caso": chatbot.modo_caso_practico,
+    }
+    t0 = time.perf_counter()
+    try:
+        with metricas_llm.modo(modo):
+            funciones[modo]()
+    except FinGuion:
+        pass
+    return time.perf_counter() - t0, entrada.pasos(), items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los modos del chatbot contra un mock de Ollama")
+    parser.add_argument("--modos", default=",".join(GUIONES), help="lista separada por comas")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--sesiones", type=int, default=4, help="sesiones concurrentes para el throughput")
+    parser.add_argument("--modo-concurrente", default="examen")
+    parser.add_argument("--precarga", type=int, default=2)
+    parser.add_argument("--pensar", type=float, default=0.0, help="segundos que 'piensa' el estudiante por respuesta")
+    parser.add_argument("--prompt-tps", type=float, default=400.0)
+    parser.add_argument("--gen-tps", type=float, default=40.0)
+    parser.add_argument("--latencia-base", type=float, default=0.05)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--tasa-cuelgue", type=float, default=0.0)
+    parser.add_argument("--relleno", action="store_true", help="permitir el relleno del banco en segundo plano")
+    parser.add_argument("--salida", help="fichero JSON del informe (por defecto stdout)")
+    args = parser.parse_args()
+
+    mock = ServidorMock(prompt_tps=args.prompt_tps, gen_tps=args.gen_tps, latencia_base=args.latencia_base,
+                        tasa_error=args.tasa_error, tasa_cuelgue=args.tasa_cuelgue, duracion_cuelgue=5.0).iniciar()
+    directorio = tempfile.mkdtemp(prefix="sgsi-bench-")
+    os.environ["SGSI_LLM_BACKENDS"] = mock.url
+    os.environ["SGSI_BANCO"] = os.path.join(directorio, "banco.db")
+    import chatbot
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.relleno:
+        chatbot.BANCO_MIN_DISPONIBLES = 0
+    chatbot.METRICAS_SALIDA = ""  # las métricas por llamada van en el informe
+    entrada = EntradaGuionada(args.pensar)
+    builtins.input = entrada
+
+    def llamadas():
+        with mock.lock:
+            return mock.stats["peticiones"]
+
+    informe = {
+        "config": {k: v for k, v in vars(args).items() if k != "salida"},
+        "modos": {},
+        "concurrencia": {},
+    }
+    silencio = io.StringIO()
+    for modo in [m.strip() for m in args.modos.split(",") if m.strip()]:
+        totales, pasos, llamadas_por_item = [], [], []
+        for _ in range(args.repeticiones):
+            antes = llamadas()
+            with contextlib.redirect_stdout(silencio):
+                total, p, items = ejecutar_modo(chatbot, entrada, modo, args.precarga)
+            time.sleep(0.05)
+            totales.append(total)
+            pasos.extend(p)
+            llamadas_por_item.append((llamadas() - antes) / items)
+            silencio.seek(0)
+            silencio.truncate()
+        informe["modos"][modo] = {
+            "total_s": resumen(totales),
+            "paso_s": resumen(pasos),
+            "llamadas_llm_por_item": round(sum(llamadas_por_item) / len(llamadas_por_item), 3),
+        }
+        print(f"📊 {modo:14s} paso p50={informe['modos'][modo]['paso_s']['p50']:.3f}s "
+              f"p95={informe['modos'][modo]['paso_s']['p95']:.3f}s "
+              f"llamadas/item={informe['modos'][modo]['llamadas_llm_por_item']}", file=sys.stderr)
+
+    # Throughput con varias sesiones simultáneas del mismo modo
+    resultados = []
+    errores = []
+
+    def sesion():
+        try:
+            resultados.append(ejecutar_modo(chatbot, entrada, args.modo_concurrente, args.precarga))
+        except Exception as e:
+            errores.append(repr(e))
+
+    antes = llamadas()
+    t0 = time.perf_counter()
+    hilos = [threading.Thread(target=sesion) for _ in range(args.sesiones)]
+    with contextlib.redirect_stdout(silencio):
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+    duracion = time.perf_counter() - t0
+    items = sum(r[2] for r in resultados)
+    informe["concurrencia"] = {
+        "modo": args.modo_concurrente,
+        "sesiones": args.sesiones,
+        "duracion_s": round(duracion, 3),
+        "items_por_s": round(items / duracion, 3) if duracion else 0.0,
+        "paso_s": resumen([p for r in resultados for p in r[1]]),
+        "llamadas_llm": llamadas() - antes,
+        "errores": errores,
+    }
+    print(f"🚀 {args.sesiones} sesiones de {args.modo_concurrente}: {informe['concurrencia']['items_por_s']} items/s",
+          file=sys.stderr)
+    informe["mock"] = dict(mock.stats)
+    informe["planificador"] = chatbot.PLANIFICADOR.metricas()
+    informe["circuito"] = chatbot.CIRCUITO.a_dict()
+    informe["perfiles"] = chatbot.PERFILES.a_dict()
+    informe["rutas"] = chatbot.RUTAS.a_dict()
+    informe["cache_respuestas"] = chatbot.CACHE_RESPUESTAS.metricas()
+    informe["llamadas_llm"] = chatbot.METRICAS.a_json()["llamadas"]
+    indice = chatbot.obtener_indice_iso()
+    informe["indice_iso"] = indice.metricas() if indice else None
+    mock.detener()
+
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from clasificador_sgsi import normalizar
+
+# --------------------------
+# CACHÉ DE RESPUESTAS (chat libre)
+# --------------------------
+# Clave exacta = pregunta normalizada (sin tildes, mayúsculas ni puntuación, SGSIA -> SGSI).
+# Para preguntas casi iguales se usa un índice MinHash sobre 3-gramas de caracteres con
+# LSH por bandas; los candidatos se confirman con la similitud de Jaccard real y, además,
+# deben citar los mismos números (norma, control, cláusula): "ISO 27001" y "ISO 27005"
+# se parecen mucho como texto pero son preguntas distintas.
+# Desalojo LRU con TTL y tope de memoria estimada.
+
+NUM_PERMUTACIONES = 64
+BANDAS = 16
+FILAS = NUM_PERMUTACIONES // BANDAS
+_PRIMO = (1 << 61) - 1
+_COEFS = [((i * 0x9E3779B1 + 1) % _PRIMO, (i * 0x85EBCA77 + 7) % _PRIMO) for i in range(NUM_PERMUTACIONES)]
+
+
+def normalizar_pregunta(texto: str) -> str:
+    texto = normalizar(texto)
+    texto = re.sub(r"\bsgsia?\b", "sgsi", texto)
+    return " ".join(texto.split())
+
+
+def numeros(texto: str) -> tuple:
+    """Números y códigos de la pregunta en orden (27001, 5.1, 8.12...)."""
+    return tuple(re.findall(r"\d+(?:\.\d+)*", texto))
+
+
+def shingles(texto: str, n: int = 3) -> frozenset:
+    texto = f" {texto} "
+    return frozenset(texto[i:i + n] for i in range(max(1, len(texto) - n + 1)))
+
+
+def minhash(conjunto) -> tuple:
+    bases = [zlib.crc32(s.encode("utf-8")) for s in conjunto]
+    return tuple(min((a * b + c) % _PRIMO for b in bases) for a, c in _COEFS)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class _Entrada:
+    __slots__ = ("clave", "respuesta", "numeros", "shingles", "firma", "expira", "bytes")
+
+    def __init__(self, clave, respuesta, nums, conjunto, firma, expira):
+        self.clave = clave
+        self.respuesta = respuesta
+        self.numeros = nums
+        self.shingles = conjunto
+        self.firma = firma
+        self.expira = expira
+        self.bytes = sys.getsizeof(respuesta) + sys.getsizeof(clave) + 60 * len(conjunto)
+
+
+class CacheRespuestas:
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024, ttl: float = 24 * 3600, umbral: float = 0.8):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.umbral = umbral
+        self.entradas = OrderedDict()           # clave normalizada -> _Entrada (orden LRU)
+        self.bandas = [dict() for _ in range(BANDAS)]
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits_exactos": 0, "hits_similares": 0, "misses": 0, "desalojos": 0}
+
+    def _bandas(self, firma):
+        return [firma[i * FILAS:(i + 1) * FILAS] for i in range(BANDAS)]
+
+    def _quitar(self, clave):
+        entrada = self.entradas.pop(clave)
+        self.bytes -= entrada.bytes
+        for indice, banda in zip(self.bandas, self._bandas(entrada.firma)):
+            claves = indice.get(banda)
+            if claves:
+                claves.discard(clave)
+                if not claves:
+                    del indice[banda]
+
+    def buscar(self, pregunta: str, umbral: float = None):
+        """Devuelve la respuesta cacheada para la pregunta (o una casi igual), o None. `umbral` sustituye al general."""
+        clave = normalizar_pregunta(pregunta)
+        ahora = time.time()
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada and entrada.expira < ahora:
+                self._quitar(clave)
+                entrada = None
+            if entrada:
+                self.entradas.move_to_end(clave)
+                self.stats["hits_exactos"] += 1
+                return entrada.respuesta
+            nums = numeros(pregunta)
+            conjunto = shingles(clave)
+            candidatos = set()
+            for indice, banda in zip(self.bandas, self._bandas(minhash(conjunto))):
+                candidatos |= indice.get(banda, set())
+            mejor, mejor_sim = None, self.umbral if umbral is None else umbral
+            for c in candidatos:
+                e = self.entradas[c]
+                if e.expira < ahora or e.numeros != nums:
+                    continue
+                sim = jaccard(conjunto, e.shingles)
+                if sim >= mejor_sim:
+                    mejor, mejor_sim = e, sim
+            if mejor:
+                self.entradas.move_to_end(mejor.clave)
+                self.stats["hits_similares"] += 1
+                return mejor.respuesta
+            self.stats["misses"] += 1
+            return None
+
+    def guardar(self, pregunta: str, respuesta: str):
+        clave = normalizar_pregunta(pregunta)
+        if not clave:
+            return
+        conjunto = shingles(clave)
+        entrada = _Entrada(clave, respuesta, numeros(pregunta), conjunto, minhash(conjunto), time.time() + self.ttl)
+        with self.lock:
+            if clave in self.entradas:
+                self._quitar(clave)
+            self.entradas[clave] = entrada
+            self.bytes += entrada.bytes
+            for indice, banda in zip(self.bandas, self._bandas(entrada.firma)):
+                indice.setdefault(banda, set()).add(clave)
+            while self.bytes > self.max_bytes and len(self.entradas) > 1:
+                self._quitar(next(iter(self.entradas)))
+                self.stats["desalojos"] += 1
+
+    def limpiar(self):
+        with self.lock:
+            self.entradas.clear()
+            self.bandas = [dict() for _ in range(BANDAS)]
+            self.bytes = 0
+
+    def metricas(self) -> dict:
+        with self.lock:
+            consultas = self.stats["hits_exactos"] + self.stats["hits_similares"] + self.stats["misses"]
+            aciertos = self.stats["hits_exactos"] + self.stats["hits_similares"]
+            return {**self.stats, "entradas": len(self.entradas), "bytes": self.bytes,
+                    "tasa_aciertos": aciertos / consultas if consultas else 0.0}
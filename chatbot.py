@@ -1,51 +1,414 @@
-import requests
+import atexit
+import contextvars
 import logging
 import re
 import random
 import time
 import json
 import os
-import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from banco_preguntas import BancoPreguntas, clave_explicacion
+from clasificador_sgsi import ClasificadorSGSI
+from historial_chat import HistorialChat
+from cache_respuestas import CacheRespuestas
+from duplicados import IndiceSimilitud, RotacionTemas
+import planificador_llm
+from planificador_llm import PlanificadorLLM
+from pool_llm import PoolLLM, parsear_backends
+from arranque import EstadoArranque
+from perfiles_llm import PerfilGeneracion, PerfilesLLM
+from rutas_llm import EnrutadorModelos
+from resiliencia_llm import (CircuitoLLM, ErrorConexionLLM, ErrorLLM, ErrorRespuestaLLM, Plazo, PlazoAgotado,
+                             espera_reintento)
+import indice_iso
+import metricas_llm
+from metricas_llm import MetricasLLM
 
 # --------------------------
 # CONFIG
 # --------------------------
 MODELO = "gemma3:4b-it-qat"  # tu modelo local Ollama
+# Modelo pequeño para las llamadas triviales (filtro Sí/No, generación de preguntas); "" = todo a MODELO.
+# Si su salida no pasa el validador del perfil, la llamada se escala a MODELO
+MODELO_PEQUENO = os.environ.get("SGSI_MODELO_PEQUENO", "gemma3:1b-it-qat")
+RUTAS_PEQUENO = [s.strip() for s in os.environ.get("SGSI_RUTAS_PEQUENO", "filtro,pregunta_json,pregunta_texto").split(",")
+                 if s.strip()]
 URL_API = "http://localhost:11434/v1/chat/completions"
-SESSION = requests.Session()
+
+# Backends OpenAI-compatibles: "url1,url2|modelo2" (por defecto solo URL_API)
+LLM_BACKENDS = os.environ.get("SGSI_LLM_BACKENDS", URL_API)
+LLM_POLITICA = os.environ.get("SGSI_LLM_POLITICA", "menos_pendientes")  # o "latencia"
+POOL = PoolLLM(parsear_backends(LLM_BACKENDS), politica=LLM_POLITICA)
+
+# Máximo de generaciones simultáneas por backend (ajustar a OLLAMA_NUM_PARALLEL)
+LLM_MAX_EN_VUELO = int(os.environ.get("SGSI_LLM_MAX_EN_VUELO", "2"))
+PLANIFICADOR = PlanificadorLLM(max_en_vuelo=LLM_MAX_EN_VUELO * len(POOL.backends))
+
+# Fallos: reintentos (con jitter) ante errores transitorios dentro del plazo de cada llamada, y
+# cortocircuito tras varios fallos seguidos para responder al instante con el respaldo de cada modo
+LLM_REINTENTOS = int(os.environ.get("SGSI_LLM_REINTENTOS", "2"))
+CIRCUITO = CircuitoLLM(umbral=int(os.environ.get("SGSI_LLM_UMBRAL_CIRCUITO", "5")),
+                       enfriamiento=float(os.environ.get("SGSI_LLM_ENFRIAMIENTO", "15")))
+
+# Arranque: el modelo se carga, se fija en memoria (keep_alive de Ollama) y se calienta
+# en segundo plano; solo espera la primera llamada que llegue antes de terminar
+def _leer_keep_alive(valor: str):
+    return int(valor) if valor.lstrip("-").isdigit() else valor
+
+LLM_KEEP_ALIVE = _leer_keep_alive(os.environ.get("SGSI_LLM_KEEP_ALIVE", "-1"))  # -1 = residente siempre; o p. ej. "30m"
+LLM_KEEP_ALIVE_PEQUENO = _leer_keep_alive(os.environ.get("SGSI_LLM_KEEP_ALIVE_PEQUENO", "-1"))
+ARRANQUE = EstadoArranque()
+RUTAS = EnrutadorModelos(MODELO, MODELO_PEQUENO, RUTAS_PEQUENO, keep_alive=LLM_KEEP_ALIVE,
+                         keep_alive_pequeno=LLM_KEEP_ALIVE_PEQUENO)
+
+# Examen rápido: preguntas generadas por adelantado y tamaño del pool de hilos
+EXAMEN_PRECARGA = 2
+EXAMEN_MAX_WORKERS = 2
+
+# Banco de preguntas en disco (por tema/nivel) y usuario para el registro de vistas
+BANCO_RUTA = os.environ.get("SGSI_BANCO", "banco_preguntas.db")
+BANCO_MAX_POR_TEMA = 40
+BANCO_MIN_DISPONIBLES = 3
+USUARIO = os.environ.get("SGSI_USUARIO", "local")
+
+# Similitud (Jaccard de 3-gramas) a partir de la cual una pregunta/escenario cuenta como repetido,
+# e intentos de generación antes de aceptar uno repetido o usar el de respaldo
+UMBRAL_DUPLICADO_PREGUNTA = 0.55
+UMBRAL_DUPLICADO_ESCENARIO = 0.5
+MAX_INTENTOS_DUPLICADO = 3
+
+# Preguntas en JSON (pregunta + justificaciones en una sola llamada); False = formato de texto clásico
+PREGUNTAS_ESTRUCTURADAS = True
+
+# Índice local de controles ISO (BM25): los k más relevantes se añaden a los prompts (0 = sin referencias);
+# se descartan los que puntúan por debajo de esa fracción del mejor
+INDICE_ISO_RUTA = os.environ.get("SGSI_INDICE_ISO", indice_iso.RUTA_INDICE)
+REFERENCIAS_K = int(os.environ.get("SGSI_REFERENCIAS_K", "3"))
+REFERENCIAS_RELATIVO = 0.5
+
+# Métricas por llamada al modelo: JSON al salir (vacío = no guardar) y perfilado opcional de los modos
+METRICAS = MetricasLLM()
+METRICAS_SALIDA = os.environ.get("SGSI_METRICAS_JSON", "metricas_llm.json")
+PERFIL_DIR = os.environ.get("SGSI_PERFIL")  # directorio donde guardar perfiles por muestreo de cada modo
+atexit.register(lambda: METRICAS.volcar(METRICAS_SALIDA))
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
+# --------------------------
+# PERFILES DE GENERACIÓN
+# --------------------------
+# Por sitio (ver perfiles_llm): tope de tokens, temperatura, secuencias de parada y validador
+# de la salida. En los adaptativos el max_tokens enviado sigue a las longitudes observadas.
+# Los validadores van en lambdas porque los parsers se definen más abajo.
+def _frase_completa(texto: str) -> bool:
+    return texto.rstrip().rstrip("*_\"'»").endswith((".", "!", "?", "…", ")"))
+
+PERFILES = PerfilesLLM({
+    "filtro": PerfilGeneracion(4, temperature=0.0, stop=("\n", ".", ","), adaptativo=False,
+                               validador=lambda t: re.search(r"\b(s[ií]|no)\b", t.lower())),
+    "pregunta_json": PerfilGeneracion(360, temperature=0.18, minimo=120, validador=lambda t: validar_pregunta_json(t)),
+    # Tras la opción C solo interesa una posible línea con la respuesta correcta
+    "pregunta_texto": PerfilGeneracion(240, temperature=0.18, minimo=60, stop=("\nD)", "\nExplicación", "\nJustificación"),
+                                       validador=lambda t: len(parse_question_block(t)[1]) == 3),
+    "explicacion": PerfilGeneracion(120, temperature=0.18, minimo=40, validador=_frase_completa),
+    "escenario": PerfilGeneracion(200, temperature=0.2, minimo=60, stop=("\nPreguntas", "\n**Preguntas", "\nAcciones"),
+                                  validador=lambda t: len(t.split()) >= 15 and _frase_completa(t)),
+    "evaluacion": PerfilGeneracion(140, temperature=0.2, minimo=40,
+                                   validador=lambda t: parsear_veredicto(t) is not None and _frase_completa(t)),
+    "chat": PerfilGeneracion(320, temperature=0.3, adaptativo=False),
+    "warmup": PerfilGeneracion(20, adaptativo=False),
+})
+
 # --------------------------
 # UTIL: llamada al modelo
 # --------------------------
-def generar_respuesta(prompt: str, max_tokens: int = 250, temperature: float = 0.25, timeout: int = 60) -> str:
+# `prioridad` es una clase de planificador_llm.PRIORIDADES ('interactivo', 'explicacion',
+# 'fondo', 'relleno'); si no se indica se usa la fijada con planificador_llm.prioridad(...) en el hilo.
+# Con `hedge=True` la llamada se duplica a un segundo backend si tarda más que el p95 de su
+# sitio; la copia no ocupa otro turno del planificador (ver pool_llm).
+# `sitio` etiqueta la llamada en METRICAS (junto con el modo fijado con metricas_llm.modo).
+# `timeout` es el plazo total (arranque + cola + envío + reintentos). Si la llamada falla se
+# lanza ErrorLLM (ver resiliencia_llm) y el llamador usa su respaldo.
+# `max_tokens` y `temperature` salen del perfil del sitio (PERFILES) salvo que se indiquen, y el
+# modelo de su ruta (RUTAS) salvo que se fije con `modelo`.
+def generar_respuesta(prompt: str, max_tokens: int = None, temperature: float = None, timeout: int = 60,
+                      formato_json: bool = False, prioridad: str = None, hedge: bool = False,
+                      sitio: str = "otro", modelo: str = None) -> str:
+    return generar_respuesta_mensajes(
+        [{"role": "user", "content": prompt}], max_tokens=max_tokens, temperature=temperature, timeout=timeout,
+        formato_json=formato_json, prioridad=prioridad, hedge=hedge, sitio=sitio, modelo=modelo
+    )
+
+def generar_respuesta_mensajes(mensajes: list, max_tokens: int = None, temperature: float = None, timeout: int = 60,
+                               formato_json: bool = False, prioridad: str = None, hedge: bool = False,
+                               sitio: str = "otro", modelo: str = None) -> str:
+    """Igual que generar_respuesta pero recibe la lista de mensajes (system/user/assistant)."""
+    perfil = PERFILES.perfil(sitio)
+    tope = max_tokens or perfil.max_tokens
+    payload = _payload(mensajes, modelo or RUTAS.modelo(sitio), perfil, max_tokens or PERFILES.presupuesto(sitio),
+                       perfil.temperature if temperature is None else temperature)
+    if formato_json:
+        payload["response_format"] = {"type": "json_object"}
+    plazo = Plazo(timeout)
+    t0 = time.perf_counter()
+    espera, uso, intentos, error = 0.0, None, 0, False
+    try:
+        CIRCUITO.comprobar()
+        if sitio != "warmup":
+            ARRANQUE.esperar(plazo.comprobar("arranque"))
+        with PLANIFICADOR.turno(prioridad, timeout=plazo.comprobar("cola")) as espera:
+            escalada = False
+            try:
+                respuesta, truncada, uso, n = _enviar_ruta(payload, plazo, hedge, sitio)
+            except ErrorRespuestaLLM:
+                # El servidor rechaza el modelo pequeño (p. ej. no está instalado): directo al grande
+                if not RUTAS.escalable(payload["model"]):
+                    raise
+                payload["model"], escalada = RUTAS.grande, True
+                respuesta, truncada, uso, n = _enviar_ruta(payload, plazo, hedge, sitio)
+            intentos += n
+            tokens = _tokens(uso)
+            valida = PERFILES.valida(sitio, respuesta)
+            escalar = not valida and RUTAS.escalable(payload["model"])
+            ampliada = truncada and not valida and payload["max_tokens"] < tope
+            if escalar or ampliada:
+                # Segundo intento: con el modelo grande si el pequeño no dio una salida válida y con
+                # el tope si el presupuesto adaptativo se quedó corto. En PERFILES solo cuenta la
+                # salida que se devuelve: la descartada no mueve el presupuesto adaptativo
+                if escalar:
+                    payload["model"], escalada = RUTAS.grande, True
+                if ampliada:
+                    payload["max_tokens"] = tope
+                respuesta, truncada, uso_2, n = _enviar_ruta(payload, plazo, hedge, sitio)
+                intentos += n
+                tokens = _tokens(uso_2)
+                uso = _sumar_uso(uso, uso_2)
+                valida = PERFILES.valida(sitio, respuesta)
+        PERFILES.observar(sitio, tokens, truncada, valida, ampliada)
+        RUTAS.llamada(sitio, escalada)
+        return respuesta.strip().replace("**", "*")
+    except ErrorLLM as e:
+        error = True
+        logging.error(f"❌ Llamada '{sitio}' fallida ({type(e).__name__}): {e}")
+        raise
+    finally:
+        METRICAS.registrar(sitio, time.perf_counter() - t0, espera, uso, max(1, intentos), error)
+
+def _payload(mensajes: list, modelo: str, perfil: PerfilGeneracion, max_tokens: int, temperature: float) -> dict:
     payload = {
-        "model": MODELO,
-        "messages": [{"role": "user", "content": prompt}],
+        "model": modelo,
+        "messages": mensajes,
         "max_tokens": max_tokens,
         "temperature": temperature
     }
+    if perfil.stop:
+        payload["stop"] = perfil.stop
+    return payload
+
+def _enviar(payload: dict, plazo: Plazo, hedge: bool, sitio: str):
+    """POST con reintentos ante fallos transitorios; devuelve (respuesta, intentos)."""
+    intentos = 0
+    for intento in range(LLM_REINTENTOS + 1):
+        prueba = CIRCUITO.permitir()
+        try:
+            resp = POOL.post(payload, timeout=plazo.comprobar("envío"), hedge=hedge, sitio=sitio)
+            intentos += getattr(resp, "intentos", 1)
+            _comprobar_estado(resp)
+            CIRCUITO.exito()
+            return resp, intentos
+        except (requests.RequestException, ErrorConexionLLM) as e:
+            fallo = _error_tipado(e)
+            CIRCUITO.fallo()
+            if not _reintentar(fallo, intento, plazo, sitio):
+                raise fallo from e
+        finally:
+            # Plazo agotado, 4xx o cualquier otra salida: la prueba del semiabierto no se queda tomada
+            CIRCUITO.liberar(prueba)
+
+def _enviar_ruta(payload: dict, plazo: Plazo, hedge: bool, sitio: str):
+    """Envía y lee la respuesta; registra la latencia en la ruta del modelo. (texto, cortada, usage, intentos)."""
+    t0 = time.perf_counter()
+    resp, intentos = _enviar(payload, plazo, hedge, sitio)
+    RUTAS.envio(sitio, payload["model"], time.perf_counter() - t0)
+    return (*_contenido(resp), intentos)
+
+def _contenido(resp):
+    """(texto, cortada por max_tokens, usage) de una respuesta no streaming."""
     try:
-        resp = SESSION.post(URL_API, json=payload, timeout=timeout)
-        resp.raise_for_status()
         data = resp.json()
-        respuesta = data["choices"][0]["message"]["content"].strip()
-        respuesta = respuesta.replace("**", "*")
-        return respuesta
-    except Exception as e:
-        logging.error(f"❌ Error en API HTTP: {e}")
-        return f"❌ Error en API HTTP: {e}"
+        eleccion = data["choices"][0]
+        return eleccion["message"]["content"], eleccion.get("finish_reason") == "length", data.get("usage")
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise ErrorRespuestaLLM(f"respuesta inesperada del modelo: {e}") from e
+
+def _tokens(uso: dict) -> int:
+    return int((uso or {}).get("completion_tokens") or 0)
+
+def _sumar_uso(a: dict, b: dict) -> dict:
+    return {k: int((a or {}).get(k) or 0) + int((b or {}).get(k) or 0)
+            for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+
+def _comprobar_estado(resp):
+    if resp.status_code >= 500:
+        raise ErrorConexionLLM(f"HTTP {resp.status_code} del backend")
+    if resp.status_code >= 400:
+        CIRCUITO.exito()  # el backend responde: no cuenta como caída
+        raise ErrorRespuestaLLM(f"HTTP {resp.status_code}: {resp.text[:200]}")
+
+def _error_tipado(e: Exception) -> ErrorLLM:
+    if isinstance(e, ErrorLLM):
+        return e
+    if isinstance(e, requests.Timeout):
+        return PlazoAgotado(f"el modelo no respondió a tiempo: {e}")
+    return ErrorConexionLLM(str(e))
+
+def _reintentar(fallo: ErrorLLM, intento: int, plazo: Plazo, sitio: str) -> bool:
+    """Espera con jitter y devuelve True si el fallo es transitorio y queda plazo para otro intento."""
+    if not isinstance(fallo, ErrorConexionLLM) or intento >= LLM_REINTENTOS:
+        return False
+    pausa = espera_reintento(intento)
+    if pausa >= plazo.restante():
+        return False
+    logging.warning(f"🔁 Reintento {intento + 1}/{LLM_REINTENTOS} de '{sitio}' en {pausa:.2f}s: {fallo}")
+    time.sleep(pausa)
+    return True
+
+def generar_respuesta_stream(prompt: str, max_tokens: int = None, temperature: float = None, timeout: int = 60,
+                             prioridad: str = None, sitio: str = "otro"):
+    """
+    Variante en streaming de generar_respuesta: consume los chunks SSE del
+    endpoint compatible con OpenAI y va entregando el texto según llega.
+    Aplica la misma limpieza '**' -> '*' aunque los asteriscos lleguen partidos.
+    Si falla lanza ErrorLLM; solo se reintenta si aún no se entregó texto.
+    Usa el tope del perfil (no el presupuesto adaptativo): lo ya mostrado no se puede repetir.
+    """
+    return generar_respuesta_stream_mensajes(
+        [{"role": "user", "content": prompt}], max_tokens=max_tokens, temperature=temperature, timeout=timeout,
+        prioridad=prioridad, sitio=sitio
+    )
+
+def generar_respuesta_stream_mensajes(mensajes: list, max_tokens: int = None, temperature: float = None, timeout: int = 60,
+                                      prioridad: str = None, sitio: str = "otro"):
+    perfil = PERFILES.perfil(sitio)
+    payload = _payload(mensajes, RUTAS.modelo(sitio), perfil, max_tokens or perfil.max_tokens,
+                       perfil.temperature if temperature is None else temperature)
+    payload["stream"] = True
+    # El último chunk trae el campo usage (tokens de prompt y generados)
+    payload["stream_options"] = {"include_usage": True}
+    primero = True
+    pendiente = ""
+    partes, fin = [], None
+    plazo = Plazo(timeout)
+    t0 = time.perf_counter()
+    espera, uso, intentos, error, ttft = 0.0, None, 0, False, None
+    try:
+        CIRCUITO.comprobar()
+        ARRANQUE.esperar(plazo.comprobar("arranque"))
+        # El turno se mantiene mientras dure el stream: es una generación en curso
+        with PLANIFICADOR.turno(prioridad, timeout=plazo.comprobar("cola")) as espera:
+            for intento in range(LLM_REINTENTOS + 1):
+                prueba = CIRCUITO.permitir()
+                try:
+                    with POOL.stream(payload, timeout=plazo.comprobar("envío")) as resp:
+                        intentos += getattr(resp, "intentos", 1)
+                        _comprobar_estado(resp)
+                        resp.encoding = "utf-8"
+                        for linea in resp.iter_lines(decode_unicode=True):
+                            if not linea or not linea.startswith("data:"):
+                                continue
+                            dato = linea[5:].strip()
+                            if dato == "[DONE]":
+                                break
+                            try:
+                                evento = json.loads(dato)
+                            except ValueError as e:
+                                raise ErrorRespuestaLLM(f"chunk inesperado del modelo: {dato[:80]}") from e
+                            uso = evento.get("usage") or uso
+                            choices = evento.get("choices") or [{}]
+                            fin = choices[0].get("finish_reason") or fin
+                            delta = choices[0].get("delta", {}).get("content") or ""
+                            if not delta:
+                                continue
+                            if primero:
+                                primero = False
+                                ttft = time.perf_counter() - t0
+                                delta = delta.lstrip()
+                            texto = (pendiente + delta).replace("**", "*")
+                            # Retener un '*' final por si el siguiente chunk empieza con otro
+                            pendiente = "*" if texto.endswith("*") else ""
+                            if pendiente:
+                                texto = texto[:-1]
+                            if texto:
+                                partes.append(texto)
+                                yield texto
+                    CIRCUITO.exito()
+                    break
+                except (requests.RequestException, ErrorConexionLLM) as e:
+                    fallo = _error_tipado(e)
+                    CIRCUITO.fallo()
+                    # Con texto ya entregado no se puede repetir la generación
+                    if not primero or not _reintentar(fallo, intento, plazo, sitio):
+                        raise fallo from e
+                finally:
+                    # También si el cliente abandona el stream (GeneratorExit) o llega un chunk inválido
+                    CIRCUITO.liberar(prueba)
+        if pendiente:
+            partes.append(pendiente)
+            yield pendiente
+        PERFILES.observar(sitio, _tokens(uso), fin == "length", PERFILES.valida(sitio, "".join(partes)))
+        RUTAS.envio(sitio, payload["model"], time.perf_counter() - t0 - espera)
+        RUTAS.llamada(sitio, False)
+    except ErrorLLM as e:
+        error = True
+        logging.error(f"❌ Llamada '{sitio}' fallida ({type(e).__name__}): {e}")
+        raise
+    finally:
+        METRICAS.registrar(sitio, time.perf_counter() - t0, espera, uso, max(1, intentos), error, ttft)
+
+def imprimir_stream(fragmentos, prefijo: str = "") -> str:
+    """Imprime los fragmentos según llegan y devuelve el texto completo (registra el tiempo al primer token)."""
+    print(prefijo, end="", flush=True)
+    t0 = time.perf_counter()
+    ttft = None
+    partes = []
+    for frag in fragmentos:
+        if ttft is None:
+            ttft = time.perf_counter() - t0
+        partes.append(frag)
+        print(frag, end="", flush=True)
+    print()
+    total = time.perf_counter() - t0
+    logging.info(f"⏱️ Primer token: {ttft if ttft is not None else total:.2f}s · total: {total:.2f}s")
+    return "".join(partes).strip()
 
 # --------------------------
 # WARM-UP
 # --------------------------
-def warm_up_model():
-    logging.info("🔥 Warm-up del modelo (sin caché real)...")
-    generar_respuesta("¿Qué es un SGSI?", max_tokens=20)
-    generar_respuesta("¿Qué es ISO 27001?", max_tokens=20)
-    time.sleep(0.15)
+def warm_up_model(estado: EstadoArranque = ARRANQUE):
+    estado.cambiar("loading", f"cargando {', '.join(RUTAS.modelos())}")
+    fijados = {m: POOL.fijar_modelo(m, keep_alive=RUTAS.keep_alive[m]) for m in RUTAS.modelos()}
+    if RUTAS.pequeno in fijados and not fijados[RUTAS.pequeno] and fijados[MODELO]:
+        RUTAS.desactivar("no se pudo cargar en ningún backend")
+    estado.cambiar("warming", ", ".join(f"{m} residente en {n}/{len(POOL.backends)} backends"
+                                        for m, n in fijados.items()))
+    logging.info("🔥 Warm-up de los modelos (sin caché real)...")
+    for modelo in RUTAS.modelos():
+        try:
+            with metricas_llm.modo("warmup"):
+                generar_respuesta("¿Qué es un SGSI?", prioridad="fondo", sitio="warmup", modelo=modelo)
+                generar_respuesta("¿Qué es ISO 27001?", prioridad="fondo", sitio="warmup", modelo=modelo)
+        except ErrorLLM as e:
+            logging.warning(f"⚠️ Warm-up sin respuesta de {modelo}: {e}")
+        if fijados[modelo]:
+            POOL.mantener_modelo(modelo, keep_alive=RUTAS.keep_alive[modelo])
+
+def iniciar_warm_up():
+    """Lanza el warm-up en segundo plano (una sola vez); ARRANQUE indica el progreso."""
+    ARRANQUE.iniciar(warm_up_model)
 
 # --------------------------
 # PARSER ROBUSTO
@@ -108,10 +471,157 @@ def safe_fallback_question():
         "C) Sistema de Gestión de Servicios"
     )
 
+# --------------------------
+# PREGUNTA ESTRUCTURADA (JSON)
+# --------------------------
+# Una sola llamada devuelve pregunta, opciones, letra correcta y la justificación de
+# cada opción; la explicación queda lista sin segunda llamada al modelo.
+ESQUEMA_PREGUNTA = {
+    "pregunta": str,
+    "opciones": {"A": str, "B": str, "C": str},
+    "correcta": ("A", "B", "C"),
+    "justificacion": {"A": str, "B": str, "C": str},
+}
+
+_justificaciones = OrderedDict()  # enunciado limpio -> {texto de opción: justificación}
+_justificaciones_lock = threading.Lock()
+MAX_JUSTIFICACIONES = 1000
+
+def limpiar_enunciado(q_text: str) -> str:
+    return re.sub(r"^📘\s*Pregunta[:：]?\s*", "", q_text, flags=re.IGNORECASE).strip()
+
+def validar_pregunta_json(salida: str) -> dict:
+    """Parsea y valida la salida JSON contra ESQUEMA_PREGUNTA. Lanza ValueError si no cumple."""
+    m = re.search(r"\{.*\}", salida or "", flags=re.DOTALL)
+    if not m:
+        raise ValueError("la salida no contiene un objeto JSON")
+    data = json.loads(m.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("se esperaba un objeto JSON")
+    for campo, tipo in ESQUEMA_PREGUNTA.items():
+        valor = data.get(campo)
+        if isinstance(tipo, dict):
+            if not isinstance(valor, dict):
+                raise ValueError(f"'{campo}' debe ser un objeto")
+            for letra in tipo:
+                if not isinstance(valor.get(letra), str) or not valor[letra].strip():
+                    raise ValueError(f"falta '{campo}.{letra}'")
+        elif isinstance(tipo, tuple):
+            if str(valor).strip().upper() not in tipo:
+                raise ValueError(f"'{campo}' debe ser una de {tipo}")
+        elif not isinstance(valor, tipo) or not valor.strip():
+            raise ValueError(f"falta '{campo}'")
+    opciones = {k: data["opciones"][k].replace("*", "").strip() for k in "ABC"}
+    if len(set(opciones.values())) < 3:
+        raise ValueError("opciones repetidas")
+    return {
+        "pregunta": limpiar_enunciado(data["pregunta"].strip()),
+        "opciones": opciones,
+        "correcta": str(data["correcta"]).strip().upper(),
+        "justificacion": {k: data["justificacion"][k].strip() for k in "ABC"},
+    }
+
+def registrar_justificaciones(q_text: str, justificaciones: dict):
+    """Guarda {texto de opción: justificación} para explicar la pregunta al instante."""
+    if not justificaciones:
+        return
+    with _justificaciones_lock:
+        _justificaciones[limpiar_enunciado(q_text)] = justificaciones
+        _justificaciones.move_to_end(limpiar_enunciado(q_text))
+        while len(_justificaciones) > MAX_JUSTIFICACIONES:
+            _justificaciones.popitem(last=False)
+
+def justificaciones_de(q_text: str):
+    with _justificaciones_lock:
+        return _justificaciones.get(limpiar_enunciado(q_text))
+
+# --------------------------
+# REFERENCIAS ISO (índice local)
+# --------------------------
+_indice_iso = None
+_indice_iso_lock = threading.Lock()
+
+def obtener_indice_iso():
+    """Índice BM25 de controles ISO (se abre una vez, mapeado en memoria); None si no está disponible."""
+    global _indice_iso
+    with _indice_iso_lock:
+        if _indice_iso is None:
+            try:
+                _indice_iso = indice_iso.abrir(INDICE_ISO_RUTA)
+            except (OSError, ValueError) as e:
+                logging.warning(f"⚠️ Índice ISO no disponible ({e}); los prompts van sin referencias")
+                _indice_iso = False
+        return _indice_iso or None
+
+def referencias_iso(consulta: str, k: int = None) -> str:
+    """Bloque de prompt con los controles ISO más relevantes para la consulta, o '' si no hay."""
+    k = REFERENCIAS_K if k is None else k
+    indice = obtener_indice_iso() if k > 0 else None
+    resultados = indice.buscar(consulta, k, relativo=REFERENCIAS_RELATIVO) if indice else []
+    if not resultados:
+        return ""
+    return f"\nReferencias ISO (úsalas solo si aplican):\n{indice_iso.formatear(resultados)}\n"
+
+def pregunta_con_referencias(pregunta: str, anterior: str = "") -> str:
+    """Turno del usuario con las referencias delante. El historial guarda solo la pregunta."""
+    referencias = referencias_iso(f"{anterior} {pregunta}")
+    return f"{referencias.strip()}\n\nPregunta: {pregunta}" if referencias else pregunta
+
+def instruccion_evitar(evitar: list, etiqueta: str = "preguntas") -> str:
+    """Línea de prompt con textos ya usados que el modelo no debe repetir ni reformular."""
+    if not evitar:
+        return ""
+    lista = "\n".join(f"- {t[:160]}" for t in evitar)
+    return f"\nNo repitas ni reformules estas {etiqueta} ya usadas:\n{lista}\n"
+
+def generar_pregunta_estructurada(topic: str, advanced: bool = False, evitar: list = None):
+    """Devuelve (enunciado, opciones, correcta, justificaciones por texto) o None si la salida no es válida."""
+    adv = "Incluye referencia a ISO/IEC cuando corresponda." if advanced else "Enfócate en ISO 27001."
+    tag = random.randint(1000, 999999)
+    prompt = (
+        "SGSI significa 'Sistema de Gestión de Seguridad de la Información'. "
+        "Genera UNA pregunta breve y precisa de opción múltiple sobre el tema indicado, con tres opciones (A, B, C) "
+        "y una sola correcta.\n"
+        f"{adv}\n\n"
+        f"Tema: {topic}\nID: {tag}\n{instruccion_evitar(evitar)}{referencias_iso(topic)}\n"
+        "Responde SOLO con un objeto JSON con esta forma exacta:\n"
+        '{"pregunta": "<enunciado>", "opciones": {"A": "<texto>", "B": "<texto>", "C": "<texto>"}, '
+        '"correcta": "<A|B|C>", "justificacion": {"A": "<por qué es o no correcta>", "B": "...", "C": "..."}}\n'
+        "Cada justificación en una sola frase breve. Usa siempre las siglas SGSI."
+    )
+    salida = generar_respuesta(prompt, timeout=60, formato_json=True, sitio="pregunta_json")
+    try:
+        data = validar_pregunta_json(salida)
+    except (ValueError, json.JSONDecodeError) as e:
+        METRICAS.fallo_parseo("pregunta_json")
+        logging.warning(f"⚠️ Pregunta JSON inválida ({e}); se usa el formato de texto.")
+        return None
+    opts = data["opciones"]
+    justif = {opts[k]: data["justificacion"][k] for k in "ABC"}
+    return data["pregunta"], opts, data["correcta"], justif
+
+def explicacion_desde_justificaciones(q_text: str, opts: dict, correct_letter: str, user_letter: str):
+    """Arma la explicación breve con las justificaciones ya generadas, o None si no las hay."""
+    justif = justificaciones_de(q_text)
+    if not justif or opts.get(correct_letter) not in justif:
+        return None
+    lineas = [f"{correct_letter}) es correcta: {justif[opts[correct_letter]]}"]
+    if user_letter != correct_letter and opts.get(user_letter) in justif:
+        lineas.append(f"{user_letter}) es incorrecta: {justif[opts[user_letter]]}")
+    explic = "\n".join(lineas)
+    explic = re.sub(r'\bSGSIA?\b', 'SGSI', explic, flags=re.IGNORECASE)
+    return explic.replace("*", "").strip()
+
 # --------------------------
 # GENERADORES
 # --------------------------
-def generate_question_for_topic(topic: str, advanced: bool = False) -> str:
+def generate_question_for_topic(topic: str, advanced: bool = False, evitar: list = None) -> str:
+    if PREGUNTAS_ESTRUCTURADAS:
+        item = generar_pregunta_estructurada(topic, advanced, evitar)
+        if item:
+            q_text, opts, corr, justif = item
+            registrar_justificaciones(q_text, justif)
+            return formatear_pregunta(q_text, opts, corr)
     context = (
         "SGSI significa 'Sistema de Gestión de Seguridad de la Información'. "
         "Genera UNA pregunta breve y precisa sobre el tema indicado. Debe incluir tres opciones (A, B, C). "
@@ -121,16 +631,17 @@ def generate_question_for_topic(topic: str, advanced: bool = False) -> str:
     tag = random.randint(1000, 999999)
     prompt = (
         f"{context}\n{adv}\n\n"
-        f"Tema: {topic}\nID: {tag}\n\n"
+        f"Tema: {topic}\nID: {tag}\n{instruccion_evitar(evitar)}{referencias_iso(topic)}\n"
         "Formato EXACTO de salida:\n"
         "📘 Pregunta: <enunciado>\n"
         "A) <texto>\n"
         "B) <texto>\n"
         "C) <texto>\n"
     )
-    salida = generar_respuesta(prompt, max_tokens=240, temperature=0.18, timeout=60)
+    salida = generar_respuesta(prompt, timeout=60, sitio="pregunta_texto")
     q_text, opts, corr = parse_question_block(salida)
     if not opts:
+        METRICAS.fallo_parseo("pregunta_texto")
         salida = safe_fallback_question()
         q_text, opts, corr = parse_question_block(salida)
     textos = list(opts.values())
@@ -140,9 +651,13 @@ def generate_question_for_topic(topic: str, advanced: bool = False) -> str:
             opts[key] = textos_sin_duplicar[i]
         else:
             opts[key] = f"Opción {key}"
-    if opts and corr in opts:
+    return formatear_pregunta(q_text, opts, corr)
+
+def formatear_pregunta(q_text: str, opts: dict, corr: str, mezclar: bool = True) -> str:
+    """Mezcla la posición de la opción correcta y arma el bloque '📘 Pregunta' marcado con '*'."""
+    opts = dict(opts)
+    if mezclar and opts and corr in opts:
         letters = list(opts.keys())
-        correct_text = opts[corr]
         random_letter = random.choice(letters)
         if random_letter != corr:
             opts[random_letter], opts[corr] = opts[corr], opts[random_letter]
@@ -157,10 +672,121 @@ def generate_question_for_topic(topic: str, advanced: bool = False) -> str:
             lines.append(f"{L}) {opt_text}")
     return "\n".join(lines)
 
+# --------------------------
+# BANCO DE PREGUNTAS
+# --------------------------
+_banco = None
+_banco_lock = threading.Lock()
+
+def _generar_para_banco(topic: str, advanced: bool):
+    """Genera una pregunta y la devuelve parseada (con justificaciones), o None si hubo que usar el fallback."""
+    with planificador_llm.prioridad("relleno"), metricas_llm.modo("banco"):
+        q_text, opts, corr = parse_question_block(generate_question_for_topic(topic, advanced))
+    if q_text == parse_question_block(safe_fallback_question())[0]:
+        return None
+    return q_text, opts, corr, justificaciones_de(q_text)
+
+def obtener_banco() -> BancoPreguntas:
+    global _banco
+    with _banco_lock:
+        if _banco is None:
+            _banco = BancoPreguntas(
+                BANCO_RUTA, generador=_generar_para_banco,
+                max_por_tema=BANCO_MAX_POR_TEMA, min_disponibles=BANCO_MIN_DISPONIBLES,
+            )
+        return _banco
+
+def obtener_pregunta(topic: str, advanced: bool = False, usuario: str = USUARIO, evitar: list = None,
+                     degradar: bool = True) -> str:
+    """
+    Sirve una pregunta no vista desde el banco; si no hay, la genera en vivo y la guarda.
+    `evitar` son enunciados ya usados que la generación en vivo no debe repetir.
+    Si el modelo falla, con `degradar` se usa pregunta_de_respaldo; sin él se propaga ErrorLLM.
+    """
+    banco = obtener_banco()
+    item = banco.servir(topic, advanced, usuario)
+    if item:
+        q_text, opts, corr, justif = item
+        registrar_justificaciones(q_text, justif)
+        return formatear_pregunta(q_text, opts, corr)
+    try:
+        raw = generate_question_for_topic(topic, advanced, evitar)
+    except ErrorLLM:
+        if not degradar:
+            raise
+        return pregunta_de_respaldo(topic, advanced)
+    q_text, opts, corr = parse_question_block(raw)
+    if q_text != parse_question_block(safe_fallback_question())[0]:
+        banco.guardar(topic, advanced, q_text, opts, corr, justificaciones_de(q_text), usuario=usuario)
+    return raw
+
+def pregunta_de_respaldo(topic: str, advanced: bool = False) -> str:
+    """Sin modelo: una pregunta del banco del tema aunque ya se haya visto o, si no hay, la fija."""
+    item = obtener_banco().respaldo(topic, advanced)
+    if not item:
+        return safe_fallback_question()
+    q_text, opts, corr, justif = item
+    registrar_justificaciones(q_text, justif)
+    logging.info(f"🛟 Pregunta de respaldo del banco ({topic})")
+    return formatear_pregunta(q_text, opts, corr)
+
+def devolver_pregunta(raw: str, topic: str, advanced: bool = False, usuario: str = USUARIO):
+    """Devuelve al banco una pregunta obtenida pero no mostrada: deja de contar como vista."""
+    q_text = parse_question_block(raw)[0]
+    if q_text != parse_question_block(safe_fallback_question())[0]:
+        obtener_banco().devolver(topic, advanced, q_text, usuario)
+
+
+class PreguntaEspeculativa:
+    """
+    Siguiente pregunta de un tema generada en segundo plano mientras el estudiante lee
+    la explicación de la actual. Si no la quiere, se cancela o, si ya se generó, se
+    devuelve al banco sin contar como vista.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, tema: str, advanced: bool, usuario: str = USUARIO):
+        self.tema = tema
+        self.advanced = advanced
+        self.usuario = usuario
+        # El hilo hereda el contexto (modo para las métricas)
+        self.futuro = executor.submit(contextvars.copy_context().run, self._generar)
+
+    def _generar(self) -> str:
+        with planificador_llm.prioridad("explicacion"):
+            return obtener_pregunta(self.tema, self.advanced, self.usuario)
+
+    def es_de(self, tema: str, advanced: bool) -> bool:
+        return self.tema == tema and self.advanced == advanced
+
+    def tomar(self) -> str:
+        try:
+            return self.futuro.result()
+        except Exception as e:
+            logging.error(f"❌ Error en la pregunta precargada: {e}")
+            return obtener_pregunta(self.tema, self.advanced, self.usuario)
+
+    def descartar(self):
+        if self.futuro.cancel():
+            return
+        def devolver(futuro):
+            if not futuro.cancelled() and futuro.exception() is None:
+                devolver_pregunta(futuro.result(), self.tema, self.advanced, self.usuario)
+        self.futuro.add_done_callback(devolver)
+
 # --------------------------
 # EXPLICACIÓN BREVE
 # --------------------------
-def generate_brief_explanation(question_block: str, correct_letter: str, user_letter: str) -> str:
+def generate_brief_explanation(question_block: str, correct_letter: str, user_letter: str,
+                               topic: str = None, advanced: bool = False) -> str:
+    """Con `topic` la explicación se busca y se guarda en el banco junto a su pregunta (tema, nivel)."""
+    enunciado, opts, _ = parse_question_block(question_block)
+    rapida = explicacion_desde_justificaciones(enunciado, opts, correct_letter, user_letter)
+    if rapida:
+        return rapida
+    clave = clave_explicacion(correct_letter, user_letter, opts)
+    cacheada = obtener_banco().explicacion(topic, advanced, enunciado, clave) if topic else None
+    if cacheada:
+        return cacheada
     # Forzar siglas SGSI uniformes
     question_block = re.sub(r'\bSGSIA?\b', 'SGSI', question_block, flags=re.IGNORECASE)
     prompt = (
@@ -172,9 +798,42 @@ def generate_brief_explanation(question_block: str, correct_letter: str, user_le
         f"Respuesta del usuario: {user_letter}\n\n"
         "No cambies la letra correcta, no inventes otra, y sé muy conciso."
     )
-    explic = generar_respuesta(prompt, max_tokens=120, temperature=0.18, timeout=40)
+    try:
+        explic = generar_respuesta(prompt, timeout=40, prioridad="explicacion", sitio="explicacion")
+    except ErrorLLM:
+        # Respaldo sin modelo: solo la opción correcta (no se guarda en el banco)
+        return f"La respuesta correcta es {correct_letter}) {opts.get(correct_letter, '')}. {EXPLICACION_NO_DISPONIBLE}"
     explic = re.sub(r'\bSGSIA?\b', 'SGSI', explic, flags=re.IGNORECASE)  # normalizar siglas en la respuesta
-    return explic.replace("*", "").strip()
+    explic = explic.replace("*", "").strip()
+    if topic:
+        obtener_banco().guardar_explicacion(topic, advanced, enunciado, clave, explic)
+    return explic
+
+# --------------------------
+# TEMAS POR MODO
+# --------------------------
+TEMAS_ESTANDARES = [
+    "Requisitos ISO 27001", "Política de seguridad", "Controles de acceso",
+    "Gestión de incidentes", "Auditoría interna", "Clasificación de la información", "Gestión de riesgos"
+]
+TEMAS_EXAMEN = [
+    "Controles de acceso en ISO 27001",
+    "Gestión de incidentes según ISO 27001",
+    "Clasificación de la información (SGSI)",
+    "Gestión de riesgos (ISO 27005)",
+    "Política de seguridad",
+    "Auditoría interna",
+    "Evaluación de proveedores (ISO 27002)",
+    "Gestión de continuidad del negocio (ISO 27001)"
+]
+TEMAS_CASO = [
+    "Filtración de datos personales",
+    "Acceso no autorizado",
+    "Falla en control de contraseñas",
+    "Ransomware en servidores",
+    "Pérdida de respaldo de información"
+]
+EXAMEN_TOTAL_PREGUNTAS = 8  # 🔹 cada una vale 20 / 8 = 2.5 puntos
 
 # --------------------------
 # INTRO TEXT (ampliadas)
@@ -211,6 +870,110 @@ INTRO_CASE = (
     "👉 Escribe tu respuesta en 2-4 líneas o escribe 'salir' para terminar.\n"
 )
 
+MENU_PRINCIPAL = (
+    "=== MENÚ PRINCIPAL ===\n"
+    "1) Chat libre\n"
+    "2) Evaluación de Estándares (ISO 27001)\n"
+    "3) Evaluación Avanzada de Estándares (27001/27002/27005)\n"
+    "4) Examen rápido\n"
+    "5) Caso práctico\n"
+    "6) Salir"
+)
+MENSAJE_DESPEDIDA = "👋 ¡Gracias por usar el Asistente SGSI! ¡Éxitos en tu presentación!"
+
+# Respaldos cuando el modelo no responde (ErrorLLM)
+EXPLICACION_NO_DISPONIBLE = "(Explicación ampliada no disponible: el modelo no responde ahora mismo.)"
+CHAT_NO_DISPONIBLE = "⚠️ El modelo no está disponible en este momento. Inténtalo de nuevo en unos segundos."
+EVALUACION_NO_DISPONIBLE = "⚠️ No se pudo evaluar tu respuesta: el modelo no responde ahora mismo."
+ESCENARIOS_RESPALDO = {
+    "Filtración de datos personales": "Un analista envió por error a un proveedor externo una hoja de cálculo "
+                                      "con nombres, DNI y teléfonos de 2.000 clientes. El proveedor avisó dos días después.",
+    "Acceso no autorizado": "Los registros muestran inicios de sesión de madrugada en la cuenta de una gerente "
+                            "que está de vacaciones, con descargas de contratos desde una IP extranjera.",
+    "Falla en control de contraseñas": "Una auditoría descubre que el sistema de nóminas acepta contraseñas de "
+                                       "4 caracteres y que varias cuentas usan la misma clave desde hace años.",
+    "Ransomware en servidores": "El lunes por la mañana los servidores de archivos muestran los documentos "
+                                "cifrados y una nota de rescate; algunos equipos de usuarios siguen encendidos.",
+    "Pérdida de respaldo de información": "Al intentar restaurar una base de datos dañada, el equipo de TI descubre "
+                                          "que las copias de seguridad de los últimos tres meses están vacías.",
+}
+
+def textos_estaticos() -> list:
+    """Textos fijos de la interfaz: se pre-renderizan a audio al instalar (voz_tts.py prerender)."""
+    return [INTRO_MAIN, INTRO_CHAT, INTRO_QUIZ_BASIC, INTRO_QUIZ_ADV, INTRO_EXAM, INTRO_CASE,
+            MENU_PRINCIPAL, MENSAJE_DESPEDIDA, safe_fallback_question(), CHAT_NO_DISPONIBLE, EVALUACION_NO_DISPONIBLE]
+
+# --------------------------
+# FILTRO DE RELEVANCIA SGSI
+# --------------------------
+CLASIFICADOR = ClasificadorSGSI()
+
+def filtro_llm(pregunta: str, contexto: str) -> bool:
+    """Filtro Sí/No con el modelo; solo se usa cuando el clasificador local duda."""
+    filtro_prompt = (
+        "Responde solo con 'Sí' o 'No'. "
+        "Considera que 'SGSI' significa 'Sistema de Gestión de Seguridad de la Información'. "
+        "Cualquier tema relacionado con ISO/IEC 27001, 27002 o 27005 también cuenta como Seguridad de la Información. "
+        "Si el texto se refiere directa o indirectamente a esos temas, responde 'Sí'.\n\n"
+        "Si es irrelevante, absurdo o trolleo, responde 'No'.\n\n"
+        f"Contexto de conversación reciente:\n{contexto}\n\n"
+        f"Pregunta actual:\n{pregunta}"
+    )
+
+    try:
+        filtro_resp = generar_respuesta(filtro_prompt, timeout=15, hedge=True, sitio="filtro")
+    except ErrorLLM as e:
+        # Respaldo: el caso es ambiguo para el clasificador; se acepta si puntúa a favor
+        logging.warning(f"⚠️ Filtro LLM no disponible ({e}); decide el clasificador local")
+        return CLASIFICADOR.puntuar(pregunta)[0] > 0
+    logging.debug(f"🔍 Filtro LLM: {filtro_resp!r}")
+
+    if not isinstance(filtro_resp, str):
+        filtro_resp = str(filtro_resp or "")
+
+    # Limpieza de texto y verificación flexible
+    texto_filtro = filtro_resp.lower()
+    texto_filtro = re.sub(r"[^a-záéíóúñ]", " ", texto_filtro)
+
+    # Validación básica SGSI
+    es_si = bool(re.search(r"\bs[ií]\b", texto_filtro))
+    if not es_si and not re.search(r"\bno\b", texto_filtro):
+        METRICAS.fallo_parseo("filtro")
+    return es_si
+
+CACHE_RESPUESTAS = CacheRespuestas()
+
+def pregunta_autocontenida(pregunta: str) -> bool:
+    """Solo se cachean preguntas que nombran el tema explícitamente: su respuesta no depende del historial."""
+    return CLASIFICADOR.puntuar(pregunta)[0] >= CLASIFICADOR.umbral_relevante
+
+def respuesta_degradada(pregunta: str) -> str:
+    """Respaldo del chat sin modelo: respuesta cacheada de una pregunta parecida o, si no, referencias ISO."""
+    cacheada = CACHE_RESPUESTAS.buscar(pregunta, umbral=UMBRAL_CACHE_DEGRADADO)
+    if cacheada:
+        return f"{cacheada}\n\n(Respuesta guardada de una pregunta parecida: el modelo no responde ahora mismo.)"
+    referencias = referencias_iso(pregunta)
+    return f"{CHAT_NO_DISPONIBLE}\n{referencias}" if referencias else CHAT_NO_DISPONIBLE
+
+def es_pregunta_sgsi(pregunta: str, contexto: str = "") -> bool:
+    decision = CLASIFICADOR.clasificar(pregunta)
+    if decision is None:
+        decision = filtro_llm(pregunta, contexto)
+    return decision
+
+# --------------------------
+# CONFIG CHAT LIBRE
+# --------------------------
+# Debe mantenerse idéntico byte a byte entre turnos para aprovechar la caché de prompt del servidor
+PROMPT_SISTEMA_CHAT = (
+    "Eres un asistente experto en SGSI. "
+    "Recuerda que 'SGSI' siempre significa 'Sistema de Gestión de Seguridad de la Información' (ISMS en inglés). "
+    "Responde en español de forma clara y práctica (máx. 4 frases). "
+    "Si hay siglas, explica su significado antes de responder."
+)
+CHAT_PRESUPUESTO_TOKENS = 1200  # historial enviado al modelo (el resto se pliega en un resumen)
+UMBRAL_CACHE_DEGRADADO = 0.5    # similitud aceptada de la caché de respuestas cuando el modelo no responde
+
 # --------------------------
 # MODO CHAT LIBRE (mejorado con historial dinámico)
 # --------------------------
@@ -219,50 +982,36 @@ def modo_chat_libre():
     print(INTRO_CHAT)
     print("\n💡 El chat mantiene contexto. Escribe 'limpiar' para reiniciar o 'salir' para terminar.\n")
 
-    historial = []
-    MAX_HISTORIAL = 25  # límite de contexto en memoria
+    historial = HistorialChat(presupuesto_tokens=CHAT_PRESUPUESTO_TOKENS)
 
     while True:
         pregunta = input("👤 Tu mensaje: ").strip()
         if not pregunta:
             continue
         if pregunta.lower() == "salir":
+            logging.info(f"💾 Caché de respuestas: {CACHE_RESPUESTAS.metricas()}")
             break
         if pregunta.lower() == "limpiar":
-            historial.clear()
+            historial.limpiar()
             print("🧹 Historial limpio.\n")
             continue
 
         # -----------------------
-        # Construir contexto dinámico
+        # Caché de respuestas: un acierto evita el filtro y la generación
         # -----------------------
-        contexto = "\n".join([h["user"] for h in historial[-MAX_HISTORIAL:]])
+        cacheable = pregunta_autocontenida(pregunta)
+        if cacheable:
+            cacheada = CACHE_RESPUESTAS.buscar(pregunta)
+            if cacheada:
+                print(f"\n🤖 {cacheada}\n")
+                historial.agregar(pregunta, cacheada)
+                continue
 
         # -----------------------
-        # Filtro SGSI (robusto)
+        # Filtro SGSI: clasificador local y, si es ambiguo, el LLM
         # -----------------------
-        filtro_prompt = (
-            "Responde solo con 'Sí' o 'No'. "
-            "Considera que 'SGSI' significa 'Sistema de Gestión de Seguridad de la Información'. "
-            "Cualquier tema relacionado con ISO/IEC 27001, 27002 o 27005 también cuenta como Seguridad de la Información. "
-            "Si el texto se refiere directa o indirectamente a esos temas, responde 'Sí'.\n\n"
-            "Si es irrelevante, absurdo o trolleo, responde 'No'.\n\n"
-            f"Contexto de conversación reciente:\n{contexto}\n\n"
-            f"Pregunta actual:\n{pregunta}"
-        )
-
-        filtro_resp = generar_respuesta(filtro_prompt, max_tokens=10, temperature=0.0, timeout=15)
-        print(f"🔍 [DEBUG filtro_resp] => {repr(filtro_resp)}")
-
-        if not isinstance(filtro_resp, str):
-            filtro_resp = str(filtro_resp or "")
-
-        # Limpieza de texto y verificación flexible
-        texto_filtro = filtro_resp.lower()
-        texto_filtro = re.sub(r"[^a-záéíóúñ]", " ", texto_filtro)
-
-        # Validación básica SGSI
-        if not re.search(r"\bs[ií]\b", texto_filtro):
+        contexto = "\n".join(historial.preguntas_recientes())
+        if not es_pregunta_sgsi(pregunta, contexto):
             print(
                 "⚠️ Tu pregunta no parece estar relacionada con SGSI/ISO. "
                 "Por favor, intenta reformularla enfocándote en información, políticas, controles o normas ISO.\n"
@@ -270,25 +1019,23 @@ def modo_chat_libre():
             continue
 
         # -----------------------
-        # Generación de respuesta con historial
+        # Generación de respuesta con historial (prefijo de sistema idéntico en cada turno)
         # -----------------------
-        prompt = (
-            "Eres un asistente experto en SGSI. "
-            "Recuerda que 'SGSI' siempre significa 'Sistema de Gestión de Seguridad de la Información' (ISMS en inglés). "
-            "Responde en español de forma clara y práctica (máx. 4 frases). "
-            "Si hay siglas, explica su significado antes de responder.\n\n"
-        )
-
-        mensajes = [{"role": "system", "content": prompt}]
-        for h in historial[-MAX_HISTORIAL:]:
-            mensajes.append({"role": "user", "content": h["user"]})
-            mensajes.append({"role": "assistant", "content": h["bot"]})
-        mensajes.append({"role": "user", "content": pregunta})
-
-        respuesta = generar_respuesta(prompt + f"Pregunta: {pregunta}", max_tokens=320, temperature=0.3)
-        print("\n🤖", respuesta, "\n")
+        anterior = (historial.preguntas_recientes() or [""])[-1]
+        mensajes = historial.mensajes(PROMPT_SISTEMA_CHAT, pregunta_con_referencias(pregunta, anterior))
+        try:
+            respuesta = imprimir_stream(
+                generar_respuesta_stream_mensajes(mensajes, sitio="chat"),
+                prefijo="\n🤖 "
+            )
+        except ErrorLLM:
+            print(f"\n{respuesta_degradada(pregunta)}\n")
+            continue
+        print()
 
-        historial.append({"user": pregunta, "bot": respuesta})
+        historial.agregar(pregunta, respuesta)
+        if cacheable:
+            CACHE_RESPUESTAS.guardar(pregunta, respuesta)
 
 # =======================
 # Modo Quiz
@@ -296,194 +1043,335 @@ def modo_chat_libre():
 def modo_estandares(basico: bool = True):
     print("\n=== 📝 EVALUACIÓN DE ESTÁNDARES ===")
     print(INTRO_QUIZ_BASIC if basico else INTRO_QUIZ_ADV)
-    temas = [
-        "Requisitos ISO 27001", "Política de seguridad", "Controles de acceso",
-        "Gestión de incidentes", "Auditoría interna", "Clasificación de la información", "Gestión de riesgos"
-    ]
+    temas = TEMAS_ESTANDARES
     puntaje = 0
+    # Un hilo para la siguiente pregunta del tema, generada mientras se explica la actual
+    especulativo = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quiz-siguiente")
 
-    while True:
-        # Selección de tema
-        print("\nTemas disponibles:")
-        for i, t in enumerate(temas, 1):
-            print(f"{i}) {t}")
-        sel = input("\n👉 Elige número o escribe tu propio tema (o 'salir'): ").strip()
-        if sel.lower() == "salir":
-            break
-        tema = temas[int(sel)-1] if sel.isdigit() and 1 <= int(sel) <= len(temas) else sel
-
-        # Bucle de preguntas sobre el mismo tema
+    try:
         while True:
-            raw = generate_question_for_topic(tema, advanced=not basico)
-            q_text, opts, corr = parse_question_block(raw)
-            if not opts:
-                raw = safe_fallback_question()
+            # Selección de tema
+            print("\nTemas disponibles:")
+            for i, t in enumerate(temas, 1):
+                print(f"{i}) {t}")
+            sel = input("\n👉 Elige número o escribe tu propio tema (o 'salir'): ").strip()
+            if sel.lower() == "salir":
+                break
+            tema = temas[int(sel)-1] if sel.isdigit() and 1 <= int(sel) <= len(temas) else sel
+
+            # Bucle de preguntas sobre el mismo tema
+            siguiente = None
+            while True:
+                raw = siguiente.tomar() if siguiente else obtener_pregunta(tema, advanced=not basico)
+                siguiente = None
                 q_text, opts, corr = parse_question_block(raw)
+                if not opts:
+                    raw = safe_fallback_question()
+                    q_text, opts, corr = parse_question_block(raw)
 
-            clean_q = re.sub(r"^📘\s*Pregunta[:：]?\s*", "", q_text, flags=re.IGNORECASE).strip()
-            print(f"\n📘 {clean_q}\n")
-            for L in ["A", "B", "C"]:
-                print(f"{L}) {opts.get(L,'')}")
+                clean_q = re.sub(r"^📘\s*Pregunta[:：]?\s*", "", q_text, flags=re.IGNORECASE).strip()
+                print(f"\n📘 {clean_q}\n")
+                for L in ["A", "B", "C"]:
+                    print(f"{L}) {opts.get(L,'')}")
 
-            while True:
-                user = input("\n👤 Tu opción (A/B/C o 'salir'): ").strip().upper()
-                if user.lower() == "salir":
-                    return
-                if user not in ["A","B","C"]:
-                    print("❌ Opción no válida. Elige A, B o C.")
-                    continue
-                break
+                while True:
+                    user = input("\n👤 Tu opción (A/B/C o 'salir'): ").strip().upper()
+                    if user.lower() == "salir":
+                        return
+                    if user not in ["A","B","C"]:
+                        print("❌ Opción no válida. Elige A, B o C.")
+                        continue
+                    break
 
-            if user == corr:
-                print("\n✅ Correcto!")
-            else:
-                print(f"\n❌ Incorrecto. La correcta era {corr}) {opts.get(corr,'')}")
+                # La siguiente pregunta se genera a la vez que la explicación y la lectura
+                siguiente = PreguntaEspeculativa(especulativo, tema, not basico)
 
-            explic = generate_brief_explanation(raw, corr, user)
-            print(f"\n📖 {explic}\n")
+                if user == corr:
+                    print("\n✅ Correcto!")
+                else:
+                    print(f"\n❌ Incorrecto. La correcta era {corr}) {opts.get(corr,'')}")
 
-            if user == corr:
-                puntaje += 5
-            print(f"🔥 Puntaje: {puntaje}\n")
+                explic = generate_brief_explanation(raw, corr, user, tema, not basico)
+                print(f"\n📖 {explic}\n")
 
-            seguir = input("¿Otra pregunta sobre este tema? (sí/no): ").strip().lower()
-            if seguir not in ("sí", "si", "s", "y", "yes"):
-                break
+                if user == corr:
+                    puntaje += 5
+                print(f"🔥 Puntaje: {puntaje}\n")
+
+                seguir = input("¿Otra pregunta sobre este tema? (sí/no): ").strip().lower()
+                if seguir not in ("sí", "si", "s", "y", "yes"):
+                    siguiente.descartar()
+                    break
+    finally:
+        especulativo.shutdown(wait=False)
 
 # ==========================
 # Modo Examen rápido
 # ==========================
-def modo_examen_rapido():
-    print("\n=== 🏁 EXAMEN RÁPIDO ===")
-    print(INTRO_EXAM)
-    puntaje = 0
-    used_q_texts = set()
-
-    pool = [
-        "Controles de acceso en ISO 27001",
-        "Gestión de incidentes según ISO 27001",
-        "Clasificación de la información (SGSI)",
-        "Gestión de riesgos (ISO 27005)",
-        "Política de seguridad",
-        "Auditoría interna",
-        "Evaluación de proveedores (ISO 27002)",
-        "Gestión de continuidad del negocio (ISO 27001)"
-    ]
-
-    TOTAL_PREGUNTAS = 8          # 🔹 ahora 8 preguntas
-    PUNTAJE_POR_PREGUNTA = 20 / TOTAL_PREGUNTAS  # 🔹 mantiene total de 20 puntos
-
-    for i in range(1, TOTAL_PREGUNTAS + 1):
-        candidates = [t for t in pool if t not in used_q_texts] or pool
-        tema = random.choice(candidates)
+def preparar_pregunta_examen(tema: str, usadas: IndiceSimilitud, rotacion: RotacionTemas = None,
+                             degradar: bool = True, usuario: str = USUARIO):
+    """
+    Genera, parsea y deduplica una pregunta del examen. Devuelve (raw, clean_q, opts, corr, tema);
+    `tema` es el de la pregunta aceptada (puede cambiar al reintentar con la rotación, que es
+    la que dio `tema`: un tema cuya pregunta se descarta se le devuelve y no cuenta como usado).
+    Una pregunta casi igual a otra ya aceptada se descarta; el reintento pasa al siguiente
+    tema de la rotación y le indica al modelo qué enunciados no repetir.
+    Sin `degradar` la pregunta fija no se acepta nunca: agotados los intentos se lanza ErrorLLM.
+    """
+    attempts = 0
+    while True:
+        evitar = usadas.recientes() if attempts else None
+        raw = obtener_pregunta(tema, advanced=True, usuario=usuario, evitar=evitar, degradar=degradar)
+        q_text, opts, corr = parse_question_block(raw)
+        clean_q = re.sub(r"^📘\s*Pregunta[:：]?\s*", "", q_text, flags=re.IGNORECASE).strip()
+        attempts += 1
 
-        attempts = 0
-        while True:
-            raw = generate_question_for_topic(tema, advanced=True)
+        # Comprobación y alta atómicas: los hilos de precarga comparten el índice
+        fija = not degradar and q_text == parse_question_block(safe_fallback_question())[0]
+        if clean_q and not fija and usadas.reservar(clean_q):
+            break
+        if attempts >= MAX_INTENTOS_DUPLICADO:
+            if not degradar:
+                if rotacion:
+                    rotacion.devolver(tema)
+                raise ErrorRespuestaLLM(f"sin pregunta nueva sobre '{tema}' tras {attempts} intentos")
+            raw = safe_fallback_question()
             q_text, opts, corr = parse_question_block(raw)
             clean_q = re.sub(r"^📘\s*Pregunta[:：]?\s*", "", q_text, flags=re.IGNORECASE).strip()
-            attempts += 1
+            usadas.agregar(clean_q)
+            break
+        logging.info(f"♻️ Pregunta casi repetida descartada ({tema}); se genera otra")
+        if rotacion:
+            rotacion.devolver(tema)
+            tema = rotacion.siguiente(excluir=(tema,))
 
-            if not clean_q or clean_q in used_q_texts:
-                if attempts > 4:
-                    raw = safe_fallback_question()
-                    q_text, opts, corr = parse_question_block(raw)
-                    clean_q = re.sub(r"^📘\s*Pregunta[:：]?\s*", "", q_text, flags=re.IGNORECASE).strip()
-                else:
-                    continue
+    textos = list(opts.values())
+    textos_sin_duplicar = list(dict.fromkeys(textos))
+    for j, key in enumerate(["A", "B", "C"]):
+        if j < len(textos_sin_duplicar):
+            opts[key] = textos_sin_duplicar[j]
+        else:
+            opts[key] = f"Opción {key}"
 
-            textos = list(opts.values())
-            textos_sin_duplicar = list(dict.fromkeys(textos))
-            for j, key in enumerate(["A", "B", "C"]):
-                if j < len(textos_sin_duplicar):
-                    opts[key] = textos_sin_duplicar[j]
-                else:
-                    opts[key] = f"Opción {key}"
+    if opts and corr in opts:
+        letters = list(opts.keys())
+        random_letter = random.choice(letters)
+        if random_letter != corr:
+            opts[random_letter], opts[corr] = opts[corr], opts[random_letter]
+            corr = random_letter
 
-            if opts and corr in opts:
-                letters = list(opts.keys())
-                correct_text = opts[corr]
-                random_letter = random.choice(letters)
-                if random_letter != corr:
-                    opts[random_letter], opts[corr] = opts[corr], opts[random_letter]
-                    corr = random_letter
+    # El bloque para la explicación debe coincidir con las letras mostradas
+    raw = formatear_pregunta(clean_q, opts, corr, mezclar=False)
+    return raw, clean_q, opts, corr, tema
 
-            used_q_texts.add(clean_q)
-            break
 
-        print(f"\n📘 Pregunta {i}: {clean_q}\n")
-        for L in ["A", "B", "C"]:
-            print(f"{L}) {opts.get(L, '')}")
+class PrecargaExamen:
+    """
+    Pipeline de precarga del examen: un pool acotado de hilos genera las
+    siguientes `profundidad` preguntas mientras el estudiante responde la actual.
+    Si no hay nada precargado, la pregunta se genera al momento.
+    """
 
-        while True:
-            user = input("\n👤 Tu opción (A/B/C o 'salir'): ").strip().upper()
-            if user.lower() == "salir":
-                print("\n🚪 Examen interrumpido por el usuario.")
-                print(f"\n🏆 Puntaje final: {puntaje:.1f}/20\n")
-                return
-            if user not in ["A", "B", "C"]:
-                print("❌ Opción no válida. Elige A, B o C.")
-                continue
-            break
+    def __init__(self, pool: list, total: int, profundidad: int = EXAMEN_PRECARGA,
+                 max_workers: int = EXAMEN_MAX_WORKERS, executor: ThreadPoolExecutor = None, usuario: str = USUARIO):
+        """Con `executor` se usa un pool compartido (p. ej. el del servidor) que no se cierra aquí."""
+        self.pool = pool
+        self.usuario = usuario
+        self.total = total
+        self.profundidad = max(0, profundidad)
+        self.usadas = IndiceSimilitud(UMBRAL_DUPLICADO_PREGUNTA)
+        self.rotacion = RotacionTemas(pool)
+        self.enviadas = 0
+        self.futuros = deque()
+        self.executor = executor if self.profundidad > 0 else None
+        self.executor_propio = False
+        if self.profundidad > 0 and executor is None:
+            self.executor_propio = True
+            self.executor = ThreadPoolExecutor(
+                max_workers=max(1, min(max_workers, self.profundidad)),
+                thread_name_prefix="examen-precarga",
+            )
 
-        if user == corr:
-            print("\n✅ Correcto!")
-            puntaje += PUNTAJE_POR_PREGUNTA
-        else:
-            print(f"\n❌ Incorrecto. La correcta era {corr}) {opts.get(corr, '')}")
+    def generar(self):
+        """Genera la siguiente pregunta al momento (sin pasar por la precarga)."""
+        return preparar_pregunta_examen(self.rotacion.siguiente(), self.usadas, self.rotacion, usuario=self.usuario)
+
+    def _generar_fondo(self):
+        # Los hilos del pool no heredan el contexto: se fijan prioridad y modo
+        with planificador_llm.prioridad("fondo"), metricas_llm.modo("examen"):
+            return self.generar()
 
-        explic = generate_brief_explanation(raw, corr, user)
-        print(f"\n📖 Explicación breve:\n{explic}\n")
-        time.sleep(0.3)
+    def rellenar(self):
+        if self.executor is None:
+            return
+        while len(self.futuros) < self.profundidad and self.enviadas < self.total:
+            self.futuros.append(self.executor.submit(self._generar_fondo))
+            self.enviadas += 1
+
+    def iniciar(self):
+        self.rellenar()
+
+    def tomar_futuro(self):
+        """El futuro precargado de la siguiente pregunta, o None si no hay (se generará al momento)."""
+        if self.futuros:
+            return self.futuros.popleft()
+        self.enviadas += 1
+        return None
+
+    def siguiente(self):
+        """Devuelve la siguiente pregunta (raw, clean_q, opts, corr, tema)."""
+        item = None
+        fut = self.tomar_futuro()
+        if fut is not None:
+            try:
+                item = fut.result()
+            except Exception as e:
+                logging.error(f"❌ Error en precarga de pregunta: {e}")
+        if item is None:
+            item = self.generar()
+        self.rellenar()
+        return item
+
+    def cerrar(self):
+        if self.usadas.rechazados:
+            logging.info(f"♻️ Preguntas casi repetidas regeneradas en el examen: {self.usadas.rechazados}")
+        for fut in self.futuros:
+            fut.cancel()
+        self.futuros.clear()
+        if self.executor_propio:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def modo_examen_rapido(precarga: int = EXAMEN_PRECARGA):
+    print("\n=== 🏁 EXAMEN RÁPIDO ===")
+    print(INTRO_EXAM)
+    puntaje = 0
+
+    TOTAL_PREGUNTAS = EXAMEN_TOTAL_PREGUNTAS
+    PUNTAJE_POR_PREGUNTA = 20 / TOTAL_PREGUNTAS  # 🔹 mantiene total de 20 puntos
+
+    precargador = PrecargaExamen(TEMAS_EXAMEN, TOTAL_PREGUNTAS, profundidad=precarga)
+    precargador.iniciar()
+    try:
+        for i in range(1, TOTAL_PREGUNTAS + 1):
+            raw, clean_q, opts, corr, tema = precargador.siguiente()
+
+            print(f"\n📘 Pregunta {i}: {clean_q}\n")
+            for L in ["A", "B", "C"]:
+                print(f"{L}) {opts.get(L, '')}")
+
+            while True:
+                user = input("\n👤 Tu opción (A/B/C o 'salir'): ").strip().upper()
+                if user.lower() == "salir":
+                    print("\n🚪 Examen interrumpido por el usuario.")
+                    print(f"\n🏆 Puntaje final: {puntaje:.1f}/20\n")
+                    return
+                if user not in ["A", "B", "C"]:
+                    print("❌ Opción no válida. Elige A, B o C.")
+                    continue
+                break
+
+            if user == corr:
+                print("\n✅ Correcto!")
+                puntaje += PUNTAJE_POR_PREGUNTA
+            else:
+                print(f"\n❌ Incorrecto. La correcta era {corr}) {opts.get(corr, '')}")
+
+            explic = generate_brief_explanation(raw, corr, user, tema, True)
+            print(f"\n📖 Explicación breve:\n{explic}\n")
+            time.sleep(0.3)
+    finally:
+        precargador.cerrar()
 
     print(f"\n🏆 Puntaje final: {puntaje:.1f}/20\n")
 
 # ==========================
 # Modo Caso práctico
 # ==========================
+def generar_escenario(tema: str, usados: IndiceSimilitud) -> str:
+    """Genera un escenario de caso práctico evitando repetir (o reformular) los ya usados."""
+    attempts = 0
+    while True:
+        # Generamos SOLO el escenario sin acciones ni pistas
+        evitar = instruccion_evitar(usados.recientes(3), "situaciones") if attempts else ""
+        prompt = (
+            f"Genera un escenario breve (3-4 líneas) sobre '{tema}' en el contexto de un SGSI. "
+            "No incluyas soluciones, pasos o acciones de evaluación. Solo describe la situación."
+            f"{evitar}"
+        )
+        try:
+            escenario_raw = generar_respuesta(prompt, sitio="escenario")
+        except ErrorLLM:
+            return escenario_de_respaldo(tema, usados)
+        esc_clean = escenario_raw.strip()
+        attempts += 1
+        if usados.reservar(esc_clean):
+            return esc_clean
+        if attempts >= MAX_INTENTOS_DUPLICADO:
+            usados.agregar(esc_clean)
+            return esc_clean
+        logging.info(f"♻️ Escenario casi repetido descartado ({tema}); se genera otro")
+
+def escenario_de_respaldo(tema: str, usados: IndiceSimilitud) -> str:
+    """Sin modelo: el escenario fijo del tema o, si ya salió, otro de los fijos que no se haya usado."""
+    candidatos = [ESCENARIOS_RESPALDO.get(tema)] + list(ESCENARIOS_RESPALDO.values())
+    for escenario in candidatos:
+        if escenario and usados.reservar(escenario):
+            return escenario
+    return ESCENARIOS_RESPALDO.get(tema) or candidatos[1]
+
+def prompt_evaluacion_caso(escenario: str, respuesta: str) -> str:
+    return (
+        f"Escenario: {escenario}\n"
+        f"Respuesta del usuario: {respuesta}\n"
+        f"{referencias_iso(f'{escenario} {respuesta}')}\n"
+        "Evalúa la respuesta con: ✅ Correcta, ⚠️ Parcial o ❌ Incorrecta. "
+        "Da una retroalimentación breve y práctica (máx. 2 líneas), sin revelar otras acciones posibles."
+    )
+
+# Veredicto de la evaluación: emoji pedido en el prompt o, si el modelo no lo usa, la palabra
+_VEREDICTOS = (
+    ("incorrecta", re.compile(r"❌|\bincorrect[ao]\b", re.IGNORECASE)),
+    ("parcial", re.compile(r"⚠️?|\bparcial(mente)?\b", re.IGNORECASE)),
+    ("correcta", re.compile(r"✅|\bcorrect[ao]\b", re.IGNORECASE)),
+)
+
+def parsear_veredicto(evaluacion: str):
+    """'correcta', 'parcial' o 'incorrecta' según la primera marca del texto; None si no hay ninguna."""
+    encontrados = [(m.start(), nombre) for nombre, patron in _VEREDICTOS
+                   for m in [patron.search(evaluacion or "")] if m]
+    return min(encontrados)[1] if encontrados else None
+
+def evaluacion_degradada(escenario: str) -> str:
+    """Sin modelo: aviso y, si hay, los controles ISO relacionados con el escenario para autoevaluarse."""
+    referencias = referencias_iso(escenario)
+    return f"{EVALUACION_NO_DISPONIBLE}\n{referencias}" if referencias else EVALUACION_NO_DISPONIBLE
+
 def modo_caso_practico():
     print("\n=== 💼 CASO PRÁCTICO ===")
     print(INTRO_CASE)
-    temas = [
-        "Filtración de datos personales",
-        "Acceso no autorizado",
-        "Falla en control de contraseñas",
-        "Ransomware en servidores",
-        "Pérdida de respaldo de información"
-    ]
-    used_q_texts = set()
-    
+    usados = IndiceSimilitud(UMBRAL_DUPLICADO_ESCENARIO)
+    rotacion = RotacionTemas(TEMAS_CASO)
+
     while True:
-        tema = random.choice(temas)
-        attempts = 0
-        while True:
-            # Generamos SOLO el escenario sin acciones ni pistas
-            prompt = (
-                f"Genera un escenario breve (3-4 líneas) sobre '{tema}' en el contexto de un SGSI. "
-                "No incluyas soluciones, pasos o acciones de evaluación. Solo describe la situación."
-            )
-            escenario_raw = generar_respuesta(prompt, max_tokens=200, temperature=0.2)
-            esc_clean = escenario_raw.strip()
-            attempts += 1
-            if esc_clean not in used_q_texts or attempts > 4:
-                used_q_texts.add(esc_clean)
-                break
-        
+        tema = rotacion.siguiente()
+        esc_clean = generar_escenario(tema, usados)
+
         print(f"\n🔔 Escenario:\n{esc_clean}\n")
         respuesta = input("👤 Describe brevemente qué acciones tomarías (2-4 líneas o 'salir'): ").strip()
         if respuesta.lower() == "salir":
             break
 
         # Evaluamos la respuesta del usuario
-        eval_prompt = (
-            f"Escenario: {esc_clean}\n"
-            f"Respuesta del usuario: {respuesta}\n\n"
-            "Evalúa la respuesta con: ✅ Correcta, ⚠️ Parcial o ❌ Incorrecta. "
-            "Da una retroalimentación breve y práctica (máx. 2 líneas), sin revelar otras acciones posibles."
-        )
-        evaluacion = generar_respuesta(eval_prompt, max_tokens=140, temperature=0.2)
-        print(f"\n📊 Evaluación:\n{evaluacion}\n")
-        
+        try:
+            imprimir_stream(
+                generar_respuesta_stream(prompt_evaluacion_caso(esc_clean, respuesta), sitio="evaluacion"),
+                prefijo="\n📊 Evaluación:\n"
+            )
+        except ErrorLLM:
+            print(f"\n{evaluacion_degradada(esc_clean)}")
+        print()
+
         seguir = input("¿Otro caso? (sí/no): ").strip().lower()
         if seguir not in ("sí", "si", "s", "y", "yes"):
             break
@@ -491,30 +1379,30 @@ def modo_caso_practico():
 # --------------------------
 # MAIN
 # --------------------------
+def ejecutar_modo(nombre: str, funcion, *args, **kwargs):
+    """Etiqueta las llamadas al modelo con el modo y, si SGSI_PERFIL está definido, lo perfila."""
+    with metricas_llm.modo(nombre), metricas_llm.perfilar(nombre, PERFIL_DIR):
+        return funcion(*args, **kwargs)
+
 def main():
-    warm_up_model()
+    iniciar_warm_up()
     print(INTRO_MAIN)
     while True:
-        print("=== MENÚ PRINCIPAL ===")
-        print("1) Chat libre")
-        print("2) Evaluación de Estándares (ISO 27001)")
-        print("3) Evaluación Avanzada de Estándares (27001/27002/27005)")
-        print("4) Examen rápido")
-        print("5) Caso práctico")
-        print("6) Salir")
+        print(MENU_PRINCIPAL)
         opcion = input("👉 Elige una opción: ").strip()
         if opcion == "1":
-            modo_chat_libre()
+            ejecutar_modo("chat", modo_chat_libre)
         elif opcion == "2":
-            modo_estandares(basico=True)
+            ejecutar_modo("quiz_basico", modo_estandares, basico=True)
         elif opcion == "3":
-            modo_estandares(basico=False)
+            ejecutar_modo("quiz_avanzado", modo_estandares, basico=False)
         elif opcion == "4":
-            modo_examen_rapido()
+            prof = input(f"⚙️ Preguntas a precargar en segundo plano (Enter = {EXAMEN_PRECARGA}, 0 = sin precarga): ").strip()
+            ejecutar_modo("examen", modo_examen_rapido, precarga=int(prof) if prof.isdigit() else EXAMEN_PRECARGA)
         elif opcion == "5":
-            modo_caso_practico()
+            ejecutar_modo("caso", modo_caso_practico)
         elif opcion == "6":
-            print("👋 ¡Gracias por usar el Asistente SGSI! ¡Éxitos en tu presentación!")
+            print(MENSAJE_DESPEDIDA)
             break
         else:
             print("❌ Opción no válida. Intenta nuevamente.\n")
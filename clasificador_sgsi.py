@@ -0,0 +1,108 @@
+import re
+import logging
+import threading
+import time
+import unicodedata
+
+# --------------------------
+# CLASIFICADOR LOCAL DE RELEVANCIA SGSI/ISO
+# --------------------------
+# Puntuación por términos ponderados (palabras, raíces y frases) del vocabulario de
+# ISO/IEC 27001, 27002 y 27005. Decide en local los casos claros y devuelve None
+# para los ambiguos, que se escalan al filtro LLM.
+
+# término -> peso. Un '*' final indica raíz (coincide con cualquier terminación).
+VOCABULARIO = {
+    # Siglas y normas: casi siempre relevantes
+    "sgsi": 3.0, "sgsia": 3.0, "isms": 3.0, "iso": 2.0, "iec": 2.0,
+    "27001": 3.0, "27002": 3.0, "27005": 3.0, "27000": 3.0, "27701": 2.5, "22301": 2.0,
+    "anexo a": 2.5, "declaracion de aplicabilidad": 3.0, "soa": 1.5,
+    "seguridad de la informacion": 3.0, "ciberseguridad": 2.5, "infosec": 2.5,
+    # Principios y gestión del riesgo (27005)
+    "confidencialidad": 2.0, "integridad": 1.5, "disponibilidad": 1.5,
+    "riesgo*": 1.5, "amenaza*": 1.5, "vulnerabilidad*": 2.0, "activo*": 1.0,
+    "tratamiento del riesgo": 2.5, "apetito de riesgo": 2.5, "riesgo residual": 2.5,
+    "analisis de riesgo*": 2.5, "evaluacion de riesgo*": 2.5, "impacto": 0.5, "probabilidad": 0.5,
+    # Sistema de gestión (27001)
+    "auditori*": 1.5, "no conformidad*": 2.0, "accion correctiva": 2.0, "acciones correctivas": 2.0,
+    "mejora continua": 1.5, "pdca": 2.0, "partes interesadas": 1.5, "alcance del sgsi": 3.0,
+    "certificacion": 1.0, "revision por la direccion": 2.0, "indicador*": 0.5,
+    "politica de seguridad": 2.5, "politica*": 0.5, "procedimiento*": 0.5, "norma*": 0.5,
+    # Controles (27002)
+    "control*": 1.0, "control de acceso": 2.0, "controles de acceso": 2.0,
+    "incidente*": 1.5, "gestion de incidentes": 2.5, "continuidad del negocio": 2.5, "continuidad": 1.0,
+    "respaldo*": 1.5, "backup*": 1.5, "copia de seguridad": 2.0, "copias de seguridad": 2.0,
+    "cifrado": 2.0, "criptografi*": 2.0, "contrasena*": 1.5, "password*": 1.5,
+    "autenticacion": 1.5, "multifactor": 2.0, "mfa": 2.0, "privilegio*": 1.0,
+    "phishing": 2.0, "malware": 2.0, "ransomware": 2.0, "firewall": 1.5, "antivirus": 1.5,
+    "clasificacion de la informacion": 2.5, "etiquetado": 1.0, "seguridad fisica": 2.0,
+    "proveedor*": 0.5, "teletrabajo": 0.5, "concienciacion": 1.5, "concientizacion": 1.5,
+    "proteccion de datos": 2.0, "datos personales": 2.0, "gdpr": 2.0, "rgpd": 2.0,
+    "logs": 1.0, "registro de eventos": 1.5, "monitoreo": 1.0, "hacker*": 1.5, "ataque*": 1.0, "brecha*": 1.0,
+    "filtracion*": 1.0, "seguridad": 1.0, "informacion": 0.5, "gestion": 0.5,
+    # Temas claramente ajenos
+    "futbol": -2.5, "receta*": -2.5, "cocina*": -2.0, "pelicula*": -2.0, "serie*": -1.0,
+    "chiste*": -2.5, "musica": -2.0, "cancion*": -2.0, "horoscopo": -3.0, "novio": -1.5, "novia": -1.5,
+    "clima": -1.5, "pizza": -2.5, "videojuego*": -2.0, "poema*": -2.0, "partido": -1.5,
+    "deporte*": -2.0, "chisme*": -2.5, "amor": -1.5,
+}
+
+UMBRAL_RELEVANTE = 2.0     # score >= -> 'Sí' local
+UMBRAL_IRRELEVANTE = -1.0  # score <= -> 'No' local
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sin tildes y sin signos de puntuación."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9\s]", " ", texto)
+
+
+def _compilar(vocabulario: dict):
+    partes = []
+    for termino in sorted(vocabulario, key=len, reverse=True):
+        raiz = termino.rstrip("*")
+        patron = r"\s+".join(re.escape(p) for p in raiz.split())
+        if termino.endswith("*"):
+            patron += r"\w*"
+        partes.append(f"(?P<t{len(partes)}>{patron})")
+    claves = sorted(vocabulario, key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(partes) + r")\b"), claves
+
+
+class ClasificadorSGSI:
+    def __init__(self, vocabulario: dict = None, umbral_relevante: float = UMBRAL_RELEVANTE,
+                 umbral_irrelevante: float = UMBRAL_IRRELEVANTE):
+        self.vocabulario = vocabulario or VOCABULARIO
+        self.umbral_relevante = umbral_relevante
+        self.umbral_irrelevante = umbral_irrelevante
+        self.regex, self.claves = _compilar(self.vocabulario)
+        self.lock = threading.Lock()
+        self.stats = {"si": 0, "no": 0, "escaladas": 0}
+
+    def puntuar(self, texto: str):
+        """Devuelve (score, términos encontrados). Cada término cuenta una sola vez."""
+        encontrados = set()
+        for m in self.regex.finditer(normalizar(texto)):
+            encontrados.add(self.claves[int(m.lastgroup[1:])])
+        return sum(self.vocabulario[t] for t in encontrados), sorted(encontrados)
+
+    def clasificar(self, texto: str):
+        """True/False si el caso es claro; None si hay que escalar al filtro LLM."""
+        t0 = time.perf_counter()
+        score, terminos = self.puntuar(texto)
+        if score >= self.umbral_relevante:
+            decision, clave = True, "si"
+        elif score <= self.umbral_irrelevante:
+            decision, clave = False, "no"
+        else:
+            decision, clave = None, "escaladas"
+        with self.lock:
+            self.stats[clave] += 1
+            total = sum(self.stats.values())
+            escaladas = self.stats["escaladas"]
+        logging.info(
+            f"🔎 Clasificador SGSI: score={score:.1f} {terminos} -> {clave} "
+            f"({(time.perf_counter() - t0) * 1e6:.0f} µs) · escaladas {escaladas}/{total} ({escaladas / total:.0%})"
+        )
+        return decision
@@ -0,0 +1,86 @@
+import random
+import threading
+from collections import Counter
+
+from cache_respuestas import normalizar_pregunta, shingles, jaccard
+
+# --------------------------
+# DETECCIÓN DE PREGUNTAS/ESCENARIOS CASI DUPLICADOS
+# --------------------------
+# Un examen o una sesión de casos acumula pocas decenas de textos, así que se compara
+# contra todos con la similitud de Jaccard exacta sobre 3-gramas de caracteres del
+# texto normalizado (mismas funciones que la caché de respuestas). Así una pregunta
+# reformulada ("objetivo" -> "propósito") cuenta como repetida.
+
+
+class IndiceSimilitud:
+    def __init__(self, umbral: float = 0.55):
+        self.umbral = umbral
+        self.textos = []                # [(texto, shingles)]
+        self.lock = threading.Lock()
+        self.rechazados = 0
+
+    def _similar(self, conjunto):
+        mejor, mejor_sim = None, 0.0
+        for texto, otro in self.textos:
+            sim = jaccard(conjunto, otro)
+            if sim > mejor_sim:
+                mejor, mejor_sim = texto, sim
+        return (mejor, mejor_sim) if mejor_sim >= self.umbral else None
+
+    def similar(self, texto: str):
+        """(texto ya aceptado, similitud) del más parecido por encima del umbral, o None."""
+        conjunto = shingles(normalizar_pregunta(texto))
+        with self.lock:
+            return self._similar(conjunto)
+
+    def reservar(self, texto: str) -> bool:
+        """Acepta el texto si no es casi igual a uno ya aceptado (comprobación y alta atómicas)."""
+        clave = normalizar_pregunta(texto)
+        if not clave:
+            return False
+        conjunto = shingles(clave)
+        with self.lock:
+            if self._similar(conjunto):
+                self.rechazados += 1
+                return False
+            self.textos.append((texto, conjunto))
+            return True
+
+    def agregar(self, texto: str):
+        """Alta sin comprobar (p. ej. la pregunta de respaldo tras agotar los intentos)."""
+        with self.lock:
+            self.textos.append((texto, shingles(normalizar_pregunta(texto))))
+
+    def recientes(self, n: int = 5) -> list:
+        with self.lock:
+            return [t for t, _ in self.textos[-n:]]
+
+    def __len__(self):
+        return len(self.textos)
+
+    def __contains__(self, texto: str):
+        return self.similar(texto) is not None
+
+
+class RotacionTemas:
+    """Reparte los temas de forma equilibrada: siempre uno de los menos usados, al azar entre ellos."""
+
+    def __init__(self, temas: list):
+        self.temas = list(temas)
+        self.usos = Counter({t: 0 for t in self.temas})
+        self.lock = threading.Lock()
+
+    def siguiente(self, excluir=()) -> str:
+        with self.lock:
+            candidatos = [t for t in self.temas if t not in excluir] or self.temas
+            minimo = min(self.usos[t] for t in candidatos)
+            tema = random.choice([t for t in candidatos if self.usos[t] == minimo])
+            self.usos[tema] += 1
+            return tema
+
+    def devolver(self, tema: str):
+        """Deshace un `siguiente` cuyo tema no llegó a usarse (p. ej. su pregunta salió repetida)."""
+        with self.lock:
+            if self.usos[tema] > 0:
+                self.usos[tema] -= 1
@@ -0,0 +1,185 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chatbot
+import metricas_llm
+
+# --------------------------
+# EVALUACIÓN EN LOTE DE CASOS PRÁCTICOS
+# --------------------------
+# Corrige sin interacción las respuestas de toda una clase: lee pares escenario/respuesta
+# de un CSV (con cabecera) o JSONL, los evalúa en paralelo con el mismo prompt que
+# modo_caso_practico y, según terminan, añade una línea por fila al JSONL de salida con
+# el veredicto ya interpretado (correcta / parcial / incorrecta). El resto de columnas
+# (id, estudiante...) se copia tal cual.
+#
+# Memoización: cada par se identifica por el hash del escenario y la respuesta con los
+# espacios normalizados. Dentro de una ejecución, los pares idénticos se evalúan una sola
+# vez; al relanzar sobre la misma salida, las filas ya escritas se saltan y las filas
+# nuevas con un par ya evaluado reutilizan ese resultado sin llamar al modelo.
+#
+#   python evaluacion_lote.py respuestas.csv --salida notas.jsonl --en-vuelo 4
+
+SALIDA_POR_DEFECTO = "evaluaciones_lote.jsonl"
+CAMPO_ESCENARIO = "escenario"
+CAMPO_RESPUESTA = "respuesta"
+
+
+def clave_par(escenario: str, respuesta: str) -> str:
+    normalizado = json.dumps([" ".join(escenario.split()), " ".join(respuesta.split())], ensure_ascii=False)
+    return hashlib.sha256(normalizado.encode("utf-8")).hexdigest()
+
+
+def leer_entrada(ruta: str) -> list:
+    """Filas (dict) del CSV o JSONL; cada una lleva `id` (la columna si existe, si no el número de fila)."""
+    if ruta.endswith((".jsonl", ".ndjson")):
+        with open(ruta, encoding="utf-8") as f:
+            filas = [json.loads(linea) for linea in f if linea.strip()]
+    else:
+        with open(ruta, encoding="utf-8-sig", newline="") as f:
+            filas = list(csv.DictReader(f))
+    validas = []
+    for n, fila in enumerate(filas, start=1):
+        escenario = str(fila.get(CAMPO_ESCENARIO) or "").strip()
+        respuesta = str(fila.get(CAMPO_RESPUESTA) or "").strip()
+        if not escenario or not respuesta:
+            logging.warning(f"⚠️ Fila {n} sin '{CAMPO_ESCENARIO}' o '{CAMPO_RESPUESTA}'; se omite")
+            continue
+        fila = dict(fila, escenario=escenario, respuesta=respuesta)
+        fila["id"] = str(fila.get("id") or n)
+        validas.append(fila)
+    return validas
+
+
+def leer_salida(ruta: str):
+    """(ids ya escritos, {clave: resultado}) de una salida previa. Descarta una última línea a medio escribir."""
+    hechos, memo = set(), {}
+    if not os.path.exists(ruta):
+        return hechos, memo
+    with open(ruta, "rb+") as f:
+        datos = f.read()
+        if datos and not datos.endswith(b"\n"):
+            f.truncate(datos.rfind(b"\n") + 1)
+            datos = datos[:datos.rfind(b"\n") + 1]
+            logging.warning(f"⚠️ Línea incompleta descartada al final de {ruta}")
+    for linea in datos.decode("utf-8").splitlines():
+        try:
+            registro = json.loads(linea)
+            hechos.add((registro["id"], registro["clave"]))
+            memo[registro["clave"]] = {"veredicto": registro["veredicto"], "evaluacion": registro["evaluacion"]}
+        except (ValueError, KeyError, TypeError):
+            logging.warning(f"⚠️ Línea ignorada en {ruta}: {linea[:80]}")
+    return hechos, memo
+
+
+def evaluar_par(escenario: str, respuesta: str) -> dict:
+    # Proceso aparte sin sesiones interactivas: se usa la prioridad por defecto del planificador
+    with metricas_llm.modo("lote_evaluacion"):
+        evaluacion = chatbot.generar_respuesta(chatbot.prompt_evaluacion_caso(escenario, respuesta),
+                                               sitio="evaluacion").strip()
+        veredicto = chatbot.parsear_veredicto(evaluacion)
+        if veredicto is None:
+            chatbot.METRICAS.fallo_parseo("evaluacion")
+    return {"veredicto": veredicto, "evaluacion": evaluacion}
+
+
+class LoteEvaluacion:
+    def __init__(self, entrada: str, salida: str, en_vuelo: int = None):
+        self.entrada = entrada
+        self.salida = salida
+        # Más hilos que turnos del planificador solo harían cola: se recorta al máximo en vuelo
+        maximo = chatbot.PLANIFICADOR.max_en_vuelo
+        self.en_vuelo = min(en_vuelo or maximo, maximo)
+        if en_vuelo and en_vuelo > maximo:
+            logging.warning(f"⚠️ --en-vuelo {en_vuelo} recortado a {maximo} (turnos del planificador; "
+                            f"ver SGSI_LLM_MAX_EN_VUELO)")
+        self.veredictos = Counter()
+        self.evaluadas = 0
+        self.memo_usadas = 0
+        self.fallidas = 0
+
+    def ejecutar(self) -> dict:
+        filas = leer_entrada(self.entrada)
+        hechos, memo = leer_salida(self.salida)
+        pendientes = {}          # clave -> filas que esperan esa evaluación
+        previas = 0
+        for fila in filas:
+            clave = clave_par(fila["escenario"], fila["respuesta"])
+            if (fila["id"], clave) in hechos:
+                previas += 1
+                continue
+            pendientes.setdefault(clave, []).append(fila)
+        logging.info(f"📝 {len(filas)} filas · {previas} ya evaluadas · {len(pendientes)} pares por resolver "
+                     f"· {self.en_vuelo} en vuelo")
+
+        t0 = time.perf_counter()
+        with open(self.salida, "a", encoding="utf-8") as salida, \
+                ThreadPoolExecutor(max_workers=self.en_vuelo, thread_name_prefix="evaluacion") as executor:
+
+            def escribir(clave, resultado, memoizado):
+                for fila in pendientes[clave]:
+                    registro = dict(fila, clave=clave, memo=memoizado, **resultado)
+                    salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                    self.veredictos[resultado["veredicto"] or "sin_veredicto"] += 1
+                salida.flush()
+
+            futuros = {}
+            for clave, grupo in pendientes.items():
+                if clave in memo:
+                    self.memo_usadas += len(grupo)
+                    escribir(clave, memo[clave], True)
+                else:
+                    futuros[executor.submit(evaluar_par, grupo[0]["escenario"], grupo[0]["respuesta"])] = clave
+            for fut in as_completed(futuros):
+                clave = futuros[fut]
+                try:
+                    resultado = fut.result()
+                except Exception as e:
+                    # Las filas quedan sin escribir y se evalúan al relanzar
+                    self.fallidas += len(pendientes[clave])
+                    logging.error(f"❌ Evaluación de la fila {pendientes[clave][0]['id']}: {e}")
+                    continue
+                self.evaluadas += 1
+                self.memo_usadas += len(pendientes[clave]) - 1
+                escribir(clave, resultado, False)
+                if self.evaluadas % 10 == 0 or self.evaluadas == len(futuros):
+                    minutos = (time.perf_counter() - t0) / 60
+                    logging.info(f"⏱️ {self.evaluadas}/{len(futuros)} · {self.evaluadas / minutos:.1f} evaluaciones/min")
+        duracion = time.perf_counter() - t0
+        return {
+            "filas": len(filas),
+            "filas_previas": previas,
+            "evaluaciones_llm": self.evaluadas,
+            "filas_memoizadas": self.memo_usadas,
+            "filas_fallidas": self.fallidas,
+            "veredictos": dict(self.veredictos),
+            "duracion_s": round(duracion, 2),
+            "evaluaciones_por_min": round(self.evaluadas / (duracion / 60), 2) if duracion > 0 else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evalúa en lote respuestas de casos prácticos (CSV o JSONL)")
+    parser.add_argument("entrada", help=f"CSV con cabecera o JSONL con '{CAMPO_ESCENARIO}' y '{CAMPO_RESPUESTA}'")
+    parser.add_argument("--salida", default=SALIDA_POR_DEFECTO, help="JSONL de resultados; si existe se reanuda")
+    parser.add_argument("--en-vuelo", type=int, help="evaluaciones simultáneas (por defecto y como máximo, los turnos del planificador)")
+    args = parser.parse_args()
+
+    chatbot.iniciar_warm_up()
+    informe = LoteEvaluacion(args.entrada, args.salida, args.en_vuelo).ejecutar()
+    print(json.dumps(informe, ensure_ascii=False, indent=2))
+    logging.info(f"🏁 {informe['evaluaciones_llm']} evaluaciones · {informe['filas_memoizadas']} memoizadas · "
+                 f"{informe['evaluaciones_por_min']} evaluaciones/min")
+    sys.exit(1 if informe["filas_fallidas"] else 0)
+
+
+if __name__ == "__main__":
+    main()
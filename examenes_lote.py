@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chatbot
+import metricas_llm
+import planificador_llm
+from duplicados import IndiceSimilitud
+
+# --------------------------
+# GENERACIÓN DE EXÁMENES EN LOTE
+# --------------------------
+# Genera N exámenes de K preguntas (como modo_examen_rapido) sin interacción, para
+# toda una clase. Cada hueco (examen, número) es un trabajo del pool acotado de hilos;
+# los temas se reparten rotando TEMAS_EXAMEN para que cada examen cubra el temario y
+# un único IndiceSimilitud deduplica en todo el lote. Cada pregunta se añade al JSONL
+# en cuanto termina (una línea por pregunta), así que si el proceso cae se pierde
+# como mucho lo que estaba en vuelo; al relanzar con el mismo fichero solo se generan
+# los huecos que faltan (también los que quedaron con la pregunta fija de respaldo, si
+# el fichero es de una versión anterior). Las vistas del banco se registran con un usuario propio del lote
+# (por defecto "lote-<salida>") para no gastar las preguntas no vistas del usuario de la CLI.
+#
+#   python examenes_lote.py --examenes 40 --preguntas 8 --salida clase.jsonl --agrupar clase.json
+
+SALIDA_POR_DEFECTO = "examenes_lote.jsonl"
+ENUNCIADO_RESPALDO = chatbot.limpiar_enunciado(chatbot.parse_question_block(chatbot.safe_fallback_question())[0])
+
+
+def leer_lote(ruta: str) -> dict:
+    """
+    {(examen, numero): registro} de un JSONL existente. Descarta una última línea a medio
+    escribir; los registros con la pregunta de respaldo cuentan como pendientes.
+    """
+    hechos = {}
+    if not os.path.exists(ruta):
+        return hechos
+    with open(ruta, "rb+") as f:
+        datos = f.read()
+        if datos and not datos.endswith(b"\n"):
+            # Escritura interrumpida: se corta la línea incompleta para poder seguir añadiendo
+            f.truncate(datos.rfind(b"\n") + 1)
+            datos = datos[:datos.rfind(b"\n") + 1]
+            logging.warning(f"⚠️ Línea incompleta descartada al final de {ruta}")
+    for linea in datos.decode("utf-8").splitlines():
+        try:
+            registro = json.loads(linea)
+            if registro.get("respaldo"):
+                continue
+            hechos[(int(registro["examen"]), int(registro["numero"]))] = registro
+        except (ValueError, KeyError, TypeError):
+            logging.warning(f"⚠️ Línea ignorada en {ruta}: {linea[:80]}")
+    return hechos
+
+
+def agrupar_examenes(hechos: dict) -> list:
+    """Lista de exámenes completos o parciales, cada uno con sus preguntas en orden."""
+    examenes = {}
+    for (examen, _), registro in sorted(hechos.items()):
+        examenes.setdefault(examen, []).append(registro)
+    return [{"examen": e, "preguntas": preguntas} for e, preguntas in sorted(examenes.items())]
+
+
+def temas_de_examen(examen: int, total: int, temas: list) -> list:
+    """Temas de las `total` preguntas del examen: rotación desplazada por examen (reparto parejo)."""
+    return [temas[(examen + n) % len(temas)] for n in range(total)]
+
+
+class LoteExamenes:
+    def __init__(self, examenes: int, preguntas: int, ruta: str, temas: list = None, workers: int = None,
+                 usuario: str = None):
+        self.examenes = examenes
+        self.preguntas = preguntas
+        self.ruta = ruta
+        self.temas = list(temas or chatbot.TEMAS_EXAMEN)
+        # Por defecto tantos hilos como generaciones admite el planificador: más solo harían cola
+        self.workers = workers or chatbot.PLANIFICADOR.max_en_vuelo
+        self.usadas = IndiceSimilitud(chatbot.UMBRAL_DUPLICADO_PREGUNTA)
+        self.usuario = usuario or f"lote-{os.path.basename(ruta)}"
+        self.generadas = 0
+        self.respaldo = 0
+        self.fallidas = 0
+
+    def pendientes(self, hechos: dict) -> list:
+        huecos = []
+        for examen in range(1, self.examenes + 1):
+            temas = temas_de_examen(examen - 1, self.preguntas, self.temas)
+            for numero in range(1, self.preguntas + 1):
+                if (examen, numero) not in hechos:
+                    huecos.append((examen, numero, temas[numero - 1]))
+        return huecos
+
+    def _generar(self, examen: int, numero: int, tema: str) -> dict:
+        with planificador_llm.prioridad("fondo"), metricas_llm.modo("lote"):
+            _, clean_q, opts, corr, _ = chatbot.preparar_pregunta_examen(tema, self.usadas, degradar=False,
+                                                                          usuario=self.usuario)
+        justif = chatbot.justificaciones_de(clean_q) or {}
+        return {
+            "examen": examen, "numero": numero, "tema": tema,
+            "pregunta": clean_q, "opciones": opts, "correcta": corr,
+            "justificacion": {L: justif[t] for L, t in opts.items() if t in justif},
+            "respaldo": clean_q == ENUNCIADO_RESPALDO,
+        }
+
+    def ejecutar(self) -> dict:
+        hechos = leer_lote(self.ruta)
+        for registro in hechos.values():
+            self.usadas.agregar(registro.get("pregunta", ""))
+        huecos = self.pendientes(hechos)
+        total = self.examenes * self.preguntas
+        logging.info(f"📝 Lote: {self.examenes} exámenes × {self.preguntas} preguntas · "
+                     f"{total - len(huecos)} ya hechas · {len(huecos)} por generar · {self.workers} hilos")
+        t0 = time.perf_counter()
+        with open(self.ruta, "a", encoding="utf-8") as salida, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lote") as executor:
+            futuros = {executor.submit(self._generar, *hueco): hueco for hueco in huecos}
+            for fut in as_completed(futuros):
+                examen, numero, tema = futuros[fut]
+                try:
+                    registro = fut.result()
+                except Exception as e:
+                    # El hueco queda sin generar; se completa al relanzar sobre el mismo fichero
+                    self.fallidas += 1
+                    logging.error(f"❌ Examen {examen} pregunta {numero} ({tema}): {e}")
+                    continue
+                salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                salida.flush()
+                hechos[(examen, numero)] = registro
+                self.generadas += 1
+                self.respaldo += int(registro["respaldo"])
+                if self.generadas % 10 == 0 or self.generadas == len(huecos):
+                    minutos = (time.perf_counter() - t0) / 60
+                    logging.info(f"⏱️ {self.generadas}/{len(huecos)} · {self.generadas / minutos:.1f} preguntas/min")
+        duracion = time.perf_counter() - t0
+        completos = sum(1 for e in range(1, self.examenes + 1)
+                        if all((e, n) in hechos and not hechos[(e, n)].get("respaldo")
+                               for n in range(1, self.preguntas + 1)))
+        return {
+            "examenes_completos": completos,
+            "preguntas_generadas": self.generadas,
+            "preguntas_previas": total - len(huecos),
+            "fallidas": self.fallidas,
+            "casi_repetidas_regeneradas": self.usadas.rechazados,
+            "preguntas_respaldo": self.respaldo,
+            "duracion_s": round(duracion, 2),
+            "preguntas_por_min": round(self.generadas / (duracion / 60), 2) if duracion > 0 else 0.0,
+            "hechos": hechos,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera exámenes rápidos en lote (JSONL reanudable)")
+    parser.add_argument("--examenes", type=int, required=True, help="número de exámenes (p. ej. uno por estudiante)")
+    parser.add_argument("--preguntas", type=int, default=chatbot.EXAMEN_TOTAL_PREGUNTAS)
+    parser.add_argument("--salida", default=SALIDA_POR_DEFECTO, help="JSONL de preguntas; si existe se reanuda")
+    parser.add_argument("--workers", type=int, help="hilos de generación (por defecto, los turnos del planificador)")
+    parser.add_argument("--temas", help="temas separados por '|' (por defecto TEMAS_EXAMEN)")
+    parser.add_argument("--agrupar", help="escribe además un JSON con los exámenes agrupados")
+    parser.add_argument("--usuario", help="usuario del banco para las vistas (por defecto lote-<salida>)")
+    args = parser.parse_args()
+
+    temas = [t.strip() for t in args.temas.split("|") if t.strip()] if args.temas else None
+    chatbot.iniciar_warm_up()
+    lote = LoteExamenes(args.examenes, args.preguntas, args.salida, temas, args.workers, args.usuario)
+    informe = lote.ejecutar()
+    hechos = informe.pop("hechos")
+    if args.agrupar:
+        with open(args.agrupar, "w", encoding="utf-8") as f:
+            json.dump(agrupar_examenes(hechos), f, ensure_ascii=False, indent=2)
+        logging.info(f"📦 Exámenes agrupados en {args.agrupar}")
+    print(json.dumps(informe, ensure_ascii=False, indent=2))
+    logging.info(f"🏁 {informe['examenes_completos']}/{args.examenes} exámenes completos · "
+                 f"{informe['preguntas_por_min']} preguntas/min")
+    sys.exit(0 if informe["examenes_completos"] == args.examenes else 1)
+
+
+if __name__ == "__main__":
+    main()
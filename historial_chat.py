@@ -0,0 +1,77 @@
+import re
+from collections import deque
+
+# --------------------------
+# HISTORIAL DE CHAT CON PRESUPUESTO DE TOKENS
+# --------------------------
+# Buffer circular de turnos (pregunta/respuesta) limitado por tokens estimados.
+# Cuando se supera el presupuesto, los turnos más antiguos se pliegan en un resumen
+# acumulado (extractivo, sin llamadas al modelo). Se pliega hasta bajar a una
+# fracción del presupuesto para que los mensajes enviados no cambien en cada turno
+# y el servidor pueda reutilizar la caché KV del prefijo.
+
+
+def estimar_tokens(texto: str) -> int:
+    """Aproximación barata: ~4 caracteres por token en español."""
+    return len(texto) // 4 + 1
+
+
+def _recortar(texto: str, max_chars: int) -> str:
+    texto = " ".join(texto.split())
+    return texto if len(texto) <= max_chars else texto[:max_chars - 1].rstrip() + "…"
+
+
+def _primera_frase(texto: str) -> str:
+    partes = re.split(r"(?<=[.!?])\s+", texto.strip(), maxsplit=1)
+    return partes[0] if partes else ""
+
+
+class HistorialChat:
+    def __init__(self, presupuesto_tokens: int = 1200, presupuesto_resumen: int = 250, reserva: float = 0.6):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.presupuesto_resumen = presupuesto_resumen
+        self.reserva = reserva
+        self.turnos = deque()
+        self.resumen = deque()
+        self.tokens = 0
+
+    def __len__(self):
+        return len(self.turnos)
+
+    def limpiar(self):
+        self.turnos.clear()
+        self.resumen.clear()
+        self.tokens = 0
+
+    def agregar(self, pregunta: str, respuesta: str):
+        coste = estimar_tokens(pregunta) + estimar_tokens(respuesta)
+        self.turnos.append((pregunta, respuesta, coste))
+        self.tokens += coste
+        if self.tokens > self.presupuesto_tokens:
+            objetivo = int(self.presupuesto_tokens * self.reserva)
+            while self.turnos and self.tokens > objetivo:
+                self._plegar(self.turnos.popleft())
+
+    def _plegar(self, turno):
+        pregunta, respuesta, coste = turno
+        self.tokens -= coste
+        self.resumen.append(f"- P: {_recortar(pregunta, 120)} → R: {_recortar(_primera_frase(respuesta), 160)}")
+        while len(self.resumen) > 1 and sum(estimar_tokens(l) for l in self.resumen) > self.presupuesto_resumen:
+            self.resumen.popleft()
+
+    def preguntas_recientes(self) -> list:
+        return [p for p, _, _ in self.turnos]
+
+    def mensajes(self, sistema: str, pregunta: str) -> list:
+        """Mensajes para el endpoint: sistema fijo, resumen, turnos y pregunta actual."""
+        mensajes = [{"role": "system", "content": sistema}]
+        if self.resumen:
+            mensajes.append({
+                "role": "system",
+                "content": "Resumen de la conversación anterior:\n" + "\n".join(self.resumen),
+            })
+        for p, r, _ in self.turnos:
+            mensajes.append({"role": "user", "content": p})
+            mensajes.append({"role": "assistant", "content": r})
+        mensajes.append({"role": "user", "content": pregunta})
+        return mensajes
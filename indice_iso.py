@@ -0,0 +1,280 @@
+import argparse
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, deque
+
+from clasificador_sgsi import normalizar
+
+# --------------------------
+# ÍNDICE LOCAL DE CONTROLES ISO (BM25)
+# --------------------------
+# Corpus incluido (controles_iso.jsonl): cláusulas de ISO 27001, controles del Anexo A /
+# ISO 27002:2022 y el proceso de ISO 27005, con título y resumen breve. Se precalcula
+# un índice invertido BM25 en un fichero binario compacto que se abre con mmap: al
+# cargar solo se decodifica la tabla de términos; las listas de postings, longitudes y
+# documentos se leen del mapa bajo demanda.
+#
+#   python indice_iso.py construir            # tras editar el corpus
+#   python indice_iso.py buscar "copias de seguridad ransomware"
+#   python indice_iso.py benchmark --consultas 2000
+#
+# Formato (little-endian): cabecera MAGIA/versión/nº secciones, nº documentos, nº
+# términos, longitud media, k1 y b; después (desplazamiento, tamaño) de cada sección.
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RUTA_CORPUS = os.path.join(DIRECTORIO, "controles_iso.jsonl")
+RUTA_INDICE = os.path.join(DIRECTORIO, "controles_iso.idx")
+
+MAGIA = b"SGSIBM25"
+VERSION = 1
+CABECERA = struct.Struct("<8sHHIIfff")
+SECCION = struct.Struct("<II")
+SECCIONES = ("terminos", "idf", "postings_off", "postings", "longitudes", "docs_off", "docs")
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset("""
+a al algo ante antes como con contra cual cuales cuando de del desde donde durante e el ella ellas ellos en
+entre era es esa ese eso esta este esto estos estas fue ha hay la las le les lo los mas me mi muy no nos o
+para pero por que quien se segun ser si sin sobre son su sus tambien te tiene u un una uno unos unas y ya
+debe deben cada otro otra otros otras puede pueden hace hacer
+""".split())
+
+# Sufijos frecuentes del español, del más largo al más corto (raíz mínima de 4 letras)
+SUFIJOS = ("aciones", "amientos", "imientos", "amiento", "imiento", "idades", "acion", "ciones", "mente",
+           "idad", "ibles", "ables", "cion", "ible", "able", "ivos", "ivas", "ivo", "iva",
+           "ar", "er", "ir", "os", "as", "es", "o", "a", "e", "s")
+
+
+def raiz(palabra: str) -> str:
+    if palabra.isdigit():
+        return palabra
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 4:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def tokenizar(texto: str) -> list:
+    return [raiz(p) for p in normalizar(texto).split() if p not in STOPWORDS and (len(p) > 2 or p.isdigit())]
+
+
+def texto_documento(doc: dict) -> str:
+    # El título cuenta dos veces: es la parte más específica del control
+    return f"{doc['norma']} {doc['codigo']} {doc['titulo']} {doc['titulo']} {doc['resumen']}"
+
+
+def leer_corpus(ruta: str = RUTA_CORPUS) -> list:
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def _little_endian(datos: array) -> bytes:
+    if sys.byteorder != "little":
+        datos = array(datos.typecode, datos)
+        datos.byteswap()
+    return datos.tobytes()
+
+
+def construir(corpus: str = RUTA_CORPUS, salida: str = RUTA_INDICE) -> dict:
+    """Construye el índice binario a partir del corpus JSONL. Devuelve un resumen."""
+    docs = leer_corpus(corpus)
+    tokens = [tokenizar(texto_documento(d)) for d in docs]
+    indice = {}
+    for i, toks in enumerate(tokens):
+        for termino, tf in Counter(toks).items():
+            indice.setdefault(termino, []).append((i, tf))
+    terminos = sorted(indice)
+    n = len(docs)
+    longitudes = array("H", (len(t) for t in tokens))
+    media = sum(longitudes) / n if n else 0.0
+
+    idf = array("f")
+    postings_off = array("I", [0])
+    postings = array("H")
+    for termino in terminos:
+        lista = indice[termino]
+        idf.append(math.log(1 + (n - len(lista) + 0.5) / (len(lista) + 0.5)))
+        for doc, tf in lista:
+            postings.extend((doc, min(tf, 0xFFFF)))
+        postings_off.append(len(postings) // 2)
+
+    docs_off = array("I", [0])
+    docs_blob = bytearray()
+    for d in docs:
+        docs_blob += json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        docs_off.append(len(docs_blob))
+
+    secciones = {
+        "terminos": "\n".join(terminos).encode("utf-8"),
+        "idf": _little_endian(idf),
+        "postings_off": _little_endian(postings_off),
+        "postings": _little_endian(postings),
+        "longitudes": _little_endian(longitudes),
+        "docs_off": _little_endian(docs_off),
+        "docs": bytes(docs_blob),
+    }
+    desplazamiento = CABECERA.size + SECCION.size * len(SECCIONES)
+    tabla, cuerpo = [], bytearray()
+    for nombre in SECCIONES:
+        cuerpo += b"\0" * (-(desplazamiento + len(cuerpo)) % 4)   # alineación de los arrays
+        tabla.append(SECCION.pack(desplazamiento + len(cuerpo), len(secciones[nombre])))
+        cuerpo += secciones[nombre]
+    temporal = salida + ".tmp"
+    with open(temporal, "wb") as f:
+        f.write(CABECERA.pack(MAGIA, VERSION, len(SECCIONES), n, len(terminos), media, K1, B))
+        f.write(b"".join(tabla))
+        f.write(cuerpo)
+    os.replace(temporal, salida)
+    return {"documentos": n, "terminos": len(terminos), "postings": len(postings) // 2,
+            "bytes": os.path.getsize(salida)}
+
+
+class IndiceISO:
+    def __init__(self, ruta: str = RUTA_INDICE, ventana_metricas: int = 500):
+        t0 = time.perf_counter()
+        self.ruta = ruta
+        with open(ruta, "rb") as f:
+            self.mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magia, version, n_secciones, self.n_docs, n_terminos, self.media, self.k1, self.b = \
+            CABECERA.unpack_from(self.mapa, 0)
+        if magia != MAGIA or version != VERSION or n_secciones != len(SECCIONES):
+            raise ValueError(f"{ruta} no es un índice ISO v{VERSION}; reconstrúyelo con 'python indice_iso.py construir'")
+        vista = memoryview(self.mapa)
+        secciones = {}
+        for i, nombre in enumerate(SECCIONES):
+            desplazamiento, tamano = SECCION.unpack_from(self.mapa, CABECERA.size + i * SECCION.size)
+            secciones[nombre] = vista[desplazamiento:desplazamiento + tamano]
+
+        def arreglo(nombre, tipo):
+            if sys.byteorder == "little":
+                return secciones[nombre].cast(tipo)
+            copia = array(tipo, secciones[nombre].tobytes())
+            copia.byteswap()
+            return copia
+
+        palabras = bytes(secciones["terminos"]).decode("utf-8").split("\n") if n_terminos else []
+        self.terminos = {t: i for i, t in enumerate(palabras)}
+        self.idf = arreglo("idf", "f")
+        self.postings_off = arreglo("postings_off", "I")
+        self.postings = arreglo("postings", "H")
+        self.longitudes = arreglo("longitudes", "H")
+        self.docs_off = arreglo("docs_off", "I")
+        self.docs = secciones["docs"]
+        self.lock = threading.Lock()
+        self.latencias = deque(maxlen=ventana_metricas)
+        self.consultas = 0
+        self.carga_ms = (time.perf_counter() - t0) * 1000
+
+    def documento(self, i: int) -> dict:
+        return json.loads(bytes(self.docs[self.docs_off[i]:self.docs_off[i + 1]]).decode("utf-8"))
+
+    def buscar(self, consulta: str, k: int = 3, minimo: float = 0.0, relativo: float = 0.0) -> list:
+        """
+        [(puntuación, documento)] de los k documentos con mayor BM25. Se descartan los que no
+        superan `minimo` ni la fracción `relativo` de la mejor puntuación (coincidencias débiles).
+        """
+        t0 = time.perf_counter()
+        puntuaciones = {}
+        for termino in set(tokenizar(consulta)):
+            t = self.terminos.get(termino)
+            if t is None:
+                continue
+            idf = self.idf[t]
+            for p in range(self.postings_off[t], self.postings_off[t + 1]):
+                doc, tf = self.postings[2 * p], self.postings[2 * p + 1]
+                norma = self.k1 * (1 - self.b + self.b * self.longitudes[doc] / self.media)
+                puntuaciones[doc] = puntuaciones.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norma)
+        mejores = heapq.nlargest(k, ((s, d) for d, s in puntuaciones.items() if s > minimo))
+        if mejores:
+            mejores = [(s, d) for s, d in mejores if s >= relativo * mejores[0][0]]
+        resultado = [(round(s, 3), self.documento(d)) for s, d in mejores]
+        with self.lock:
+            self.consultas += 1
+            self.latencias.append(time.perf_counter() - t0)
+        return resultado
+
+    def metricas(self) -> dict:
+        with self.lock:
+            lat = sorted(self.latencias)
+        p = lambda q: round(lat[min(len(lat) - 1, int(len(lat) * q))] * 1e6, 1) if lat else 0.0
+        return {"documentos": self.n_docs, "terminos": len(self.terminos), "carga_ms": round(self.carga_ms, 3),
+                "consultas": self.consultas, "latencia_p50_us": p(0.5), "latencia_p95_us": p(0.95)}
+
+    def cerrar(self):
+        # Las vistas de memoria deben liberarse antes de cerrar el mapa
+        for nombre in ("idf", "postings_off", "postings", "longitudes", "docs_off", "docs"):
+            vista = getattr(self, nombre)
+            if isinstance(vista, memoryview):
+                vista.release()
+        self.mapa.close()
+
+
+def abrir(ruta: str = RUTA_INDICE, corpus: str = RUTA_CORPUS) -> IndiceISO:
+    """Abre el índice; lo (re)construye si falta o si el corpus es más reciente."""
+    if os.path.exists(corpus) and (not os.path.exists(ruta) or os.path.getmtime(corpus) > os.path.getmtime(ruta)):
+        resumen = construir(corpus, ruta)
+        logging.info(f"📚 Índice ISO construido: {resumen}")
+    return IndiceISO(ruta)
+
+
+def formatear(resultados: list) -> str:
+    return "\n".join(f"- {d['norma'].split(':')[0]} {d['codigo']} {d['titulo']}: {d['resumen']}"
+                     for _, d in resultados)
+
+
+CONSULTAS_BENCHMARK = [
+    "¿Qué es un SGSI?", "control de acceso y mínimo privilegio", "copias de seguridad ransomware",
+    "gestión de incidentes de seguridad", "auditoría interna ISO 27001", "tratamiento del riesgo residual",
+    "clasificación y etiquetado de la información", "proveedores en la nube", "phishing concienciación",
+    "declaración de aplicabilidad anexo A", "contraseñas y autenticación multifactor", "continuidad del negocio",
+    "registro de eventos y monitorización", "datos personales RGPD", "Un practicante perdió una USB con clientes",
+]
+
+
+def benchmark(ruta: str, consultas: int, k: int) -> dict:
+    cargas = []
+    for _ in range(20):
+        indice = IndiceISO(ruta)
+        cargas.append(indice.carga_ms)
+        indice.cerrar()
+    indice = IndiceISO(ruta)
+    for i in range(consultas):
+        indice.buscar(CONSULTAS_BENCHMARK[i % len(CONSULTAS_BENCHMARK)], k)
+    cargas.sort()
+    return {**indice.metricas(), "carga_p50_ms": round(cargas[len(cargas) // 2], 3),
+            "bytes": os.path.getsize(ruta)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice BM25 local de controles ISO 27001/27002/27005")
+    parser.add_argument("accion", choices=("construir", "buscar", "benchmark"))
+    parser.add_argument("consulta", nargs="?", default="")
+    parser.add_argument("--corpus", default=RUTA_CORPUS)
+    parser.add_argument("--indice", default=RUTA_INDICE)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--consultas", type=int, default=2000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if args.accion == "construir":
+        print(json.dumps(construir(args.corpus, args.indice), ensure_ascii=False))
+    elif args.accion == "buscar":
+        for puntuacion, doc in abrir(args.indice, args.corpus).buscar(args.consulta, args.k):
+            print(f"{puntuacion:6.2f}  {doc['norma']} {doc['codigo']} {doc['titulo']}")
+    else:
+        abrir(args.indice, args.corpus).cerrar()
+        print(json.dumps(benchmark(args.indice, args.consultas, args.k), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# --------------------------
+# MÉTRICAS POR LLAMADA AL MODELO
+# --------------------------
+# Cada llamada se etiqueta con su sitio (filtro, pregunta_json, explicacion, escenario,
+# evaluacion, chat...) y con el modo en curso (contextvar, igual que la prioridad del
+# planificador). Se acumulan contadores e histogramas en memoria, exportables en
+# formato de texto de Prometheus o como JSON.
+
+BUCKETS_SEGUNDOS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_TOKENS_S = (1, 2, 5, 10, 20, 40, 80, 160, 320)
+
+_modo_actual = contextvars.ContextVar("modo_llm", default="general")
+
+
+@contextmanager
+def modo(nombre: str):
+    """Etiqueta con `nombre` las llamadas hechas dentro del bloque."""
+    token = _modo_actual.set(nombre)
+    try:
+        yield
+    finally:
+        _modo_actual.reset(token)
+
+
+def modo_actual() -> str:
+    return _modo_actual.get()
+
+
+class Histograma:
+    __slots__ = ("limites", "cuentas", "suma", "n")
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)   # la última es +Inf
+        self.suma = 0.0
+        self.n = 0
+
+    def observar(self, valor: float):
+        i = 0
+        while i < len(self.limites) and valor > self.limites[i]:
+            i += 1
+        self.cuentas[i] += 1
+        self.suma += valor
+        self.n += 1
+
+    def cuantil(self, q: float) -> float:
+        """Aproximación por el límite superior del bucket (como histogram_quantile sin interpolar)."""
+        if not self.n:
+            return 0.0
+        objetivo = q * self.n
+        acumulado = 0
+        for limite, cuenta in zip(self.limites, self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return limite
+        return float("inf")
+
+    def a_dict(self) -> dict:
+        return {"n": self.n, "suma": round(self.suma, 4), "media": round(self.suma / self.n, 4) if self.n else 0.0,
+                "p50": self.cuantil(0.5), "p95": self.cuantil(0.95),
+                "buckets": dict(zip([str(l) for l in self.limites] + ["+Inf"], self.cuentas))}
+
+
+class _Serie:
+    __slots__ = ("llamadas", "errores", "reintentos", "tokens_prompt", "tokens_completion",
+                 "latencia", "espera", "tokens_s", "ttft")
+
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.reintentos = 0
+        self.tokens_prompt = 0
+        self.tokens_completion = 0
+        self.latencia = Histograma(BUCKETS_SEGUNDOS)
+        self.espera = Histograma(BUCKETS_SEGUNDOS)
+        self.tokens_s = Histograma(BUCKETS_TOKENS_S)
+        self.ttft = Histograma(BUCKETS_SEGUNDOS)
+
+
+class MetricasLLM:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}                # (sitio, modo) -> _Serie
+        self.fallos_parseo = Counter()  # (sitio, modo) -> n
+        self.inicio = time.time()
+
+    def _serie(self, sitio: str, modo_: str) -> _Serie:
+        serie = self.series.get((sitio, modo_))
+        if serie is None:
+            serie = self.series[(sitio, modo_)] = _Serie()
+        return serie
+
+    def registrar(self, sitio: str, latencia: float, espera: float = 0.0, uso: dict = None, intentos: int = 1,
+                  error: bool = False, ttft: float = None):
+        """Una llamada terminada. `uso` es el campo `usage` de la respuesta OpenAI-compatible."""
+        uso = uso or {}
+        completion = int(uso.get("completion_tokens") or 0)
+        generacion = latencia - espera
+        with self.lock:
+            serie = self._serie(sitio, modo_actual())
+            serie.llamadas += 1
+            serie.errores += int(error)
+            serie.reintentos += max(0, intentos - 1)
+            serie.tokens_prompt += int(uso.get("prompt_tokens") or 0)
+            serie.tokens_completion += completion
+            serie.latencia.observar(latencia)
+            serie.espera.observar(espera)
+            if completion and generacion > 0:
+                serie.tokens_s.observar(completion / generacion)
+            if ttft is not None:
+                serie.ttft.observar(ttft)
+
+    def fallo_parseo(self, sitio: str):
+        with self.lock:
+            self.fallos_parseo[(sitio, modo_actual())] += 1
+
+    def total_llamadas(self) -> int:
+        with self.lock:
+            return sum(s.llamadas for s in self.series.values())
+
+    def a_json(self) -> dict:
+        with self.lock:
+            claves = sorted(set(self.series) | set(self.fallos_parseo))
+            datos = {"desde": self.inicio, "hasta": time.time(), "llamadas": []}
+            for sitio, modo_ in claves:
+                serie = self.series.get((sitio, modo_)) or _Serie()
+                datos["llamadas"].append({
+                    "sitio": sitio, "modo": modo_,
+                    "llamadas": serie.llamadas, "errores": serie.errores, "reintentos": serie.reintentos,
+                    "fallos_parseo": self.fallos_parseo[(sitio, modo_)],
+                    "tokens_prompt": serie.tokens_prompt, "tokens_completion": serie.tokens_completion,
+                    "latencia_s": serie.latencia.a_dict(), "espera_cola_s": serie.espera.a_dict(),
+                    "tokens_por_s": serie.tokens_s.a_dict(), "primer_token_s": serie.ttft.a_dict(),
+                })
+        return datos
+
+    def prometheus(self) -> str:
+        """Exposición en formato de texto de Prometheus (version 0.0.4)."""
+        lineas = []
+
+        def contador(nombre, ayuda, valores):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} counter")
+            for (sitio, modo_), v in valores:
+                lineas.append(f'{nombre}{{sitio="{sitio}",modo="{modo_}"}} {v}')
+
+        def histograma(nombre, ayuda, atributo):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} histogram")
+            for (sitio, modo_), serie in series:
+                h = getattr(serie, atributo)
+                if not h.n:
+                    continue
+                etiquetas = f'sitio="{sitio}",modo="{modo_}"'
+                acumulado = 0
+                for limite, cuenta in zip(list(h.limites) + ["+Inf"], h.cuentas):
+                    acumulado += cuenta
+                    lineas.append(f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+                lineas.append(f"{nombre}_sum{{{etiquetas}}} {h.suma:.6f}")
+                lineas.append(f"{nombre}_count{{{etiquetas}}} {h.n}")
+
+        with self.lock:
+            series = sorted(self.series.items())
+            contador("sgsi_llm_llamadas_total", "Llamadas al modelo.", [(k, s.llamadas) for k, s in series])
+            contador("sgsi_llm_errores_total", "Llamadas que terminaron en error.", [(k, s.errores) for k, s in series])
+            contador("sgsi_llm_reintentos_total", "Reenvíos: reintentos con jitter, failover y hedging.",
+                     [(k, s.reintentos) for k, s in series])
+            contador("sgsi_llm_fallos_parseo_total", "Salidas del modelo que no se pudieron interpretar.",
+                     sorted(self.fallos_parseo.items()))
+            contador("sgsi_llm_tokens_prompt_total", "Tokens de prompt según el campo usage.",
+                     [(k, s.tokens_prompt) for k, s in series])
+            contador("sgsi_llm_tokens_completion_total", "Tokens generados según el campo usage.",
+                     [(k, s.tokens_completion) for k, s in series])
+            histograma("sgsi_llm_latencia_segundos", "Latencia total de la llamada (cola incluida).", "latencia")
+            histograma("sgsi_llm_espera_cola_segundos", "Espera en el planificador antes de enviar.", "espera")
+            histograma("sgsi_llm_tokens_por_segundo", "Tokens generados por segundo de generación.", "tokens_s")
+            histograma("sgsi_llm_primer_token_segundos", "Tiempo al primer token en streaming.", "ttft")
+        return "\n".join(lineas) + "\n"
+
+    def volcar(self, ruta: str):
+        """Escribe el JSON en `ruta` (pensado para atexit). No hace nada si no hubo llamadas."""
+        if not ruta or not self.total_llamadas():
+            return
+        try:
+            with open(ruta, "w", encoding="utf-8") as f:
+                json.dump(self.a_json(), f, ensure_ascii=False, indent=2)
+            logging.info(f"📈 Métricas del modelo guardadas en {ruta}")
+        except OSError as e:
+            logging.error(f"❌ No se pudieron guardar las métricas: {e}")
+
+
+# --------------------------
+# PERFILADOR POR MUESTREO (opcional)
+# --------------------------
+# Un hilo toma la pila del hilo perfilado cada `intervalo` segundos y cuenta las pilas
+# en formato "collapsed" (una línea por pila: marcos separados por ';' y el número de
+# muestras), apto para flamegraph.pl o speedscope. Coste despreciable si no se activa.
+
+class PerfiladorMuestreo:
+    def __init__(self, hilo_id: int = None, intervalo: float = 0.005):
+        self.hilo_id = hilo_id or threading.get_ident()
+        self.intervalo = intervalo
+        self.muestras = Counter()
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def _muestrear(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.hilo_id)
+            pila = []
+            while frame is not None:
+                codigo = frame.f_code
+                pila.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+                frame = frame.f_back
+            if pila:
+                self.muestras[";".join(reversed(pila))] += 1
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True, name="perfilador")
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{pila} {n}\n" for pila, n in self.muestras.most_common())
+
+
+@contextmanager
+def perfilar(nombre: str, directorio: str = None):
+    """Perfila el bloque si hay `directorio` (p. ej. SGSI_PERFIL) y guarda perfil_<nombre>_<ts>.txt."""
+    if not directorio:
+        yield
+        return
+    perfilador = PerfiladorMuestreo().iniciar()
+    try:
+        yield
+    finally:
+        perfilador.detener()
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, f"perfil_{nombre}_{int(time.time())}.txt")
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(perfilador.collapsed())
+        logging.info(f"🔬 Perfil de '{nombre}' ({sum(perfilador.muestras.values())} muestras) en {ruta}")
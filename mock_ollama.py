@@ -0,0 +1,215 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --------------------------
+# SERVIDOR MOCK DE OLLAMA (/v1/chat/completions)
+# --------------------------
+# Sustituto local para pruebas y benchmarks: simula el coste de evaluar el prompt
+# (tokens/s) y de generar (tokens/s), soporta streaming SSE, respeta max_tokens y
+# puede inyectar errores HTTP 500 y cuelgues (timeouts). La salida imita el
+# formato que espera cada llamada del chatbot.
+
+ESCENARIOS = [
+    "Un empleado del área de finanzas recibió un correo que simulaba ser del banco y "
+    "entregó sus credenciales. Horas después se detectaron accesos desde otra ciudad al sistema contable.",
+    "El servidor de archivos amaneció con los documentos cifrados y una nota de rescate. "
+    "El último respaldo verificado tiene tres semanas.",
+    "Un practicante copió una base de datos de clientes a una memoria USB personal que luego perdió.",
+]
+
+
+def estimar_tokens(texto: str) -> int:
+    return max(1, len(texto) // 4)
+
+
+PLANTILLAS_PREGUNTA = [
+    "¿Qué control de ISO 27002 aplica mejor a {tema}?",
+    "En {tema}, ¿cuál es la primera acción que exige la norma?",
+    "¿Quién es responsable de aprobar lo relativo a {tema}?",
+    "¿Qué evidencia revisaría un auditor sobre {tema}?",
+    "¿Cada cuánto conviene revisar {tema} dentro del SGSI?",
+]
+
+
+def salida_para(prompt: str) -> str:
+    """Respuesta plausible según el tipo de llamada que hace el chatbot."""
+    n = random.randint(1000, 999999)
+    tema = re.search(r"Tema: (.+)", prompt)
+    tema = tema.group(1).strip().lower() if tema else "la seguridad de la información"
+    if "Responde solo con 'Sí' o 'No'" in prompt:
+        return "Sí"
+    if "objeto JSON" in prompt:
+        return json.dumps({
+            "pregunta": random.choice(PLANTILLAS_PREGUNTA).format(tema=tema),
+            "opciones": {"A": "Gestión de accesos privilegiados", "B": "Cifrado de datos en reposo",
+                         "C": "Capacitación en concienciación"},
+            "correcta": random.choice("ABC"),
+            "justificacion": {"A": "Limita quién puede administrar sistemas críticos.",
+                              "B": "Protege la confidencialidad si se pierde el soporte.",
+                              "C": "Reduce errores humanos, pero no es un control técnico."},
+        }, ensure_ascii=False)
+    if "Formato EXACTO" in prompt:
+        return (f"📘 Pregunta: ¿Cuál es el objetivo principal del requisito {n} de ISO 27001?\n"
+                "A) Definir el alcance del SGSI *\nB) Comprar un antivirus\nC) Contratar auditores externos")
+    if "Explica en máximo 3 líneas" in prompt:
+        return ("La opción correcta define el alcance del SGSI, requisito base de ISO 27001. "
+                "La opción elegida no responde a un requisito de la norma.")
+    if "Genera un escenario" in prompt:
+        return random.choice(ESCENARIOS) + f" (Caso {n})"
+    if "Evalúa la respuesta" in prompt:
+        return "⚠️ Parcial. Aislar el equipo es correcto; falta notificar al responsable de seguridad."
+    return ("Un SGSI (Sistema de Gestión de Seguridad de la Información) es el conjunto de políticas, "
+            "procesos y controles que protegen la confidencialidad, integridad y disponibilidad de la información. "
+            "ISO 27001 define sus requisitos y el Anexo A lista los controles de referencia.")
+
+
+class ServidorMock:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, prompt_tps: float = 400.0, gen_tps: float = 20.0,
+                 latencia_base: float = 0.05, tasa_error: float = 0.0, tasa_cuelgue: float = 0.0,
+                 duracion_cuelgue: float = 120.0, latencia_carga: float = 0.0):
+        self.prompt_tps = prompt_tps
+        self.gen_tps = gen_tps
+        self.latencia_base = latencia_base
+        self.tasa_error = tasa_error
+        self.tasa_cuelgue = tasa_cuelgue
+        self.duracion_cuelgue = duracion_cuelgue
+        self.latencia_carga = latencia_carga     # carga del modelo en frío (/api/generate)
+        self.lock = threading.Lock()
+        self.stats = {"peticiones": 0, "errores": 0, "cuelgues": 0, "tokens_prompt": 0, "tokens_generados": 0}
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, estado, datos):
+                cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def do_GET(self):
+                if self.path.endswith("/models"):
+                    self._json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                elif self.path.endswith("/stats"):
+                    with mock.lock:
+                        self._json(200, dict(mock.stats))
+                else:
+                    self._json(404, {"error": "not found"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.endswith("/api/generate"):
+                    time.sleep(mock.latencia_carga)
+                    self._json(200, {"model": body.get("model", "mock"), "response": "", "done": True,
+                                     "done_reason": "load"})
+                    return
+                mock.atender(self, body)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://{host}:{self.port}/v1/chat/completions"
+        self.hilo = None
+
+    def atender(self, handler, body: dict):
+        mensajes = body.get("messages", [])
+        prompt = "\n".join(str(m.get("content", "")) for m in mensajes)
+        ultimo = str(mensajes[-1].get("content", "")) if mensajes else ""
+        texto = salida_para(ultimo)
+        max_tokens = int(body.get("max_tokens") or 256)
+        finish = "stop"
+        if estimar_tokens(texto) > max_tokens:
+            texto, finish = texto[:max_tokens * 4], "length"
+        for stop in body.get("stop") or []:
+            if stop and stop in texto:
+                texto = texto[:texto.index(stop)]
+        tokens_prompt, tokens_gen = estimar_tokens(prompt), estimar_tokens(texto)
+        azar = random.random()
+        with self.lock:
+            self.stats["peticiones"] += 1
+            self.stats["tokens_prompt"] += tokens_prompt
+            if azar < self.tasa_error:
+                self.stats["errores"] += 1
+            elif azar < self.tasa_error + self.tasa_cuelgue:
+                self.stats["cuelgues"] += 1
+            else:
+                self.stats["tokens_generados"] += tokens_gen
+
+        time.sleep(self.latencia_base + tokens_prompt / self.prompt_tps)
+        if azar < self.tasa_error:
+            handler._json(500, {"error": "fallo inyectado"})
+            return
+        if azar < self.tasa_error + self.tasa_cuelgue:
+            time.sleep(self.duracion_cuelgue)
+            handler.close_connection = True
+            return
+
+        uso = {"prompt_tokens": tokens_prompt, "completion_tokens": tokens_gen,
+               "total_tokens": tokens_prompt + tokens_gen}
+        if body.get("stream"):
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.send_header("Cache-Control", "no-cache")
+            handler.send_header("Connection", "close")
+            handler.end_headers()
+            handler.close_connection = True
+            trozos = [texto[i:i + 4] for i in range(0, len(texto), 4)]
+            for trozo in trozos:
+                time.sleep(1.0 / self.gen_tps)
+                evento = {"choices": [{"index": 0, "delta": {"content": trozo}, "finish_reason": None}]}
+                handler.wfile.write(f"data: {json.dumps(evento, ensure_ascii=False)}\n\n".encode("utf-8"))
+                handler.wfile.flush()
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish}], "usage": uso}
+            handler.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            handler.wfile.flush()
+            return
+        time.sleep(tokens_gen / self.gen_tps)
+        handler._json(200, {
+            "id": f"mock-{random.randint(0, 1 << 30)}",
+            "object": "chat.completion",
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": finish}],
+            "usage": uso,
+        })
+
+    def iniciar(self):
+        self.hilo = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="mock-ollama")
+        self.hilo.start()
+        return self
+
+    def detener(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor mock compatible con /v1/chat/completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--prompt-tps", type=float, default=400.0, help="tokens/s de evaluación del prompt")
+    parser.add_argument("--gen-tps", type=float, default=20.0, help="tokens/s de generación")
+    parser.add_argument("--latencia-base", type=float, default=0.05)
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="fracción de respuestas HTTP 500")
+    parser.add_argument("--tasa-cuelgue", type=float, default=0.0, help="fracción de peticiones que no responden")
+    args = parser.parse_args()
+    mock = ServidorMock(args.host, args.port, args.prompt_tps, args.gen_tps, args.latencia_base,
+                        args.tasa_error, args.tasa_cuelgue)
+    print(f"🧪 Mock de Ollama en {mock.url}")
+    try:
+        mock.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
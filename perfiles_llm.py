@@ -0,0 +1,126 @@
+import logging
+import math
+import threading
+from collections import deque
+
+# --------------------------
+# PERFILES DE GENERACIÓN POR TIPO DE LLAMADA
+# --------------------------
+# Cada sitio (filtro, pregunta_json, explicacion, escenario...) tiene un perfil con su
+# temperatura, secuencias de parada, tope de tokens y un validador de la salida. En los
+# perfiles adaptativos el max_tokens que se envía no es el tope sino el p95 de las
+# longitudes observadas (tokens generados según `usage`) con un margen: el modelo deja
+# de gastar tokens en texto que nadie usa. Una salida cortada por max_tokens
+# (finish_reason "length") cuenta como si hubiera necesitado el tope, así que unas pocas
+# truncadas devuelven el presupuesto al tope; y si además no pasa el validador, el
+# llamador la repite una vez con el tope. Solo se observa la salida que el llamador
+# devuelve, no el intento descartado (cortado o del modelo pequeño antes de escalar).
+
+VENTANA = 64          # longitudes recientes por sitio
+MIN_MUESTRAS = 8      # por debajo se usa el tope
+CUANTIL = 0.95
+MARGEN = 1.2          # presupuesto = p95 * MARGEN + HOLGURA
+HOLGURA = 8
+
+
+class PerfilGeneracion:
+    def __init__(self, max_tokens: int, temperature: float = 0.25, stop: tuple = (), validador=None,
+                 adaptativo: bool = True, minimo: int = 16):
+        self.max_tokens = max_tokens      # tope: nunca se pide más
+        self.temperature = temperature
+        self.stop = list(stop)
+        self.validador = validador        # callable(texto) -> bool
+        self.adaptativo = adaptativo
+        self.minimo = min(minimo, max_tokens)
+
+
+class _Observaciones:
+    __slots__ = ("longitudes", "llamadas", "truncadas", "invalidas", "ampliadas", "tokens")
+
+    def __init__(self):
+        self.longitudes = deque(maxlen=VENTANA)
+        self.llamadas = 0
+        self.truncadas = 0
+        self.invalidas = 0
+        self.ampliadas = 0
+        self.tokens = 0
+
+
+def cuantil(valores, q: float) -> int:
+    orden = sorted(valores)
+    return orden[max(0, math.ceil(q * len(orden)) - 1)]
+
+
+class PerfilesLLM:
+    def __init__(self, perfiles: dict, por_defecto: PerfilGeneracion = None):
+        self.perfiles = dict(perfiles)
+        self.por_defecto = por_defecto or PerfilGeneracion(250, adaptativo=False)
+        self.lock = threading.Lock()
+        self.obs = {}                       # sitio -> _Observaciones
+
+    def perfil(self, sitio: str) -> PerfilGeneracion:
+        return self.perfiles.get(sitio, self.por_defecto)
+
+    def _obs(self, sitio: str) -> _Observaciones:
+        obs = self.obs.get(sitio)
+        if obs is None:
+            obs = self.obs[sitio] = _Observaciones()
+        return obs
+
+    def presupuesto(self, sitio: str) -> int:
+        """max_tokens a pedir ahora para `sitio`: el tope o, con muestras suficientes, el p95 con margen."""
+        perfil = self.perfil(sitio)
+        if not perfil.adaptativo:
+            return perfil.max_tokens
+        with self.lock:
+            longitudes = list(self._obs(sitio).longitudes)
+        if len(longitudes) < MIN_MUESTRAS:
+            return perfil.max_tokens
+        estimado = int(cuantil(longitudes, CUANTIL) * MARGEN) + HOLGURA
+        return max(perfil.minimo, min(perfil.max_tokens, estimado))
+
+    def valida(self, sitio: str, texto: str) -> bool:
+        validador = self.perfil(sitio).validador
+        if validador is None:
+            return bool(texto and texto.strip())
+        try:
+            return bool(validador(texto))
+        except Exception:
+            return False
+
+    def observar(self, sitio: str, tokens: int, truncada: bool, valida: bool, ampliada: bool = False):
+        """Una salida terminada: `tokens` generados (0 si el servidor no los informa)."""
+        perfil = self.perfil(sitio)
+        with self.lock:
+            obs = self._obs(sitio)
+            obs.llamadas += 1
+            obs.truncadas += int(truncada)
+            obs.invalidas += int(not valida)
+            obs.ampliadas += int(ampliada)
+            obs.tokens += tokens
+            if truncada:
+                obs.longitudes.append(perfil.max_tokens)
+            elif tokens:
+                obs.longitudes.append(tokens)
+        if truncada:
+            logging.info(f"✂️ Salida de '{sitio}' cortada por max_tokens ({tokens} tokens)")
+
+    def a_dict(self) -> dict:
+        sitios = sorted(set(self.perfiles) | set(self.obs))
+        datos = {}
+        for sitio in sitios:
+            perfil = self.perfil(sitio)
+            with self.lock:
+                obs = self._obs(sitio)
+                longitudes = list(obs.longitudes)
+                contadores = {"llamadas": obs.llamadas, "truncadas": obs.truncadas, "invalidas": obs.invalidas,
+                              "ampliadas": obs.ampliadas,
+                              "tokens_por_llamada": round(obs.tokens / obs.llamadas, 1) if obs.llamadas else 0.0}
+            datos[sitio] = {
+                "tope": perfil.max_tokens, "presupuesto": self.presupuesto(sitio), "stop": perfil.stop,
+                "temperature": perfil.temperature,
+                "p50": cuantil(longitudes, 0.5) if longitudes else 0,
+                "p95": cuantil(longitudes, CUANTIL) if longitudes else 0,
+                **contadores,
+            }
+        return datos
@@ -0,0 +1,122 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from resiliencia_llm import ErrorLLM
+
+# --------------------------
+# PLANIFICADOR DE LLAMADAS AL MODELO
+# --------------------------
+# Ollama en local solo ejecuta unas pocas generaciones a la vez. Todas las llamadas
+# pasan por aquí: se limita el número en vuelo, se atiende primero la clase de mayor
+# prioridad (chat/filtro > explicaciones > precarga/warm-up > relleno del banco) y, si la
+# cola crece, se rechaza primero el trabajo de fondo. El relleno del banco solo entra con la
+# cola casi vacía, así que nunca ocupa los huecos que necesita la precarga del examen.
+
+# clase -> (orden, profundidad de cola a partir de la cual se rechaza)
+PRIORIDADES = {
+    "interactivo": (0, 64),
+    "explicacion": (1, 24),
+    "fondo": (2, 8),
+    "relleno": (3, 2),
+}
+
+_prioridad_actual = contextvars.ContextVar("prioridad_llm", default="interactivo")
+
+
+class SaturacionLLM(ErrorLLM):
+    """La cola está llena para esta clase o se agotó la espera por un turno."""
+
+
+@contextmanager
+def prioridad(clase: str):
+    """Fija la prioridad por defecto de las llamadas hechas dentro del bloque (por hilo)."""
+    token = _prioridad_actual.set(clase)
+    try:
+        yield
+    finally:
+        _prioridad_actual.reset(token)
+
+
+def prioridad_actual() -> str:
+    return _prioridad_actual.get()
+
+
+class PlanificadorLLM:
+    def __init__(self, max_en_vuelo: int = 2, prioridades: dict = None, ventana_metricas: int = 500):
+        self.max_en_vuelo = max_en_vuelo
+        self.prioridades = prioridades or PRIORIDADES
+        self.cond = threading.Condition()
+        self.cola = []                 # heap de (orden, secuencia)
+        self.secuencia = itertools.count()
+        self.en_vuelo = 0
+        self.stats = {
+            clase: {"admitidas": 0, "rechazadas": 0, "expiradas": 0, "esperas": deque(maxlen=ventana_metricas)}
+            for clase in self.prioridades
+        }
+
+    def adquirir(self, clase: str = None, timeout: float = None) -> float:
+        """Bloquea hasta obtener un turno. Devuelve los segundos esperados en cola."""
+        clase = clase or prioridad_actual()
+        orden, max_cola = self.prioridades[clase]
+        t0 = time.perf_counter()
+        with self.cond:
+            if len(self.cola) >= max_cola:
+                self.stats[clase]["rechazadas"] += 1
+                raise SaturacionLLM(f"cola del modelo llena ({len(self.cola)} en espera) para '{clase}'")
+            entrada = (orden, next(self.secuencia))
+            heapq.heappush(self.cola, entrada)
+            limite = None if timeout is None else t0 + timeout
+            while self.en_vuelo >= self.max_en_vuelo or self.cola[0] != entrada:
+                restante = None if limite is None else limite - time.perf_counter()
+                if restante is not None and restante <= 0:
+                    self.cola.remove(entrada)
+                    heapq.heapify(self.cola)
+                    self.stats[clase]["expiradas"] += 1
+                    self.cond.notify_all()
+                    raise SaturacionLLM(f"sin turno para el modelo tras {timeout:.0f}s en cola ('{clase}')")
+                self.cond.wait(restante)
+            heapq.heappop(self.cola)
+            self.en_vuelo += 1
+            espera = time.perf_counter() - t0
+            self.stats[clase]["admitidas"] += 1
+            self.stats[clase]["esperas"].append(espera)
+            # El siguiente de la cola puede tener hueco también
+            self.cond.notify_all()
+        if espera > 1.0:
+            logging.info(f"⏳ Llamada '{clase}' esperó {espera:.2f}s en cola (en vuelo: {self.en_vuelo})")
+        return espera
+
+    def liberar(self):
+        with self.cond:
+            self.en_vuelo -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def turno(self, clase: str = None, timeout: float = None):
+        espera = self.adquirir(clase, timeout)
+        try:
+            yield espera
+        finally:
+            self.liberar()
+
+    def metricas(self) -> dict:
+        """Profundidad de cola, llamadas en vuelo y espera en cola (p50/p95/máx) por clase."""
+        with self.cond:
+            datos = {"en_vuelo": self.en_vuelo, "en_cola": len(self.cola), "clases": {}}
+            for clase, st in self.stats.items():
+                esperas = sorted(st["esperas"])
+                datos["clases"][clase] = {
+                    "admitidas": st["admitidas"],
+                    "rechazadas": st["rechazadas"],
+                    "expiradas": st["expiradas"],
+                    "espera_p50": esperas[len(esperas) // 2] if esperas else 0.0,
+                    "espera_p95": esperas[int(len(esperas) * 0.95)] if esperas else 0.0,
+                    "espera_max": esperas[-1] if esperas else 0.0,
+                }
+        return datos
@@ -0,0 +1,288 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+import requests
+
+from resiliencia_llm import ErrorConexionLLM
+
+# --------------------------
+# POOL DE BACKENDS OPENAI-COMPATIBLES
+# --------------------------
+# Varios servidores Ollama (u otro endpoint /v1/chat/completions), cada uno con su
+# requests.Session. Un hilo comprueba su salud periódicamente; las llamadas van al
+# backend sano con menos peticiones pendientes (o con mejor latencia esperada) y,
+# si se pide, se lanza una copia "hedged" a un segundo backend cuando la primera
+# tarda más que el p95 observado para ese sitio (filtro, explicacion...): cada sitio tiene
+# su ventana de latencias para que las generaciones largas no retrasen el hedge de las
+# llamadas cortas. Si la primera falla antes del p95 se reenvía al otro backend (failover).
+# La copia hedged no ocupa turno en el planificador (planificador_llm): es un envío más al
+# servidor por encima de max_en_vuelo, acotado por los hilos de hedge_ejecutor y pensado
+# solo para las llamadas cortas que lo piden.
+
+POLITICAS = ("menos_pendientes", "latencia")
+
+
+class SinBackends(ErrorConexionLLM):
+    """Ningún backend sano disponible."""
+
+
+class Backend:
+    def __init__(self, url: str, modelo: str = None):
+        self.url = url
+        self.modelo = modelo
+        self.url_salud = url.rsplit("/chat/completions", 1)[0] + "/models"
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.pendientes = 0
+        self.sano = True
+        self.ewma = None               # latencia media exponencial (s)
+        self.latencias = {}            # sitio -> deque de latencias recientes
+        self.errores = 0
+
+    def registrar(self, latencia: float, sitio: str = "otro"):
+        with self.lock:
+            if sitio not in self.latencias:
+                self.latencias[sitio] = deque(maxlen=200)
+            self.latencias[sitio].append(latencia)
+            self.ewma = latencia if self.ewma is None else 0.8 * self.ewma + 0.2 * latencia
+
+    def p95(self, sitio: str = "otro"):
+        with self.lock:
+            latencias = self.latencias.get(sitio, ())
+            if len(latencias) < 5:
+                return None
+            datos = sorted(latencias)
+            return datos[int(len(datos) * 0.95)]
+
+    def p95_por_sitio(self) -> dict:
+        with self.lock:
+            sitios = sorted(self.latencias)
+        return {sitio: self.p95(sitio) for sitio in sitios}
+
+    def __repr__(self):
+        return f"Backend({self.url}, sano={self.sano}, pendientes={self.pendientes})"
+
+
+def parsear_backends(texto: str):
+    """'url1,url2|modelo2' -> [Backend]. El modelo es opcional por backend."""
+    backends = []
+    for parte in texto.split(","):
+        parte = parte.strip()
+        if parte:
+            url, _, modelo = parte.partition("|")
+            backends.append(Backend(url.strip(), modelo.strip() or None))
+    return backends
+
+
+class PoolLLM:
+    def __init__(self, backends: list, politica: str = "menos_pendientes", intervalo_salud: float = 10.0,
+                 hedge_min: float = 0.5):
+        if not backends:
+            raise ValueError("se necesita al menos un backend")
+        if politica not in POLITICAS:
+            raise ValueError(f"política desconocida: {politica}")
+        self.backends = backends
+        self.politica = politica
+        self.intervalo_salud = intervalo_salud
+        self.hedge_min = hedge_min
+        self.hedge_ejecutor = ThreadPoolExecutor(max_workers=4 * len(backends), thread_name_prefix="hedge")
+        self.stats = {"hedges": 0, "hedges_ganados": 0, "failovers": 0}
+        self._chequeo = None
+        self._keep_alive = {}          # modelo -> hilo que lo mantiene cargado
+        self._lock = threading.Lock()
+
+    # ---------- salud ----------
+    def iniciar_chequeos(self):
+        with self._lock:
+            if self._chequeo is None and self.intervalo_salud > 0:
+                self._chequeo = threading.Thread(target=self._bucle_salud, daemon=True, name="llm-salud")
+                self._chequeo.start()
+
+    def _bucle_salud(self):
+        while True:
+            for b in self.backends:
+                self.comprobar(b)
+            time.sleep(self.intervalo_salud)
+
+    def comprobar(self, backend: Backend) -> bool:
+        try:
+            resp = backend.session.get(backend.url_salud, timeout=3)
+            sano = resp.status_code < 500
+        except requests.RequestException:
+            sano = False
+        if sano != backend.sano:
+            logging.warning(f"{'✅' if sano else '⚠️'} Backend {backend.url} {'recuperado' if sano else 'caído'}")
+        backend.sano = sano
+        return sano
+
+    # ---------- selección ----------
+    def elegir(self, excluir=()) -> Backend:
+        candidatos = [b for b in self.backends if b.sano and b not in excluir]
+        if not candidatos:
+            # Si todos parecen caídos se prueba igualmente alguno no excluido
+            candidatos = [b for b in self.backends if b not in excluir]
+        if not candidatos:
+            raise SinBackends("no hay backends disponibles")
+        if self.politica == "latencia":
+            media = [b.ewma for b in candidatos if b.ewma is not None]
+            por_defecto = sum(media) / len(media) if media else 1.0
+            coste = lambda b: (b.ewma if b.ewma is not None else por_defecto) * (b.pendientes + 1)
+        else:
+            coste = lambda b: b.pendientes
+        minimo = min(coste(b) for b in candidatos)
+        return random.choice([b for b in candidatos if coste(b) == minimo])
+
+    def retraso_hedge(self, sitio: str = "otro") -> float:
+        p95s = [p for p in (b.p95(sitio) for b in self.backends) if p is not None]
+        return max(self.hedge_min, min(p95s)) if p95s else self.hedge_min
+
+    # ---------- envío ----------
+    def _payload(self, backend: Backend, payload: dict) -> dict:
+        if backend.modelo:
+            payload = dict(payload, model=backend.modelo)
+        return payload
+
+    def _enviar(self, backend: Backend, payload: dict, timeout: float, sitio: str = "otro"):
+        with backend.lock:
+            backend.pendientes += 1
+        t0 = time.perf_counter()
+        try:
+            resp = backend.session.post(backend.url, json=self._payload(backend, payload), timeout=timeout)
+            backend.registrar(time.perf_counter() - t0, sitio)
+            return resp
+        except requests.ConnectionError:
+            backend.sano = False
+            backend.errores += 1
+            raise
+        finally:
+            with backend.lock:
+                backend.pendientes -= 1
+
+    def post(self, payload: dict, timeout: float, hedge: bool = False, sitio: str = "otro"):
+        """
+        POST sin streaming. Con `hedge`, duplica la petición a otro backend tras el p95 de `sitio`.
+        La respuesta lleva `intentos` (peticiones enviadas, contando failover y hedge).
+        """
+        self.iniciar_chequeos()
+        principal = self.elegir()
+        sanos = [b for b in self.backends if b.sano]
+        if not hedge or len(sanos) < 2:
+            try:
+                resp = self._enviar(principal, payload, timeout, sitio)
+                resp.intentos = 1
+                return resp
+            except requests.ConnectionError:
+                if len(self.backends) < 2:
+                    raise
+                self.stats["failovers"] += 1
+                resp = self._enviar(self.elegir(excluir=(principal,)), payload, timeout, sitio)
+                resp.intentos = 2
+                return resp
+
+        futuros = {self.hedge_ejecutor.submit(self._enviar, principal, payload, timeout, sitio): principal}
+        hechos, _ = wait(futuros, timeout=self.retraso_hedge(sitio))
+        hedged = not hechos
+        if hedged or next(iter(hechos)).exception() is not None:
+            # Sin respuesta tras el p95 (hedge) o con error antes (failover): copia a otro backend
+            segundo = self.elegir(excluir=(principal,))
+            self.stats["hedges" if hedged else "failovers"] += 1
+            futuros[self.hedge_ejecutor.submit(self._enviar, segundo, payload, timeout, sitio)] = segundo
+        pendientes = set(futuros)
+        error = None
+        while pendientes:
+            hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for fut in hechos:
+                try:
+                    resp = fut.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if hedged and futuros[fut] is not principal:
+                    self.stats["hedges_ganados"] += 1
+                resp.intentos = len(futuros)
+                return resp
+        raise error
+
+    @contextmanager
+    def stream(self, payload: dict, timeout: float):
+        """POST con streaming; el backend cuenta como ocupado hasta cerrar la respuesta."""
+        self.iniciar_chequeos()
+        backend = self.elegir()
+        with backend.lock:
+            backend.pendientes += 1
+        intentos = 1
+        try:
+            try:
+                resp = backend.session.post(backend.url, json=self._payload(backend, payload), timeout=timeout, stream=True)
+            except requests.ConnectionError:
+                backend.sano = False
+                backend.errores += 1
+                if len(self.backends) < 2:
+                    raise
+                self.stats["failovers"] += 1
+                with backend.lock:
+                    backend.pendientes -= 1
+                backend = self.elegir(excluir=(backend,))
+                with backend.lock:
+                    backend.pendientes += 1
+                intentos = 2
+                resp = backend.session.post(backend.url, json=self._payload(backend, payload), timeout=timeout, stream=True)
+            resp.intentos = intentos
+            # La duración de un stream no se registra: mezclaría con la latencia de las llamadas completas
+            with resp:
+                yield resp
+        finally:
+            with backend.lock:
+                backend.pendientes -= 1
+
+    def fijar_modelo(self, modelo: str, keep_alive=-1, timeout: float = 300.0) -> int:
+        """
+        Pide a cada backend Ollama (API nativa /api/generate sin prompt) que cargue el
+        modelo y lo mantenga en memoria `keep_alive` (-1 = indefinidamente). Devuelve
+        cuántos backends respondieron; los que no son Ollama solo generan un aviso.
+        """
+        def fijar(backend: Backend) -> bool:
+            url = backend.url.rsplit("/v1/", 1)[0] + "/api/generate"
+            try:
+                resp = backend.session.post(url, json={"model": backend.modelo or modelo, "keep_alive": keep_alive},
+                                            timeout=timeout)
+                resp.raise_for_status()
+                return True
+            except requests.RequestException as e:
+                logging.warning(f"⚠️ No se pudo fijar el modelo en {backend.url}: {e}")
+                return False
+
+        return sum(self.hedge_ejecutor.map(fijar, self.backends))
+
+    def mantener_modelo(self, modelo: str, keep_alive=-1, intervalo: float = 240.0):
+        """
+        Repite fijar_modelo cada `intervalo` segundos en un hilo de fondo: cada llamada
+        por /v1 reinicia la caducidad al valor por defecto del servidor (OLLAMA_KEEP_ALIVE).
+        """
+        def bucle():
+            while True:
+                time.sleep(intervalo)
+                self.fijar_modelo(modelo, keep_alive, timeout=30)
+
+        with self._lock:
+            if modelo not in self._keep_alive:
+                hilo = threading.Thread(target=bucle, daemon=True, name=f"llm-keep-alive-{modelo}")
+                self._keep_alive[modelo] = hilo
+                hilo.start()
+
+    def estado(self) -> dict:
+        return {
+            "politica": self.politica,
+            **self.stats,
+            "backends": [
+                {"url": b.url, "sano": b.sano, "pendientes": b.pendientes, "errores": b.errores,
+                 "ewma": round(b.ewma, 3) if b.ewma is not None else None,
+                 "p95": b.p95_por_sitio()}
+                for b in self.backends
+            ],
+        }
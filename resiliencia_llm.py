@@ -0,0 +1,141 @@
+import logging
+import random
+import threading
+import time
+
+# --------------------------
+# ERRORES TIPADOS, PLAZOS Y CORTOCIRCUITO DE LAS LLAMADAS AL MODELO
+# --------------------------
+# Una llamada fallida lanza una subclase de ErrorLLM (en vez de devolver un texto
+# "❌ Error..." que el llamador confundía con la salida del modelo) y cada modo decide
+# su respaldo. Cada llamada tiene un único Plazo que cubre la espera del arranque, la
+# cola del planificador, el envío y los reintentos. Solo se reintenta ante fallos
+# transitorios (conexión, 5xx), con espera aleatoria ("full jitter"). El CircuitoLLM
+# se abre tras varios fallos seguidos: mientras está abierto las llamadas fallan al
+# instante y, pasado el enfriamiento, deja pasar una sola llamada de prueba. La prueba se
+# libera en cualquier salida de la llamada (ver liberar) y, si aun así se perdiera, caduca
+# pasado `plazo_prueba`.
+
+
+class ErrorLLM(Exception):
+    """Fallo de una llamada al modelo."""
+
+
+class PlazoAgotado(ErrorLLM):
+    """Se acabó el plazo de la llamada (arranque, cola, envío o reintentos)."""
+
+
+class CircuitoAbierto(ErrorLLM):
+    """El backend falló varias veces seguidas: se responde sin intentarlo."""
+
+
+class ErrorConexionLLM(ErrorLLM):
+    """Sin conexión con el backend o error 5xx: transitorio, se puede reintentar."""
+
+
+class ErrorRespuestaLLM(ErrorLLM):
+    """Respuesta de error no transitoria (4xx) o con un cuerpo inesperado."""
+
+
+class Plazo:
+    def __init__(self, segundos: float):
+        self.segundos = segundos
+        self.limite = time.monotonic() + segundos
+
+    def restante(self) -> float:
+        return max(0.0, self.limite - time.monotonic())
+
+    def comprobar(self, etapa: str) -> float:
+        """Segundos restantes; lanza PlazoAgotado si ya no queda tiempo para `etapa`."""
+        restante = self.restante()
+        if restante <= 0:
+            raise PlazoAgotado(f"plazo de {self.segundos:.0f}s agotado ({etapa})")
+        return restante
+
+
+def espera_reintento(intento: int, base: float = 0.25, tope: float = 4.0) -> float:
+    """Espera antes del reintento `intento` (0, 1, ...): aleatoria entre 0 y base·2^intento."""
+    return random.uniform(0, min(tope, base * 2 ** intento))
+
+
+class CircuitoLLM:
+    def __init__(self, umbral: int = 5, enfriamiento: float = 15.0, plazo_prueba: float = 120.0):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.plazo_prueba = plazo_prueba
+        self.lock = threading.Lock()
+        self.estado = "cerrado"          # cerrado -> abierto -> semiabierto -> cerrado/abierto
+        self.fallos = 0                  # fallos seguidos
+        self.abierto_hasta = 0.0
+        self.prueba_en_curso = None      # id de la llamada de prueba en semiabierto
+        self.prueba_hasta = 0.0
+        self._ultima_prueba = 0
+        self.stats = {"aperturas": 0, "rechazadas": 0}
+
+    def _rechazar(self, ahora: float):
+        self.stats["rechazadas"] += 1
+        raise CircuitoAbierto(f"modelo no disponible (nuevo intento en {max(0.0, self.abierto_hasta - ahora):.0f}s)")
+
+    def comprobar(self):
+        """Falla al instante si el circuito está abierto y no ha pasado el enfriamiento (no ocupa la prueba)."""
+        with self.lock:
+            ahora = time.monotonic()
+            if self.estado == "abierto" and ahora < self.abierto_hasta:
+                self._rechazar(ahora)
+
+    def permitir(self):
+        """
+        Llamar justo antes de enviar. En semiabierto solo pasa una llamada de prueba: devuelve
+        su id (None si no es prueba), que hay que pasar a liberar() al salir de la llamada.
+        """
+        with self.lock:
+            if self.estado == "cerrado":
+                return None
+            ahora = time.monotonic()
+            if self.estado == "abierto" and ahora >= self.abierto_hasta:
+                self.estado = "semiabierto"
+                self.prueba_en_curso = None
+            if self.estado == "semiabierto" and (self.prueba_en_curso is None or ahora >= self.prueba_hasta):
+                self._ultima_prueba += 1
+                self.prueba_en_curso = self._ultima_prueba
+                self.prueba_hasta = ahora + self.plazo_prueba
+                return self.prueba_en_curso
+            self._rechazar(ahora)
+
+    def liberar(self, prueba):
+        """Suelta la prueba `prueba` si sigue pendiente (la llamada salió sin exito() ni fallo())."""
+        if prueba is None:
+            return
+        with self.lock:
+            if self.prueba_en_curso == prueba:
+                self.prueba_en_curso = None
+
+    def exito(self):
+        """El backend respondió (aunque sea con un 4xx): no está caído."""
+        with self.lock:
+            if self.estado != "cerrado":
+                logging.info("✅ Circuito del modelo cerrado: el backend responde de nuevo")
+            self.estado = "cerrado"
+            self.fallos = 0
+            self.prueba_en_curso = None
+
+    def fallo(self):
+        with self.lock:
+            self.fallos += 1
+            if self.estado == "semiabierto" or (self.estado == "cerrado" and self.fallos >= self.umbral):
+                self.estado = "abierto"
+                self.abierto_hasta = time.monotonic() + self.enfriamiento
+                self.prueba_en_curso = None
+                self.stats["aperturas"] += 1
+                logging.warning(f"⛔ Circuito del modelo abierto tras {self.fallos} fallos seguidos "
+                                f"({self.enfriamiento:.0f}s sin llamadas)")
+
+    def abierto(self) -> bool:
+        with self.lock:
+            return self.estado != "cerrado"
+
+    def a_dict(self) -> dict:
+        with self.lock:
+            return {"estado": self.estado, "fallos_seguidos": self.fallos, **self.stats,
+                    "reabre_en_s": round(max(0.0, self.abierto_hasta - time.monotonic()), 1)
+                    if self.estado == "abierto" else 0.0}
@@ -0,0 +1,87 @@
+import logging
+import threading
+
+from metricas_llm import BUCKETS_SEGUNDOS, Histograma
+
+# --------------------------
+# ENRUTADO DE LLAMADAS ENTRE UN MODELO PEQUEÑO Y UNO GRANDE
+# --------------------------
+# Los sitios de `rutas` (filtro Sí/No, generación de preguntas...) van a un modelo
+# pequeño; el resto al grande. Si la salida del pequeño no pasa el validador de su
+# perfil (ver perfiles_llm), o el servidor no lo tiene (4xx), la llamada se repite con
+# el grande ("escalado"). Cada modelo tiene su keep_alive; si en el arranque el pequeño
+# no se puede cargar en ningún backend y el grande sí, las rutas se desactivan y todo va
+# al grande. Un backend con modelo propio ("url|modelo" en SGSI_LLM_BACKENDS) usa ese
+# modelo en todas las rutas.
+
+
+class _SerieRuta:
+    __slots__ = ("llamadas", "escaladas", "latencias")
+
+    def __init__(self):
+        self.llamadas = 0
+        self.escaladas = 0
+        self.latencias = {}         # modelo -> Histograma (por envío)
+
+
+class EnrutadorModelos:
+    def __init__(self, grande: str, pequeno: str = None, rutas=(), keep_alive=-1, keep_alive_pequeno=None):
+        self.grande = grande
+        self.pequeno = pequeno or None
+        self.rutas = set(rutas) if self.pequeno else set()
+        self.keep_alive = {grande: keep_alive}
+        if self.pequeno:
+            self.keep_alive[self.pequeno] = keep_alive if keep_alive_pequeno is None else keep_alive_pequeno
+        self.lock = threading.Lock()
+        self.series = {}            # sitio -> _SerieRuta
+        self.motivo_desactivado = None
+
+    def modelo(self, sitio: str) -> str:
+        return self.pequeno if sitio in self.rutas and self.motivo_desactivado is None else self.grande
+
+    def modelos(self) -> list:
+        """Modelos que hay que cargar y mantener en memoria (el grande primero)."""
+        return [self.grande] + ([self.pequeno] if self.rutas and self.motivo_desactivado is None else [])
+
+    def escalable(self, modelo: str) -> bool:
+        return modelo != self.grande
+
+    def desactivar(self, motivo: str):
+        """Envía todas las rutas al modelo grande (p. ej. el pequeño no está instalado)."""
+        if self.motivo_desactivado is None and self.rutas:
+            self.motivo_desactivado = motivo
+            logging.warning(f"⚠️ Modelo pequeño {self.pequeno} desactivado ({motivo}); todo va a {self.grande}")
+
+    def _serie(self, sitio: str) -> _SerieRuta:
+        serie = self.series.get(sitio)
+        if serie is None:
+            serie = self.series[sitio] = _SerieRuta()
+        return serie
+
+    def envio(self, sitio: str, modelo: str, latencia: float):
+        with self.lock:
+            latencias = self._serie(sitio).latencias
+            if modelo not in latencias:
+                latencias[modelo] = Histograma(BUCKETS_SEGUNDOS)
+            latencias[modelo].observar(latencia)
+
+    def llamada(self, sitio: str, escalada: bool):
+        with self.lock:
+            serie = self._serie(sitio)
+            serie.llamadas += 1
+            serie.escaladas += int(escalada)
+        if escalada:
+            logging.info(f"⬆️ '{sitio}' escalada de {self.pequeno} a {self.grande}")
+
+    def a_dict(self) -> dict:
+        with self.lock:
+            sitios = {
+                sitio: {
+                    "modelo": self.modelo(sitio), "llamadas": serie.llamadas, "escaladas": serie.escaladas,
+                    "tasa_escalado": round(serie.escaladas / serie.llamadas, 3) if serie.llamadas else 0.0,
+                    "latencia_s": {modelo: h.a_dict() for modelo, h in serie.latencias.items()},
+                }
+                for sitio, serie in sorted(self.series.items())
+            }
+        return {"grande": self.grande, "pequeno": self.pequeno, "rutas_pequeno": sorted(self.rutas),
+                "desactivado": self.motivo_desactivado, "sitios": sitios}
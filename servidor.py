@@ -0,0 +1,592 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import chatbot
+import metricas_llm
+import voz_tts
+from historial_chat import HistorialChat
+
+# --------------------------
+# SERVIDOR HTTP/SSE (asyncio)
+# --------------------------
+# Expone cada modo del chatbot como endpoints por sesión. Las conexiones las atiende
+# un único bucle asyncio; las llamadas bloqueantes al modelo van a un pool acotado de
+# hilos compartido por todas las sesiones (no hay un hilo por usuario).
+#
+#   POST   /api/sesion                          -> {"sesion": id}
+#   GET    /api/estado                          -> arranque del modelo: loading / warming / ready
+#   GET    /api/metricas                        -> planificador, backends y llamadas al modelo (JSON)
+#   GET    /metrics                             -> métricas por llamada en formato Prometheus
+#   DELETE /api/<sid>
+#   POST   /api/<sid>/chat        {"mensaje", "voz"} -> SSE (token / audio / rechazo / fin)
+#   POST   /api/<sid>/chat/limpiar
+#   POST   /api/<sid>/quiz/pregunta  {"tema", "avanzado"}
+#   POST   /api/<sid>/quiz/responder {"opcion"}
+#   POST   /api/<sid>/examen/iniciar {"precarga"}
+#   POST   /api/<sid>/examen/responder {"opcion"}
+#   POST   /api/<sid>/caso/escenario
+#   POST   /api/<sid>/caso/responder {"respuesta", "voz"} -> SSE (token / audio / fin)
+#   POST   /api/voz               {"texto", "voz_id", "velocidad"} -> {"audio": "/audio/<clave>.wav"}
+#   GET    /audio/<clave>.wav                   -> WAV de la caché de voz (servicio voz_tts.py)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SESION_TTL = 30 * 60          # segundos sin actividad antes de descartar la sesión
+MAX_SESIONES = 200            # al crear una más se descarta la de uso más antiguo
+PREFIJO_USUARIO = "sesion-"   # usuario del banco de cada sesión; sus vistas se borran al cerrarla
+MAX_LLM_EN_VUELO = 8          # hilos para llamadas bloqueantes al modelo
+MAX_PRECARGA = 4              # hilos para precargar preguntas de examen
+MAX_CUERPO = 64 * 1024
+
+EJECUTOR = ThreadPoolExecutor(max_workers=MAX_LLM_EN_VUELO, thread_name_prefix="llm")
+# Pool aparte para la precarga del examen; sus futuros se esperan desde el bucle de eventos
+# (asyncio.wrap_future), nunca desde un hilo de EJECUTOR
+EJECUTOR_PRECARGA = ThreadPoolExecutor(max_workers=MAX_PRECARGA, thread_name_prefix="precarga")
+
+
+# Procesos de voz (SGSI_VOZ) y pool que sintetiza frases mientras el modelo sigue generando
+VOZ = voz_tts.PoolVoz()
+EJECUTOR_VOZ = ThreadPoolExecutor(max_workers=2 * len(VOZ.clientes), thread_name_prefix="voz")
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado: int, mensaje: str):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.mensaje = mensaje
+
+
+class Sesion:
+    __slots__ = ("id", "usuario", "historial", "puntaje", "escenarios", "temas_caso", "pregunta", "siguiente", "examen",
+                 "escenario", "ultimo_uso", "lock")
+
+    def __init__(self, sid: str):
+        self.id = sid
+        self.usuario = f"{PREFIJO_USUARIO}{sid}"
+        self.historial = HistorialChat(presupuesto_tokens=chatbot.CHAT_PRESUPUESTO_TOKENS)
+        self.puntaje = 0
+        self.escenarios = chatbot.IndiceSimilitud(chatbot.UMBRAL_DUPLICADO_ESCENARIO)
+        self.temas_caso = chatbot.RotacionTemas(chatbot.TEMAS_CASO)
+        self.pregunta = None      # (raw, opts, corr, tema, avanzado) del quiz en curso
+        self.siguiente = None     # PreguntaEspeculativa del mismo tema, lanzada al responder
+        self.examen = None        # dict con precarga, número, puntaje y pregunta actual
+        self.escenario = None
+        self.ultimo_uso = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def cerrar(self):
+        self.descartar_siguiente()
+        if self.examen:
+            self.examen["precarga"].cerrar()
+            self.examen = None
+
+    def descartar_siguiente(self):
+        if self.siguiente:
+            self.siguiente.descartar()
+            self.siguiente = None
+
+
+SESIONES = {}
+
+
+def obtener_sesion(sid: str) -> Sesion:
+    sesion = SESIONES.get(sid)
+    if sesion is None:
+        raise ErrorHTTP(404, "sesión no encontrada")
+    sesion.ultimo_uso = time.monotonic()
+    return sesion
+
+
+async def limpiar_sesiones():
+    while True:
+        await asyncio.sleep(60)
+        limite = time.monotonic() - SESION_TTL
+        for sid in [s for s, ses in SESIONES.items() if ses.ultimo_uso < limite]:
+            # Mientras se espera a descartar una, crear_sesion puede haber quitado otra
+            sesion = SESIONES.pop(sid, None)
+            if sesion:
+                await descartar_sesion(sesion)
+                logging.info(f"🧹 Sesión expirada: {sid}")
+
+
+async def descartar_sesion(sesion):
+    """Cierra la sesión y borra sus vistas del banco (si no, la tabla crece con cada sesión)."""
+    sesion.cerrar()
+    await en_hilo(chatbot.obtener_banco().olvidar_usuario, sesion.usuario)
+
+
+# --------------------------
+# UTIL: hilos y streaming
+# --------------------------
+# Se copia el contexto para que el hilo vea el modo (métricas) fijado por la petición
+async def en_hilo(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(EJECUTOR, contextvars.copy_context().run, fn, *args)
+
+
+async def iterar_en_hilo(crear_generador):
+    """Consume un generador bloqueante en el pool y entrega sus elementos al bucle asyncio."""
+    loop = asyncio.get_running_loop()
+    cola = asyncio.Queue()
+    cancelado = threading.Event()
+    fin = object()
+
+    def trabajar():
+        try:
+            for item in crear_generador():
+                if cancelado.is_set():
+                    break
+                loop.call_soon_threadsafe(cola.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(cola.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(cola.put_nowait, fin)
+
+    tarea = loop.run_in_executor(EJECUTOR, contextvars.copy_context().run, trabajar)
+    try:
+        while True:
+            item = await cola.get()
+            if item is fin:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelado.set()
+        await tarea
+
+
+def con_voz(crear_generador, cuerpo: dict):
+    """
+    Envuelve un generador de texto: produce ("texto", fragmento) y, si la petición trae
+    "voz": true, también ("audio", {...}) por frase en cuanto está sintetizada.
+    """
+    if not cuerpo.get("voz"):
+        return lambda: (("texto", frag) for frag in crear_generador())
+    voz_elegida = str(cuerpo.get("voz_id") or voz_tts.VOZ_POR_DEFECTO)
+    return lambda: voz_tts.canalizar_voz(crear_generador(), VOZ, EJECUTOR_VOZ, voz_elegida)
+
+
+def _evento_audio(dato: dict) -> dict:
+    return {"tipo": "audio", "audio": f"/audio/{dato['clave']}.wav", "orden": dato["orden"],
+            "frase": dato["frase"], "duracion": dato["duracion"]}
+
+
+def _pregunta_publica(opts: dict, enunciado: str) -> dict:
+    return {"pregunta": chatbot.limpiar_enunciado(enunciado), "opciones": {L: opts.get(L, "") for L in "ABC"}}
+
+
+def _opcion(cuerpo: dict) -> str:
+    opcion = str(cuerpo.get("opcion", "")).strip().upper()
+    if opcion not in ("A", "B", "C"):
+        raise ErrorHTTP(400, "opción no válida, elige A, B o C")
+    return opcion
+
+
+# --------------------------
+# HANDLERS
+# --------------------------
+async def crear_sesion(cuerpo):
+    while len(SESIONES) >= MAX_SESIONES:
+        antigua = min(SESIONES.values(), key=lambda s: s.ultimo_uso)
+        del SESIONES[antigua.id]
+        await descartar_sesion(antigua)
+        logging.info(f"🧹 Sesión descartada por el tope de {MAX_SESIONES}: {antigua.id}")
+    sid = secrets.token_urlsafe(12)
+    SESIONES[sid] = Sesion(sid)
+    return {"sesion": sid}
+
+
+async def borrar_sesion(sesion, cuerpo):
+    SESIONES.pop(sesion.id, None)
+    await descartar_sesion(sesion)
+    return {"ok": True}
+
+
+async def chat(sesion, cuerpo):
+    mensaje = str(cuerpo.get("mensaje", "")).strip()
+    if not mensaje:
+        raise ErrorHTTP(400, "mensaje vacío")
+    cacheable = chatbot.pregunta_autocontenida(mensaje)
+    cacheada = chatbot.CACHE_RESPUESTAS.buscar(mensaje) if cacheable else None
+    if cacheada:
+        sesion.historial.agregar(mensaje, cacheada)
+        yield {"tipo": "fin", "texto": cacheada, "cache": True}
+        return
+    contexto = "\n".join(sesion.historial.preguntas_recientes())
+    if not await en_hilo(chatbot.es_pregunta_sgsi, mensaje, contexto):
+        yield {"tipo": "rechazo", "texto": "⚠️ Tu pregunta no parece estar relacionada con SGSI/ISO."}
+        return
+    anterior = (sesion.historial.preguntas_recientes() or [""])[-1]
+    mensajes = sesion.historial.mensajes(chatbot.PROMPT_SISTEMA_CHAT, chatbot.pregunta_con_referencias(mensaje, anterior))
+    partes = []
+    try:
+        async for tipo, dato in iterar_en_hilo(con_voz(
+            lambda: chatbot.generar_respuesta_stream_mensajes(mensajes, sitio="chat"),
+            cuerpo,
+        )):
+            if tipo == "audio":
+                yield _evento_audio(dato)
+                continue
+            partes.append(dato)
+            yield {"tipo": "token", "texto": dato}
+    except chatbot.ErrorLLM:
+        yield {"tipo": "fin", "texto": chatbot.respuesta_degradada(mensaje), "degradada": True}
+        return
+    respuesta = "".join(partes).strip()
+    sesion.historial.agregar(mensaje, respuesta)
+    if cacheable:
+        chatbot.CACHE_RESPUESTAS.guardar(mensaje, respuesta)
+    yield {"tipo": "fin", "texto": respuesta}
+
+
+async def metricas(cuerpo):
+    indice = chatbot.obtener_indice_iso()
+    return {"sesiones": len(SESIONES), "planificador": chatbot.PLANIFICADOR.metricas(),
+            "backends": chatbot.POOL.estado(), "cache_respuestas": chatbot.CACHE_RESPUESTAS.metricas(),
+            "llm": chatbot.METRICAS.a_json(), "circuito": chatbot.CIRCUITO.a_dict(), "perfiles": chatbot.PERFILES.a_dict(),
+            "rutas": chatbot.RUTAS.a_dict(), "voz": VOZ.metricas(),
+            "indice_iso": indice.metricas() if indice else None}
+
+
+async def estado(cuerpo):
+    return chatbot.ARRANQUE.a_dict()
+
+
+async def chat_limpiar(sesion, cuerpo):
+    sesion.historial.limpiar()
+    return {"ok": True}
+
+
+async def quiz_pregunta(sesion, cuerpo):
+    tema = str(cuerpo.get("tema") or chatbot.TEMAS_ESTANDARES[0]).strip()
+    avanzado = bool(cuerpo.get("avanzado", False))
+    raw = None
+    if sesion.siguiente and sesion.siguiente.es_de(tema, avanzado):
+        siguiente, sesion.siguiente = sesion.siguiente, None
+        # Como en _examen_siguiente: si aún no empezó en EJECUTOR_PRECARGA se cancela y se genera al momento
+        if not siguiente.futuro.cancel():
+            try:
+                raw = await asyncio.wrap_future(siguiente.futuro)
+            except Exception as e:
+                logging.error(f"❌ Error en la pregunta precargada: {e}")
+    else:
+        sesion.descartar_siguiente()
+    if raw is None:
+        raw = await en_hilo(chatbot.obtener_pregunta, tema, avanzado, sesion.usuario)
+    q_text, opts, corr = chatbot.parse_question_block(raw)
+    if not opts:
+        raw = chatbot.safe_fallback_question()
+        q_text, opts, corr = chatbot.parse_question_block(raw)
+    sesion.pregunta = (raw, opts, corr, tema, avanzado)
+    return _pregunta_publica(opts, q_text)
+
+
+async def quiz_responder(sesion, cuerpo):
+    if not sesion.pregunta:
+        raise ErrorHTTP(409, "no hay pregunta en curso")
+    opcion = _opcion(cuerpo)
+    raw, opts, corr, tema, avanzado = sesion.pregunta
+    sesion.pregunta = None
+    # Siguiente pregunta del mismo tema en paralelo con la explicación y la lectura
+    sesion.descartar_siguiente()
+    sesion.siguiente = chatbot.PreguntaEspeculativa(EJECUTOR_PRECARGA, tema, avanzado, sesion.usuario)
+    if opcion == corr:
+        sesion.puntaje += 5
+    explicacion = await en_hilo(chatbot.generate_brief_explanation, raw, corr, opcion, tema, avanzado)
+    return {"correcta": opcion == corr, "letra_correcta": corr, "texto_correcto": opts.get(corr, ""),
+            "explicacion": explicacion, "puntaje": sesion.puntaje}
+
+
+async def examen_iniciar(sesion, cuerpo):
+    try:
+        profundidad = int(cuerpo.get("precarga", chatbot.EXAMEN_PRECARGA))
+    except (TypeError, ValueError):
+        raise ErrorHTTP(400, "precarga debe ser un entero")
+    sesion.cerrar()
+    precarga = chatbot.PrecargaExamen(
+        chatbot.TEMAS_EXAMEN, chatbot.EXAMEN_TOTAL_PREGUNTAS,
+        profundidad=profundidad, executor=EJECUTOR_PRECARGA, usuario=sesion.usuario,
+    )
+    precarga.iniciar()
+    sesion.examen = {"precarga": precarga, "numero": 1, "puntaje": 0.0, "actual": None}
+    return await _examen_siguiente(sesion)
+
+
+async def _examen_siguiente(sesion):
+    examen = sesion.examen
+    precarga = examen["precarga"]
+    fut = precarga.tomar_futuro()
+    item = None
+    # Si la precarga aún no empezó (pool compartido ocupado por otras sesiones) se cancela y la
+    # pregunta se genera al momento en vez de esperar turno en EJECUTOR_PRECARGA
+    if fut is not None and not fut.cancel():
+        try:
+            item = await asyncio.wrap_future(fut)
+        except Exception as e:
+            logging.error(f"❌ Error en precarga de pregunta: {e}")
+    if item is None:
+        item = await en_hilo(precarga.generar)
+    precarga.rellenar()
+    examen["actual"] = item
+    _, clean_q, opts, _, _ = examen["actual"]
+    return {"numero": examen["numero"], "total": chatbot.EXAMEN_TOTAL_PREGUNTAS, **_pregunta_publica(opts, clean_q)}
+
+
+async def examen_responder(sesion, cuerpo):
+    examen = sesion.examen
+    if not examen or not examen["actual"]:
+        raise ErrorHTTP(409, "no hay examen en curso")
+    opcion = _opcion(cuerpo)
+    raw, _, opts, corr, tema = examen["actual"]
+    examen["actual"] = None
+    if opcion == corr:
+        examen["puntaje"] += 20 / chatbot.EXAMEN_TOTAL_PREGUNTAS
+    explicacion = await en_hilo(chatbot.generate_brief_explanation, raw, corr, opcion, tema, True)
+    resultado = {"correcta": opcion == corr, "letra_correcta": corr, "texto_correcto": opts.get(corr, ""),
+                 "explicacion": explicacion, "puntaje": round(examen["puntaje"], 1)}
+    if examen["numero"] >= chatbot.EXAMEN_TOTAL_PREGUNTAS:
+        sesion.cerrar()
+        resultado["final"] = True
+        return resultado
+    examen["numero"] += 1
+    resultado["siguiente"] = await _examen_siguiente(sesion)
+    return resultado
+
+
+async def caso_escenario(sesion, cuerpo):
+    tema = str(cuerpo.get("tema") or sesion.temas_caso.siguiente())
+    sesion.escenario = await en_hilo(chatbot.generar_escenario, tema, sesion.escenarios)
+    return {"tema": tema, "escenario": sesion.escenario}
+
+
+async def caso_responder(sesion, cuerpo):
+    respuesta = str(cuerpo.get("respuesta", "")).strip()
+    if not sesion.escenario:
+        raise ErrorHTTP(409, "no hay escenario en curso")
+    if not respuesta:
+        raise ErrorHTTP(400, "respuesta vacía")
+    prompt = chatbot.prompt_evaluacion_caso(sesion.escenario, respuesta)
+    partes = []
+    try:
+        async for tipo, dato in iterar_en_hilo(con_voz(
+            lambda: chatbot.generar_respuesta_stream(prompt, sitio="evaluacion"),
+            cuerpo,
+        )):
+            if tipo == "audio":
+                yield _evento_audio(dato)
+                continue
+            partes.append(dato)
+            yield {"tipo": "token", "texto": dato}
+    except chatbot.ErrorLLM:
+        yield {"tipo": "fin", "texto": chatbot.evaluacion_degradada(sesion.escenario), "degradada": True}
+        return
+    yield {"tipo": "fin", "texto": "".join(partes).strip()}
+
+
+async def voz(cuerpo):
+    texto = str(cuerpo.get("texto", "")).strip()
+    if not texto:
+        raise ErrorHTTP(400, "texto vacío")
+    try:
+        velocidad = float(cuerpo.get("velocidad") or voz_tts.VELOCIDAD_POR_DEFECTO)
+    except (TypeError, ValueError):
+        raise ErrorHTTP(400, "velocidad debe ser un número")
+    try:
+        clave, _, cacheado, _ = await en_hilo(VOZ.sintetizar, texto, cuerpo.get("voz_id") or voz_tts.VOZ_POR_DEFECTO,
+                                              velocidad)
+    except voz_tts.ErrorVoz as e:
+        raise ErrorHTTP(503, str(e))
+    return {"audio": f"/audio/{clave}.wav", "cache": cacheado}
+
+
+RUTAS = [
+    ("POST", re.compile(r"^/api/sesion$"), crear_sesion, False),
+    ("POST", re.compile(r"^/api/voz$"), voz, False),
+    ("GET", re.compile(r"^/api/estado$"), estado, False),
+    ("GET", re.compile(r"^/api/metricas$"), metricas, False),
+    ("DELETE", re.compile(r"^/api/(?P<sid>[\w-]+)$"), borrar_sesion, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/chat$"), chat, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/chat/limpiar$"), chat_limpiar, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/quiz/pregunta$"), quiz_pregunta, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/quiz/responder$"), quiz_responder, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/examen/iniciar$"), examen_iniciar, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/examen/responder$"), examen_responder, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/caso/escenario$"), caso_escenario, True),
+    ("POST", re.compile(r"^/api/(?P<sid>[\w-]+)/caso/responder$"), caso_responder, True),
+]
+
+AUDIO = re.compile(r"^/audio/(?P<clave>[0-9a-f]{64})\.wav$")
+ESTATICOS = {"/": "principal.html", "/principal.html": "principal.html", "/carga": "carga.html",
+             "/carga.html": "carga.html"}
+
+
+# --------------------------
+# HTTP mínimo sobre asyncio
+# --------------------------
+async def leer_peticion(reader):
+    linea = await reader.readline()
+    if not linea:
+        return None
+    try:
+        metodo, ruta, _ = linea.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ErrorHTTP(400, "petición mal formada")
+    cabeceras = {}
+    while True:
+        linea = await reader.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        cabeceras[nombre.strip().lower()] = valor.strip()
+    try:
+        largo = int(cabeceras.get("content-length") or 0)
+    except ValueError:
+        raise ErrorHTTP(400, "Content-Length no válido")
+    if largo < 0:
+        raise ErrorHTTP(400, "Content-Length no válido")
+    if largo > MAX_CUERPO:
+        raise ErrorHTTP(413, "cuerpo demasiado grande")
+    cuerpo = {}
+    if largo:
+        try:
+            cuerpo = json.loads((await reader.readexactly(largo)).decode("utf-8"))
+        except asyncio.IncompleteReadError:
+            raise ErrorHTTP(400, "cuerpo incompleto")
+        except ValueError:
+            raise ErrorHTTP(400, "JSON inválido")
+        if not isinstance(cuerpo, dict):
+            raise ErrorHTTP(400, "se esperaba un objeto JSON")
+    return metodo.upper(), urlsplit(ruta).path, cuerpo
+
+
+def cabecera(estado: int, tipo: str, extra: str = "") -> bytes:
+    razones = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+    return (f"HTTP/1.1 {estado} {razones.get(estado, 'OK')}\r\nContent-Type: {tipo}\r\n"
+            f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n{extra}\r\n").encode("latin-1")
+
+
+async def responder(writer, estado: int, datos, tipo: str = "application/json; charset=utf-8"):
+    cuerpo = datos if isinstance(datos, bytes) else json.dumps(datos, ensure_ascii=False).encode("utf-8")
+    writer.write(cabecera(estado, tipo, f"Content-Length: {len(cuerpo)}\r\n") + cuerpo)
+    await writer.drain()
+
+
+async def responder_sse(writer, eventos):
+    # El primer evento se obtiene antes de enviar cabeceras para que los errores
+    # de validación puedan responderse todavía como JSON
+    try:
+        primero = await eventos.__anext__()
+    except StopAsyncIteration:
+        primero = None
+    writer.write(cabecera(200, "text/event-stream; charset=utf-8", "Cache-Control: no-cache\r\n"))
+    if primero is not None:
+        writer.write(f"data: {json.dumps(primero, ensure_ascii=False)}\n\n".encode("utf-8"))
+    await writer.drain()
+    async for evento in eventos:
+        writer.write(f"data: {json.dumps(evento, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await writer.drain()
+
+
+async def atender(reader, writer):
+    try:
+        peticion = await leer_peticion(reader)
+        if peticion is None:
+            return
+        metodo, ruta, cuerpo = peticion
+        if metodo == "OPTIONS":
+            writer.write(cabecera(200, "text/plain", "Access-Control-Allow-Methods: GET, POST, DELETE\r\n"
+                                  "Access-Control-Allow-Headers: Content-Type\r\nContent-Length: 0\r\n"))
+            return
+        if metodo == "GET" and ruta == "/metrics":
+            await responder(writer, 200, chatbot.METRICAS.prometheus().encode("utf-8"),
+                            "text/plain; version=0.0.4; charset=utf-8")
+            return
+        if metodo == "GET" and AUDIO.match(ruta):
+            ruta_audio = VOZ.cache.buscar(AUDIO.match(ruta).group("clave"))
+            if not ruta_audio:
+                raise ErrorHTTP(404, "audio no encontrado")
+            with open(ruta_audio, "rb") as f:
+                await responder(writer, 200, f.read(), "audio/wav")
+            return
+        if metodo == "GET" and ruta in ESTATICOS:
+            with open(os.path.join(BASE_DIR, ESTATICOS[ruta]), "rb") as f:
+                await responder(writer, 200, f.read(), "text/html; charset=utf-8")
+            return
+        for metodo_ruta, patron, handler, con_sesion in RUTAS:
+            m = patron.match(ruta)
+            if not m:
+                continue
+            if metodo != metodo_ruta:
+                continue
+            if not con_sesion:
+                await responder(writer, 200, await handler(cuerpo))
+                return
+            sesion = obtener_sesion(m.group("sid"))
+            # /api/<sid>/<modo>/... -> etiqueta de las llamadas al modelo de esta petición
+            partes = ruta.split("/")
+            with metricas_llm.modo(partes[3] if len(partes) > 3 else "sesion"):
+                async with sesion.lock:
+                    resultado = handler(sesion, cuerpo)
+                    if hasattr(resultado, "__aiter__"):
+                        await responder_sse(writer, resultado)
+                    else:
+                        await responder(writer, 200, await resultado)
+            return
+        raise ErrorHTTP(404, "ruta no encontrada")
+    except ErrorHTTP as e:
+        await responder(writer, e.estado, {"error": e.mensaje})
+    except chatbot.ErrorLLM as e:
+        await responder(writer, 503, {"error": f"modelo no disponible: {e}"})
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        logging.error(f"❌ Error atendiendo petición: {e}")
+        try:
+            await responder(writer, 500, {"error": str(e)})
+        except ConnectionError:
+            pass
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def servir(host: str, port: int):
+    server = await asyncio.start_server(atender, host, port)
+    # El servidor acepta conexiones ya; carga.html consulta /api/estado hasta "ready"
+    chatbot.iniciar_warm_up()
+    # Las sesiones no sobreviven a un reinicio: sus vistas tampoco
+    borradas = await en_hilo(chatbot.obtener_banco().olvidar_prefijo, PREFIJO_USUARIO)
+    if borradas:
+        logging.info(f"🧹 {borradas} vistas de sesiones anteriores borradas del banco")
+    asyncio.create_task(limpiar_sesiones())
+    logging.info(f"🌐 Servidor SGSI escuchando en http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor HTTP/SSE del Asistente SGSI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(servir(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import pytest
+
+from cache_respuestas import CacheRespuestas
+
+PARES_DISTINTOS = [
+    ("¿Qué establece la norma ISO 27005?", "¿Qué establece la norma ISO 27001?"),
+    ("¿Qué exige el control 5.2 del anexo A?", "¿Qué exige el control 5.1 del anexo A?"),
+    ("¿Qué exige el control 8.13 del anexo A?", "¿Qué exige el control 8.12 del anexo A?"),
+    ("¿Qué relación hay entre ISO 27001 e 27005?", "¿Qué relación hay entre ISO 27001 e 27002?"),
+]
+
+
+@pytest.mark.parametrize("guardada, consulta", PARES_DISTINTOS)
+def test_numero_distinto_no_acierta(guardada, consulta):
+    cache = CacheRespuestas()
+    cache.guardar(guardada, "respuesta")
+    assert cache.buscar(consulta) is None
+
+
+def test_casi_igual_con_mismos_numeros_acierta():
+    cache = CacheRespuestas()
+    cache.guardar("¿Qué exige el control 5.1 del anexo A?", "respuesta")
+    assert cache.buscar("¿Qué exige el control 5.1 del anexo?") == "respuesta"
+    assert cache.stats["hits_similares"] == 1
+
+
+def test_clave_exacta_normalizada():
+    cache = CacheRespuestas()
+    cache.guardar("¿Qué es un SGSIA?", "respuesta")
+    assert cache.buscar("que es un sgsi") == "respuesta"
+    assert cache.stats["hits_exactos"] == 1
@@ -0,0 +1,507 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+import wave
+from collections import deque
+
+# --------------------------
+# SERVICIO DE VOZ (MeloTTS residente)
+# --------------------------
+# Cargar MeloTTS tarda decenas de segundos, así que el modelo vive en un proceso
+# aparte que lo carga una sola vez y atiende trabajos por un socket local (una línea
+# JSON por petición y por respuesta). El audio se guarda en una caché en disco
+# direccionada por contenido: clave = sha256(modelo|voz|velocidad|texto normalizado).
+# Los textos fijos del chatbot (INTRO_*, menú, pregunta de respaldo) se pre-renderizan
+# al instalar y se sirven sin sintetizar.
+#
+#   python voz_tts.py prerender          # una vez, tras instalar
+#   python voz_tts.py servir             # proceso residente
+#   python voz_tts.py servir --procesos 2  # un modelo por proceso, puertos consecutivos
+#
+# Para respuestas del modelo en streaming, canalizar_voz() parte el texto en frases
+# según llegan los tokens y las sintetiza en paralelo en el pool de procesos; el audio
+# se entrega en orden en cuanto cada frase está lista, sin esperar al texto completo.
+#
+# Requiere `melo` (MeloTTS) y `torch` solo en el proceso que sintetiza.
+
+MODELO_TTS = "melo-es"
+VOZ_POR_DEFECTO = "ES"
+VELOCIDAD_POR_DEFECTO = 1.1
+DIRECCION_VOZ = os.environ.get("SGSI_VOZ", "127.0.0.1:5055")  # "host:puerto,host:puerto2" con varios procesos
+DIR_AUDIO = os.environ.get("SGSI_AUDIO_DIR", "audio_cache")
+MAX_BYTES_AUDIO = 512 * 1024 * 1024
+
+_EMOJIS = re.compile("[\U0001F000-\U0001FAFF\u2190-\u21FF\u2300-\u23FF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]")
+
+
+class ErrorVoz(Exception):
+    """El servicio de voz no está disponible o no pudo sintetizar."""
+
+
+def texto_para_voz(texto: str) -> str:
+    """Quita emojis, marcas de formato y la marca '*' de la opción correcta; cada línea acaba en pausa."""
+    lineas = []
+    for linea in texto.splitlines():
+        linea = _EMOJIS.sub("", linea).replace("*", "").replace("=", "")
+        linea = re.sub(r"\s*—\s*", ", ", " ".join(linea.split())).strip()
+        if not linea:
+            continue
+        if linea[-1] not in ".,;:?!":
+            linea += "."
+        lineas.append(linea)
+    return " ".join(lineas)
+
+
+def clave_audio(texto: str, voz: str = VOZ_POR_DEFECTO, velocidad: float = VELOCIDAD_POR_DEFECTO) -> str:
+    return hashlib.sha256(f"{MODELO_TTS}|{voz}|{velocidad:.2f}|{texto_para_voz(texto)}".encode("utf-8")).hexdigest()
+
+
+def _parsear_direccion(direccion: str):
+    host, _, puerto = direccion.rpartition(":")
+    return host or "127.0.0.1", int(puerto)
+
+
+def duracion_wav(ruta: str) -> float:
+    try:
+        with wave.open(ruta, "rb") as w:
+            return w.getnframes() / float(w.getframerate())
+    except (OSError, EOFError, wave.Error):
+        return 0.0
+
+
+class CacheAudio:
+    """WAVs en <dir>/<2 primeros>/<clave>.wav. Los fijados (pre-renderizados) nunca se podan."""
+
+    def __init__(self, directorio: str = DIR_AUDIO, max_bytes: int = MAX_BYTES_AUDIO):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.manifiesto = os.path.join(directorio, "fijos.txt")
+        self.lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, clave[:2], f"{clave}.wav")
+
+    def buscar(self, clave: str):
+        ruta = self.ruta(clave)
+        if not os.path.exists(ruta):
+            return None
+        try:
+            os.utime(ruta)          # la mtime hace de marca LRU para la poda
+        except OSError:
+            pass
+        return ruta
+
+    def ruta_temporal(self, clave: str) -> str:
+        os.makedirs(os.path.dirname(self.ruta(clave)), exist_ok=True)
+        return self.ruta(clave) + f".{os.getpid()}.{threading.get_ident()}.tmp.wav"
+
+    def confirmar(self, clave: str, ruta_tmp: str) -> str:
+        """Publica el audio de forma atómica (un lector nunca ve un WAV a medias)."""
+        ruta = self.ruta(clave)
+        os.replace(ruta_tmp, ruta)
+        return ruta
+
+    def fijos(self) -> set:
+        try:
+            with open(self.manifiesto, encoding="utf-8") as f:
+                return {l.strip() for l in f if l.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def fijar(self, claves):
+        with self.lock:
+            todas = self.fijos() | set(claves)
+            with open(self.manifiesto, "w", encoding="utf-8") as f:
+                f.write("\n".join(sorted(todas)) + "\n")
+
+    def podar(self):
+        """Borra los audios no fijados menos usados hasta quedar bajo `max_bytes`."""
+        with self.lock:
+            fijos = self.fijos()
+            archivos = []
+            total = 0
+            for raiz, _, nombres in os.walk(self.directorio):
+                for nombre in nombres:
+                    if not nombre.endswith(".wav") or ".tmp." in nombre:
+                        continue
+                    ruta = os.path.join(raiz, nombre)
+                    st = os.stat(ruta)
+                    total += st.st_size
+                    if nombre[:-4] not in fijos:
+                        archivos.append((st.st_mtime, st.st_size, ruta))
+            for _, tam, ruta in sorted(archivos):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(ruta)
+                    total -= tam
+                except OSError:
+                    pass
+
+
+class MotorMelo:
+    """Modelo MeloTTS cargado una vez; la síntesis se serializa (el modelo no es reentrante)."""
+
+    def __init__(self, dispositivo: str = "cpu", hilos: int = 6):
+        import torch
+        from melo.api import TTS
+        torch.set_num_threads(hilos)
+        torch.set_num_interop_threads(hilos)
+        t0 = time.perf_counter()
+        self.modelo = TTS(language="ES", device=dispositivo)
+        self.voces = self.modelo.hps.data.spk2id
+        self.lock = threading.Lock()
+        logging.info(f"🔊 MeloTTS cargado en {time.perf_counter() - t0:.1f}s · voces: {list(self.voces.keys())}")
+
+    def sintetizar(self, texto: str, voz: str, velocidad: float, ruta: str):
+        if voz not in self.voces:
+            raise ErrorVoz(f"voz desconocida: {voz}")
+        with self.lock:
+            self.modelo.tts_to_file(texto, self.voces[voz], ruta, speed=velocidad, quiet=True)
+
+
+def renderizar(motor: MotorMelo, cache: CacheAudio, texto: str, voz: str = VOZ_POR_DEFECTO,
+               velocidad: float = VELOCIDAD_POR_DEFECTO):
+    """Devuelve (clave, ruta, desde_cache). Solo sintetiza si el audio no está en caché."""
+    limpio = texto_para_voz(texto)
+    if not limpio:
+        raise ErrorVoz("texto vacío")
+    clave = clave_audio(texto, voz, velocidad)
+    ruta = cache.buscar(clave)
+    if ruta:
+        return clave, ruta, True
+    tmp = cache.ruta_temporal(clave)
+    try:
+        motor.sintetizar(limpio, voz, velocidad, tmp)
+        ruta = cache.confirmar(clave, tmp)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return clave, ruta, False
+
+
+# --------------------------
+# PROCESO RESIDENTE
+# --------------------------
+class ServidorVoz(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, direccion, motor: MotorMelo, cache: CacheAudio):
+        self.motor = motor
+        self.cache = cache
+        self.sintetizados = 0
+        super().__init__(direccion, _AtenderVoz)
+
+
+class _AtenderVoz(socketserver.StreamRequestHandler):
+    def handle(self):
+        for linea in self.rfile:
+            try:
+                trabajo = json.loads(linea)
+                t0 = time.perf_counter()
+                clave, ruta, cacheado = renderizar(
+                    self.server.motor, self.server.cache, str(trabajo.get("texto", "")),
+                    trabajo.get("voz") or VOZ_POR_DEFECTO, float(trabajo.get("velocidad") or VELOCIDAD_POR_DEFECTO),
+                )
+                respuesta = {"ok": True, "clave": clave, "ruta": os.path.abspath(ruta), "cache": cacheado,
+                             "segundos": round(time.perf_counter() - t0, 3), "duracion": round(duracion_wav(ruta), 3)}
+                if not cacheado:
+                    self.server.sintetizados += 1
+                    if self.server.sintetizados % 50 == 0:
+                        self.server.cache.podar()
+            except Exception as e:
+                logging.error(f"❌ Error de síntesis: {e}")
+                respuesta = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(respuesta, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class ClienteVoz:
+    """Cliente de un proceso residente. Los aciertos de caché se resuelven sin tocar el socket."""
+
+    def __init__(self, direccion: str = DIRECCION_VOZ, cache: CacheAudio = None, timeout: float = 120.0):
+        self.direccion = _parsear_direccion(direccion)
+        self.cache = cache or CacheAudio()
+        self.timeout = timeout
+
+    def sintetizar(self, texto: str, voz: str = VOZ_POR_DEFECTO, velocidad: float = VELOCIDAD_POR_DEFECTO):
+        """Devuelve (clave, ruta, desde_cache) o lanza ErrorVoz."""
+        clave = clave_audio(texto, voz, velocidad)
+        ruta = self.cache.buscar(clave)
+        if ruta:
+            return clave, ruta, True
+        trabajo = {"texto": texto, "voz": voz, "velocidad": velocidad}
+        try:
+            with socket.create_connection(self.direccion, timeout=2.0) as conexion:
+                conexion.settimeout(self.timeout)
+                conexion.sendall((json.dumps(trabajo, ensure_ascii=False) + "\n").encode("utf-8"))
+                respuesta = json.loads(conexion.makefile("rb").readline() or b"{}")
+        except (OSError, ValueError) as e:
+            raise ErrorVoz(f"servicio de voz no disponible en {self.direccion[0]}:{self.direccion[1]}: {e}")
+        if not respuesta.get("ok"):
+            raise ErrorVoz(respuesta.get("error", "respuesta vacía del servicio de voz"))
+        return respuesta["clave"], respuesta["ruta"], respuesta["cache"]
+
+
+def _percentil(valores, p):
+    datos = sorted(valores)
+    return round(datos[min(len(datos) - 1, int(len(datos) * p))], 3) if datos else 0.0
+
+
+class PoolVoz:
+    """
+    Reparte las síntesis entre varios procesos residentes (uno por modelo): va al que
+    tenga menos trabajos pendientes. Registra por proceso el factor de tiempo real
+    (segundos de síntesis / segundos de audio) y el tiempo hasta el primer audio.
+    """
+
+    def __init__(self, direcciones: str = DIRECCION_VOZ, cache: CacheAudio = None, timeout: float = 120.0,
+                 ventana: int = 200):
+        self.cache = cache or CacheAudio()
+        self.clientes = [ClienteVoz(d.strip(), self.cache, timeout) for d in direcciones.split(",") if d.strip()]
+        self.lock = threading.Lock()
+        self.pendientes = {c: 0 for c in self.clientes}
+        self.caido_hasta = {c: 0.0 for c in self.clientes}
+        self.stats = {
+            c: {"sintesis": 0, "errores": 0, "rtf": deque(maxlen=ventana), "ttfa": deque(maxlen=ventana)}
+            for c in self.clientes
+        }
+        self.aciertos_cache = 0
+
+    def _nombre(self, cliente: ClienteVoz) -> str:
+        return f"{cliente.direccion[0]}:{cliente.direccion[1]}"
+
+    def _elegir(self, excluir=()):
+        ahora = time.monotonic()
+        with self.lock:
+            candidatos = [c for c in self.clientes if c not in excluir and self.caido_hasta[c] <= ahora]
+            candidatos = candidatos or [c for c in self.clientes if c not in excluir]
+            if not candidatos:
+                return None
+            cliente = min(candidatos, key=lambda c: self.pendientes[c])
+            self.pendientes[cliente] += 1
+            return cliente
+
+    def sintetizar(self, texto: str, voz: str = VOZ_POR_DEFECTO, velocidad: float = VELOCIDAD_POR_DEFECTO):
+        """Como ClienteVoz.sintetizar, más el proceso que atendió: (clave, ruta, desde_cache, nombre)."""
+        clave = clave_audio(texto, voz, velocidad)
+        ruta = self.cache.buscar(clave)
+        if ruta:
+            with self.lock:
+                self.aciertos_cache += 1
+            return clave, ruta, True, "cache"
+        probados = []
+        while True:
+            cliente = self._elegir(probados)
+            if cliente is None:
+                raise ErrorVoz("ningún proceso de voz disponible")
+            t0 = time.perf_counter()
+            try:
+                clave, ruta, cacheado = cliente.sintetizar(texto, voz, velocidad)
+            except ErrorVoz:
+                with self.lock:
+                    self.stats[cliente]["errores"] += 1
+                    self.caido_hasta[cliente] = time.monotonic() + 10.0
+                probados.append(cliente)
+                continue
+            finally:
+                with self.lock:
+                    self.pendientes[cliente] -= 1
+            segundos = time.perf_counter() - t0
+            duracion = duracion_wav(ruta)
+            with self.lock:
+                st = self.stats[cliente]
+                st["sintesis"] += 1
+                if duracion and not cacheado:
+                    st["rtf"].append(segundos / duracion)
+            return clave, ruta, cacheado, self._nombre(cliente)
+
+    def registrar_ttfa(self, nombre: str, segundos: float):
+        with self.lock:
+            for c in self.clientes:
+                if self._nombre(c) == nombre:
+                    self.stats[c]["ttfa"].append(segundos)
+
+    def metricas(self) -> dict:
+        with self.lock:
+            return {
+                "aciertos_cache": self.aciertos_cache,
+                "procesos": {
+                    self._nombre(c): {
+                        "sintesis": st["sintesis"], "errores": st["errores"], "pendientes": self.pendientes[c],
+                        "rtf_p50": _percentil(st["rtf"], 0.5), "rtf_p95": _percentil(st["rtf"], 0.95),
+                        "primer_audio_p50": _percentil(st["ttfa"], 0.5), "primer_audio_p95": _percentil(st["ttfa"], 0.95),
+                    }
+                    for c, st in self.stats.items()
+                },
+            }
+
+
+# --------------------------
+# STREAMING POR FRASES
+# --------------------------
+_FIN_FRASE = re.compile(r"[.!?…:;](?=\s)|\n")
+
+
+class SegmentadorFrases:
+    """Acumula fragmentos de texto y devuelve frases completas en cuanto se cierran."""
+
+    def __init__(self, min_chars: int = 25, max_chars: int = 220, max_primera: int = 90):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        # La primera frase se corta antes (en una coma) para adelantar el primer audio
+        self.max_primera = max_primera
+        self.emitidas = 0
+        self.buffer = ""
+
+    def agregar(self, fragmento: str) -> list:
+        self.buffer += fragmento
+        frases = []
+        while True:
+            # Una frase muy corta ("Sí.") se junta con la siguiente: menos llamadas y mejor prosodia
+            maximo = self.max_primera if not self.emitidas else self.max_chars
+            m = _FIN_FRASE.search(self.buffer, max(0, self.min_chars - 1))
+            if m and m.end() <= maximo:
+                corte = m.end()
+            elif len(self.buffer) > maximo:
+                corte = self.buffer.rfind(", ", self.min_chars, maximo)
+                corte = corte + 1 if corte > 0 else self.buffer.rfind(" ", 0, maximo)
+                if corte <= 0:
+                    corte = maximo
+            else:
+                return frases
+            frase, self.buffer = self.buffer[:corte].strip(), self.buffer[corte:]
+            if frase:
+                frases.append(frase)
+                self.emitidas += 1
+
+    def cerrar(self) -> list:
+        resto, self.buffer = self.buffer.strip(), ""
+        return [resto] if resto else []
+
+
+def canalizar_voz(fragmentos, pool: PoolVoz, ejecutor, voz: str = VOZ_POR_DEFECTO,
+                  velocidad: float = VELOCIDAD_POR_DEFECTO):
+    """
+    Recorre los fragmentos del modelo y produce ("texto", fragmento) según llegan y
+    ("audio", {...}) por cada frase, en orden, en cuanto su síntesis termina. Las frases
+    se sintetizan en `ejecutor` mientras el modelo sigue generando.
+    """
+    t0 = time.perf_counter()
+    segmentador = SegmentadorFrases()
+    cola = deque()
+    estado = {"primero": True, "orden": 0}
+
+    def encolar(frases):
+        for frase in frases:
+            if texto_para_voz(frase):
+                cola.append((frase, ejecutor.submit(pool.sintetizar, frase, voz, velocidad)))
+
+    def listos(esperar: bool):
+        while cola and (esperar or cola[0][1].done()):
+            frase, futuro = cola.popleft()
+            try:
+                clave, ruta, cacheado, proceso = futuro.result()
+            except ErrorVoz as e:
+                logging.warning(f"⚠️ Frase sin audio ({e}): {frase[:40]}...")
+                continue
+            if estado["primero"]:
+                estado["primero"] = False
+                ttfa = time.perf_counter() - t0
+                pool.registrar_ttfa(proceso, ttfa)
+                logging.info(f"🔊 Primer audio: {ttfa:.2f}s ({proceso})")
+            estado["orden"] += 1
+            yield "audio", {"orden": estado["orden"], "frase": frase, "clave": clave, "ruta": ruta,
+                            "duracion": round(duracion_wav(ruta), 3), "cache": cacheado}
+
+    try:
+        for fragmento in fragmentos:
+            yield "texto", fragmento
+            encolar(segmentador.agregar(fragmento))
+            yield from listos(False)
+        encolar(segmentador.cerrar())
+        yield from listos(True)
+    finally:
+        for _, futuro in cola:
+            futuro.cancel()
+
+
+# --------------------------
+# CLI
+# --------------------------
+def prerender(motor: MotorMelo, cache: CacheAudio, voz: str, velocidad: float):
+    from chatbot import textos_estaticos
+    claves = []
+    for texto in textos_estaticos():
+        clave, _, cacheado = renderizar(motor, cache, texto, voz, velocidad)
+        claves.append(clave)
+        logging.info(f"{'💾' if cacheado else '🎙️'} {texto_para_voz(texto)[:60]}...")
+    cache.fijar(claves)
+    logging.info(f"✅ {len(claves)} textos fijos pre-renderizados en {cache.directorio}")
+
+
+def servir(direccion: str, directorio: str, dispositivo: str, hilos: int, voz: str, velocidad: float):
+    """Un proceso residente: carga el modelo y atiende su puerto."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    cache = CacheAudio(directorio)
+    motor = MotorMelo(dispositivo, hilos)
+    # Primera síntesis fuera del camino de las peticiones (compila kernels, calienta cachés)
+    renderizar(motor, cache, "Asistente SGSI listo.", voz, velocidad)
+    with ServidorVoz(_parsear_direccion(direccion), motor, cache) as servidor:
+        logging.info(f"🔊 Servicio de voz escuchando en {direccion}")
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio de voz residente (MeloTTS) con caché de audio")
+    parser.add_argument("accion", choices=("servir", "prerender"))
+    parser.add_argument("--direccion", default=DIRECCION_VOZ.split(",")[0])
+    parser.add_argument("--procesos", type=int, default=1, help="procesos con su propio modelo (puertos consecutivos)")
+    parser.add_argument("--directorio", default=DIR_AUDIO)
+    parser.add_argument("--dispositivo", default="cpu")
+    parser.add_argument("--hilos", type=int, default=6, help="hilos de torch en total, repartidos entre procesos")
+    parser.add_argument("--voz", default=VOZ_POR_DEFECTO)
+    parser.add_argument("--velocidad", type=float, default=VELOCIDAD_POR_DEFECTO)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if args.accion == "prerender":
+        prerender(MotorMelo(args.dispositivo, args.hilos), CacheAudio(args.directorio), args.voz, args.velocidad)
+        return
+    host, puerto = _parsear_direccion(args.direccion)
+    direcciones = [f"{host}:{puerto + i}" for i in range(max(1, args.procesos))]
+    hilos = max(1, args.hilos // len(direcciones))
+    if len(direcciones) == 1:
+        servir(direcciones[0], args.directorio, args.dispositivo, hilos, args.voz, args.velocidad)
+        return
+    logging.info(f"🔊 {len(direcciones)} procesos de voz · SGSI_VOZ={','.join(direcciones)}")
+    procesos = [
+        multiprocessing.Process(target=servir, name=f"voz-{d}",
+                                args=(d, args.directorio, args.dispositivo, hilos, args.voz, args.velocidad))
+        for d in direcciones
+    ]
+    for p in procesos:
+        p.start()
+    try:
+        for p in procesos:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procesos:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()